@@ -1,182 +1,237 @@
 import streamlit_shadcn_ui as ui
 import streamlit as st
-import streamlit_book as stb
-from openai import OpenAI
-from PyPDF2 import PdfReader
-import markdown
-from html2docx import html2docx
-from docx import Document
-import io
-import pdfkit  
+import random
+import uuid
 import warnings
+import metrics
+from dojo import CompiledQuiz, draw_quiz, keep_quiz, session_quiz
+from exporter import MAX_VARIANTS, export_exam, pdf_available
+from jobs import CANCELLED, FAILED, QUEUED, JobLimitError, job_queue
+from memory_cache import cached
+from pipeline import (
+    dojo_pregenerator, exam_questions, explanation_input, format_explanation,
+    get_psct_test_shard_response, get_test_shard_response, request_chat_response,
+    request_psct_chat_response, stream_chat_response, stream_psct_chat_response, test_pregenerator,
+    update_document_version,
+)
+from question_bank import pregen_worker, question_bank
+from questions import parse_questions, question_key
+from retrieval import build_context
+from streaming import STREAM_DOJO, StreamedQuiz
+from uploads import document_key, read_upload
 
 warnings.filterwarnings("ignore")
 
+# Questions shown per Dojo visit
+DOJO_PAGE_SIZE = 10
+# How often a running Test Mode job's progress is refreshed
+JOB_POLL_SECONDS = 1
 
-@st.cache_resource
-def read_pdf(file):
-    pdf_reader = PdfReader(file)
-    text = ""
-    for page_num in range(len(pdf_reader.pages)):
-        page = pdf_reader.pages[page_num]
-        text += page.extract_text()
-    return text
 
-@st.cache_resource
-def get_chat_response(user_query):
-    # openai.api_key = st.secrets["OpenAI_Key"]
-
-    OpenAI_Key = st.secrets["OpenAI_Key"]
-    client = OpenAI(api_key=OpenAI_Key)
+def record_document_version(file, doc_hash, text):
+    # A revised upload of a known SOP keeps its questions about unchanged sections
+    update_document_version(file.name, doc_hash, text)
 
-    message_text = [
-        #{"role": "system", "content": "You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this text and generate for 10 questions, 4 possible answers to each question, the correct answer's index( 0 to 3 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: Question1 | Choice1 | Choice2 | Choice3 | Choice4 | (example: 2 #For Choice 3 | (reason for option A being correct/or wrong if not the right answer) | (reason for option B being correct/or wrong if not the right answer) | (reason for option C being correct/or wrong if not the right answer) | (reason for option D being correct/or wrong if not the right answer),   An Example if option C is the right answer: Question1 - What is the colour of healthy grass | Red | Yellow | Blue | Green | 3 | Healthy grass isn't Red colour | Grass is only yellow if its diseased | Its impossible for grass to be blue in colour | Yes! Grass is indeed Green in colour |. Do not give me any other information other than this. STRICTLY follow this template I have specified. i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!"},
-        {"role": "user", "content": f"You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this text and generate for 10 questions, 4 possible answers to each question, the correct answer's index( 0 to 3 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: Question1 | Choice1 | Choice2 | Choice3 | Choice4 | (example: 2 #For Choice 3 | (reason for option A being correct/or wrong if not the right answer) | (reason for option B being correct/or wrong if not the right answer) | (reason for option C being correct/or wrong if not the right answer) | (reason for option D being correct/or wrong if not the right answer),   An Example if option C is the right answer: Question1 - What is the colour of healthy grass | Red | Yellow | Blue | Green | 3 | Healthy grass isn't Red colour | Grass is only yellow if its diseased | Its impossible for grass to be blue in colour | Yes! Grass is indeed Green in colour |. Do not give me any other information other than this. STRICTLY follow this template I have specified. i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!! Use full content of my SOP book: {user_query}" }
-    ]
-
-    completion = client.chat.completions.create(
-        model="o1-mini",
-        messages=message_text, 
-    )
+def trace_session():
+    # Names this session's trace file and tags its metrics events
+    if "trace_session" not in st.session_state:
+        st.session_state.trace_session = uuid.uuid4().hex[:12]
+    return st.session_state.trace_session
 
-    filtered_message = completion.choices[0].message.content
-
-    return filtered_message
+def context_seed():
+    # Same passages on every rerun of a session (so the response cache hits), different sections per session
+    if "context_seed" not in st.session_state:
+        st.session_state.context_seed = random.randrange(2**31)
+    return st.session_state.context_seed
 
+@cached("dojo_response", shared=True)
+def get_chat_response(user_query):
+    return request_chat_response(user_query)
 
-@st.cache_resource
+@cached("psct_dojo_response", shared=True)
 def get_psct_chat_response(user_query):
-    # openai.api_key = st.secrets["OpenAI_Key"]
-
-    OpenAI_Key = st.secrets["OpenAI_Key"]
-    client = OpenAI(api_key=OpenAI_Key)
-
-    message_text = [
-        {"role": "system", "content": "You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this question and answer and reasoning,  and generate for 10 PARAGRAPH LONG ELABORATE SCENARIO questions without ECG based on the similar questioning style as given information, 4 possible answers to each question, the correct answer's index( 0 to 3 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: Question1 | Choice1 | Choice2 | Choice3 | Choice4 | (example: 2 #For Choice 3 | (reason for option A being correct/or wrong if not the right answer) | (reason for option B being correct/or wrong if not the right answer) | (reason for option C being correct/or wrong if not the right answer) | (reason for option D being correct/or wrong if not the right answer),   An Example if option C is the right answer: Question1 - What is the colour of healthy grass | Red | Yellow | Blue | Green | 3 | Healthy grass isn't Red colour | Grass is only yellow if its diseased | Its impossible for grass to be blue in colour | Yes! Grass is indeed Green in colour |. Do not give me any other information other than this. STRICTLY follow this template I have specified. i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!"},
-        {"role": "user", "content": "generate interesting questions using full content of my SOP book: " + user_query}
-    ]
-
-    completion = client.chat.completions.create(
-        model="gpt-4",
-        messages=message_text,
-        temperature=0.4,
-        top_p=0.5,
-        frequency_penalty=0,
-        presence_penalty=0,
-    )
+    return request_psct_chat_response(user_query)
 
-    filtered_message = completion.choices[0].message.content
-
-    return filtered_message
-
-@st.cache_resource
+@cached("explanation", shared=True)
 def OpenAI_Filtering_Check(input):
+    return format_explanation(input)
 
-        OpenAI_Key = st.secrets["OpenAI_Key"]
-        client = OpenAI(api_key=OpenAI_Key)
-
-        message_text = [
-            {"role": "system", "content": "Take this input and Return this in a numbered bulletised format seperated by the \n key in between bullet points. Make sure no points that are given are the same. all must be unique. Omit if needed."},
-            {"role": "user", "content": input}
-        ]
-
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=message_text,
-            temperature=0.2,
-            top_p=0.95,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None
-        )
-
-        filtered_message = completion.choices[0].message.content
-
-        return filtered_message
-
-@st.cache_resource
+@cached("parse")
 def parse_questions_text(text):
-    questions = []
-    answer_options = []
-    correct_answer_index = []
-    reasons = []
-
-    for line in text.split("\n"):
-        if line.strip():
-            parts = line.split(" | ")
-            question = parts[0].strip()
-            options = [option.strip() for option in parts[1:5]]
-            correct_index = int(parts[5].strip()) - 1
-            reason = [option.strip() for option in parts[6:10]]
-
-            questions.append(question)
-            answer_options.append(options)
-            correct_answer_index.append(correct_index)
-            reasons.append(reason)
-
-    return questions, answer_options, correct_answer_index, reasons
-
-def generate_test_questions(question_quantity, pdf_text, option):
-    OpenAI_Key = st.secrets["OpenAI_Key"]
-    client = OpenAI(api_key=OpenAI_Key)
-
-    message_text = [
-        #{"role": "system", "content": "You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this text and generate for 10 questions, 4 possible answers to each question, the correct answer's index( 0 to 3 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: Question1 | Choice1 | Choice2 | Choice3 | Choice4 | (example: 2 #For Choice 3 | (reason for option A being correct/or wrong if not the right answer) | (reason for option B being correct/or wrong if not the right answer) | (reason for option C being correct/or wrong if not the right answer) | (reason for option D being correct/or wrong if not the right answer),   An Example if option C is the right answer: Question1 - What is the colour of healthy grass | Red | Yellow | Blue | Green | 3 | Healthy grass isn't Red colour | Grass is only yellow if its diseased | Its impossible for grass to be blue in colour | Yes! Grass is indeed Green in colour |. Do not give me any other information other than this. STRICTLY follow this template I have specified. i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!"},
-        {"role": "user", "content": f"You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice and always return them in neat formatted style. Understand this text and generate for me {question_quantity} {option} questions, 4 possible answers to each question first. Then return each question's correct answer index(1 to 4 as there are 4 options) and the reason why its correct. I want the Question, Choices and then Correct Answer Index and Reasons to be in this format: Question1 -(each option to have a checkbox for user to tick and be in numbered bulletised format) Choice1 Choice2  Choice3  Choice4. once questions are finished generating, then start with the answers. Answers - 1: A Reason: <its reason>, 2: B Reason: <its reason>, 3: D Reason: <its reason> and so on.  Do not give me any other information other than this. STRICTLY follow this template I have specified(list out all the questions first, then their answers in the specified format). i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!{pdf_text}" },    ]
-
-    completion = client.chat.completions.create(
-        model="o1-mini",
-        messages=message_text,
-    )
-
-    filtered_message = completion.choices[0].message.content
-
-    if not filtered_message:
-        st.error("Failed to generate questions.")
-    else:
-        st.success("Questions generated successfully.")
-
-    generate_docx(filtered_message)
-
-
-def generate_psct_test_questions(question_quantity, pdf_text, option):
-    OpenAI_Key = st.secrets["OpenAI_Key"]
-    client = OpenAI(api_key=OpenAI_Key)
-
-    message_text = [
-        #{"role": "system", "content": "You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this text and generate for 10 questions, 4 possible answers to each question, the correct answer's index( 0 to 3 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: Question1 | Choice1 | Choice2 | Choice3 | Choice4 | (example: 2 #For Choice 3 | (reason for option A being correct/or wrong if not the right answer) | (reason for option B being correct/or wrong if not the right answer) | (reason for option C being correct/or wrong if not the right answer) | (reason for option D being correct/or wrong if not the right answer),   An Example if option C is the right answer: Question1 - What is the colour of healthy grass | Red | Yellow | Blue | Green | 3 | Healthy grass isn't Red colour | Grass is only yellow if its diseased | Its impossible for grass to be blue in colour | Yes! Grass is indeed Green in colour |. Do not give me any other information other than this. STRICTLY follow this template I have specified. i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!"},
-        {"role": "user", "content": f"You are an expert Quiz Maker who makes ELABORATE quizes. You never give the same type of questions twice and always return them in neat formatted style. Understand this text(questions, the correct answer and their wrong answers) and generate for me {question_quantity} {option} questions IN THE SAME WAY THE QUESTIONS WERE ASKED, 4 possible answers to each question first. Then return each question's correct answer index(1 to 4 as there are 4 options) and the reason why its correct. I want the Question, Choices and then Correct Answer Index and Reasons to be in this format: Question1 -(each option to have a checkbox for user to tick and be in numbered bulletised format) Choice1 Choice2  Choice3  Choice4. once questions are finished generating, then start with the answers. Answers - 1: A Reason: <its reason>, 2: B Reason: <its reason>, 3: D Reason: <its reason> and so on.  Do not give me any other information other than this. STRICTLY follow this template I have specified(list out all the questions first, then their answers in the specified format). i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!{pdf_text}" },    ]
-
-    completion = client.chat.completions.create(
-        model="o1-mini",
-        messages=message_text,
-    )
+    # JSON objects or " | " lines, whichever the response holds; malformed questions are dropped
+    return parse_questions(text, " | ")
+
+def unique_dojo_page(bank_key, questions):
+    # Checked once per session and page: on a rerun the page's own questions are already in the index
+    pages = st.session_state.setdefault("unique_pages", {})
+    page_key = (bank_key, tuple(question_key(question) for question in questions))
+    if page_key not in pages:
+        unique = question_bank.unique(*bank_key, questions)
+        # Repeats of earlier visits are replaced from the pre-generated stock rather than by another model call
+        if len(unique) < len(questions):
+            unique += question_bank.take(*bank_key, len(questions) - len(unique))
+        # Nothing new at all: better to show the repeats than an empty page
+        pages[page_key] = unique or questions
+    return pages[page_key]
+
+def new_dojo_quiz(uploaded_file, bank_key, model, stream_fn, response_fn):
+    """A Dojo page from the bank's pre-generated questions if it has enough, otherwise from the model."""
+    # Read text from uploaded PDF file
+    pdf_text = read_upload(uploaded_file, on_read=record_document_version)
+    mode = bank_key[1]
+    pregen_worker.register(*bank_key, dojo_pregenerator(mode, pdf_text))
+
+    banked_page = banked_dojo_page(bank_key)
+    if banked_page:
+        # Pre-generated questions from the bank, no model call needed
+        return CompiledQuiz(banked_page, OpenAI_Filtering_Check, explanation_input)
+
+    # Only a token-budgeted selection of SOP passages goes into the prompt
+    with metrics.stage("prompt"):
+        context = build_context(pdf_text, model, seed=context_seed())
+    if STREAM_DOJO:
+        # Repeats of earlier visits are skipped as they stream in, and made up for from the pre-generated stock
+        return StreamedQuiz(
+            lambda: stream_fn(context), " | ", OpenAI_Filtering_Check, explanation_input,
+            expected=DOJO_PAGE_SIZE, top_up=lambda missing: question_bank.take(*bank_key, missing), max_top_ups=1,
+            accept=lambda question: bool(question_bank.unique(*bank_key, [question])),
+        )
 
-    filtered_message = completion.choices[0].message.content
+    with metrics.stage("dojo_generate", model=model):
+        response_message = response_fn(context)
+    metrics.trace("dojo_response", text=response_message)
+    with metrics.stage("parse"):
+        questions = parse_questions_text(response_message)
+    questions = unique_dojo_page(bank_key, questions)
+    bank_served_questions(bank_key, questions)
+    return CompiledQuiz(questions, OpenAI_Filtering_Check, explanation_input)
+
+def render_dojo(uploaded_file, mode, model, stream_fn, response_fn):
+    bank_key = (document_key(uploaded_file), mode, "Dojo")
+    # Built on the first run for this tab and upload; later reruns only draw it
+    quiz = session_quiz(bank_key)
+    if quiz is None:
+        quiz = keep_quiz(bank_key, new_dojo_quiz(uploaded_file, bank_key, model, stream_fn, response_fn))
+    draw_quiz(quiz)
+
+    if not isinstance(quiz, StreamedQuiz):
+        return
+    if quiz.error and not quiz.questions:
+        st.error("Failed to generate questions. Please try again.")
+    elif quiz.done and not quiz.questions:
+        st.info("Every question generated this time repeated one you have already seen. Please try again.")
+    elif quiz.done:
+        bank_served_questions(bank_key, quiz.questions)
+
+def bank_served_questions(bank_key, questions):
+    # Live-generated questions go into the bank as already served, once per session
+    banked = st.session_state.setdefault("banked_pages", set())
+    if bank_key not in banked:
+        question_bank.add(*bank_key, questions, served=True)
+        banked.add(bank_key)
+
+def banked_dojo_page(bank_key):
+    """A full page of unseen pre-generated questions for this session, or None if the bank is short."""
+    pages = st.session_state.setdefault("bank_pages", {})
+    if bank_key not in pages:
+        pages[bank_key] = None
+        if question_bank.stock(*bank_key) >= DOJO_PAGE_SIZE:
+            pages[bank_key] = question_bank.take(*bank_key, DOJO_PAGE_SIZE) or None
+    return pages[bank_key]
+
+def exam_job(quantity, pdf_text, option, doc_hash, mode, shard_response, variants, formats):
+    # Runs on a job worker thread, so it reports through the job instead of Streamlit widgets
+    def run(job):
+        def on_progress(done, total):
+            job.set_progress(done / total, f"{done}/{total} shards done")
+
+        questions = exam_questions(quantity, pdf_text, option, doc_hash, mode, shard_response,
+                                   on_progress=on_progress, should_stop=job.cancel_requested)
+        job.check_cancelled()
+        if not questions:
+            raise RuntimeError("Failed to generate questions.")
+        job.set_progress(1.0, "Exporting...")
+        file_name, mime, data = export_exam(questions, f"{mode} Exam ({option})", variants, formats, seed=job.id)
+        return {"questions": len(questions), "requested": quantity, "file_name": file_name, "mime": mime, "data": data}
+    return run
+
+def generate_exam(question_quantity, pdf_text, option, doc_hash, mode, shard_response, variants=1, formats=("docx",)):
+    quantity = int(question_quantity)
+    if "pdf" in formats and not pdf_available():
+        st.error("PDF export needs wkhtmltopdf installed on the server.")
+        return
+    # Keep this difficulty stocked for the next exam on the same book
+    pregen_worker.register(doc_hash, mode, option, test_pregenerator(pdf_text, option, shard_response))
+
+    try:
+        job = job_queue.submit(trace_session(), exam_job(quantity, pdf_text, option, doc_hash, mode, shard_response, variants, formats),
+                               description=f"{mode} exam, {quantity} {option} questions")
+    except JobLimitError as e:
+        st.warning(str(e))
+        return
+    # The job object itself is kept, so its progress and export survive reruns (and outlive the queue's retention)
+    st.session_state.setdefault("exam_jobs", {})[mode] = job
+    # A session that reconnects to another replica (or a reloaded page) finds the job again by this
+    st.query_params[job_url_param(mode)] = job.id
+
+def job_url_param(mode):
+    return f"{mode.lower()}_job"
+
+def render_exam_job(mode):
+    jobs = st.session_state.setdefault("exam_jobs", {})
+    job = jobs.get(mode)
+    if job is None:
+        job_id = st.query_params.get(job_url_param(mode))
+        job = job_queue.get(job_id) if job_id else None
+        if job is None:
+            return
+    job = jobs[mode] = job_queue.latest(job)
+    polling = job.active
+
+    @st.fragment(run_every=JOB_POLL_SECONDS if polling else None)
+    def exam_job_status():
+        # A local job is updated in place; another replica's is read again on each poll
+        job = job_queue.latest(jobs[mode])
+        if job.active:
+            if job.state == QUEUED:
+                text = f"Waiting for a free worker ({job_queue.queued_ahead(job)} ahead)..."
+            else:
+                text = "Cancelling..." if job.cancel_requested() else job.message
+            st.progress(job.progress, text=text)
+            st.button("Cancel", key=f"cancel_job_{mode}", on_click=job_queue.cancel, args=(job.id,),
+                      disabled=job.cancel_requested())
+        elif polling:
+            # Finished since the last poll: rerun the page so this fragment stops polling
+            st.rerun()
+        elif job.state == CANCELLED:
+            st.info("Generation cancelled.")
+        elif job.state == FAILED:
+            st.error(job.message)
+        else:
+            if job.result["questions"] < job.result["requested"]:
+                st.warning(f"Only {job.result['questions']} of {job.result['requested']} questions could be generated.")
+            else:
+                st.success("Questions generated successfully.")
+            generate_download(job.result, key=f"download_{mode}")
 
-    if not filtered_message:
-        st.error("Failed to generate questions.")
-    else:
-        st.success("Questions generated successfully.")
+    exam_job_status()
 
-    generate_docx(filtered_message)
+def generate_test_questions(question_quantity, pdf_text, option, doc_hash, variants=1, formats=("docx",)):
+    generate_exam(question_quantity, pdf_text, option, doc_hash, "EMT", get_test_shard_response, variants, formats)
 
 
-def generate_docx(text):
-    doc = Document()
-    doc.add_paragraph(text)
+def generate_psct_test_questions(question_quantity, pdf_text, option, doc_hash, variants=1, formats=("docx",)):
+    generate_exam(question_quantity, pdf_text, option, doc_hash, "PSCT", get_psct_test_shard_response, variants, formats)
 
-    # Save the docx file in a BytesIO object
-    file_stream = io.BytesIO()
-    doc.save(file_stream)
-    file_stream.seek(0)
 
+def generate_download(result, key=None):
     # Generate download button
     st.download_button(
-        label="Download .docx",
-        data=file_stream,
-        file_name="output.docx",
-        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        label=f"Download {result['file_name']}",
+        data=result["data"],
+        file_name=result["file_name"],
+        mime=result["mime"],
+        key=key,
     )
 
 
@@ -203,6 +258,9 @@ uploaded_file = st.file_uploader("Upload PDF or DOCX", type=["pdf", "docx", "ppt
 st.divider()
 
 # Create the tabs with two options: 'Page 1' and 'Page 2'
+metrics.start_server()
+metrics.set_session(trace_session())
+
 selected_tab = ui.tabs(options=["EMT Training Dojo", "PSCT Training Dojo", "EMT Test Mode","PSCT Test Mode"], default_value='EMT Training Dojo', key="main_tabs")
 
 
@@ -211,55 +269,11 @@ if uploaded_file is not None:
 
 
     if selected_tab == 'EMT Training Dojo':
-        # Read text from uploaded PDF file
-        pdf_text = read_pdf(uploaded_file)
-        # Pass the extracted text to the get_chat_response function
-        response_message = get_chat_response(pdf_text)
-        print(response_message)
-
-        questions, answer_options, correct_answer_index, reasons = parse_questions_text(response_message)
-
-        for i in range(len(questions)):
-            def check_answer(selected_option):
-                if selected_option == correct_answer_index[i] + 1:
-                    return f"{reasons[i][correct_answer_index[i]]} | {reasons[i][0]} | {reasons[i][1]} | {reasons[i][2]} | {reasons[i][3]}"
-                else:
-                    return f"Option {selected_option}: {reasons[i][selected_option - 1]}"
-
-            stb.single_choice(
-                questions[i],
-                answer_options[i],
-                correct_answer_index[i] + 1,
-                success=OpenAI_Filtering_Check(check_answer(correct_answer_index[i] + 1)),
-                error='''Wrong Answer 😒 \n Please try again''',
-                button="Check answer"
-            )
+        render_dojo(uploaded_file, "EMT", "o1-mini", stream_chat_response, get_chat_response)
 
 
     elif selected_tab == 'PSCT Training Dojo':
-        # Read text from uploaded PDF file
-        pdf_text = read_pdf(uploaded_file)
-        # Pass the extracted text to the get_chat_response function 
-        response_message = get_psct_chat_response(pdf_text)
-        print(response_message)
-
-        questions, answer_options, correct_answer_index, reasons = parse_questions_text(response_message)
-
-        for i in range(len(questions)):
-            def check_answer(selected_option):
-                if selected_option == correct_answer_index[i] + 1:
-                    return f"{reasons[i][correct_answer_index[i]]} | {reasons[i][0]} | {reasons[i][1]} | {reasons[i][2]} | {reasons[i][3]}"
-                else:
-                    return f"Option {selected_option}: {reasons[i][selected_option - 1]}"
-
-            stb.single_choice(
-                questions[i],
-                answer_options[i],
-                correct_answer_index[i] + 1,
-                success=OpenAI_Filtering_Check(check_answer(correct_answer_index[i] + 1)),
-                error='''Wrong Answer 😒 \n Please try again''',
-                button="Check answer"
-            )
+        render_dojo(uploaded_file, "PSCT", "gpt-4", stream_psct_chat_response, get_psct_chat_response)
 
 
     elif selected_tab == 'EMT Test Mode':
@@ -271,20 +285,28 @@ if uploaded_file is not None:
         )
 
         st.write("You selected:", option)
+        variants = st.number_input("**Candidate variants**", min_value=1, max_value=MAX_VARIANTS, value=1, key="exam_variants",
+                                   help="Each variant shuffles the questions and options and gets its own answer key")
+        formats = st.multiselect("**Export as**", ["DOCX", "PDF"], default=["DOCX"], key="exam_formats")
         generate_button_clicked = st.button("Generate", key="generate_button")
 
         # Logic to handle button click and check input value
         if generate_button_clicked:
-            # Check if the input value is not empty
-            if question_quantity and question_quantity.strip() != "":
+            # Check if the input value is a positive number
+            if not formats:
+                st.write("Please choose at least one export format.")
+            elif question_quantity and question_quantity.strip().isdigit() and int(question_quantity) > 0:
                 st.write(f"Number of questions to generate: {question_quantity}")
-                pdf_text = read_pdf(uploaded_file)
-                generate_test_questions(question_quantity, pdf_text, option)
+                pdf_text = read_upload(uploaded_file, on_read=record_document_version)
+                generate_test_questions(question_quantity, pdf_text, option, document_key(uploaded_file),
+                                         int(variants), [f.lower() for f in formats])
 
 
             else:
                 st.write("Please enter a valid number.")
 
+        render_exam_job("EMT")
+
 
 
     elif selected_tab == 'PSCT Test Mode':
@@ -296,16 +318,24 @@ if uploaded_file is not None:
         )
 
         st.write("You selected:", option)
+        variants = st.number_input("**Candidate variants**", min_value=1, max_value=MAX_VARIANTS, value=1, key="exam_variants",
+                                   help="Each variant shuffles the questions and options and gets its own answer key")
+        formats = st.multiselect("**Export as**", ["DOCX", "PDF"], default=["DOCX"], key="exam_formats")
         generate_button_clicked = st.button("Generate", key="generate_button")
 
         # Logic to handle button click and check input value
         if generate_button_clicked:
-            # Check if the input value is not empty
-            if question_quantity and question_quantity.strip() != "":
+            # Check if the input value is a positive number
+            if not formats:
+                st.write("Please choose at least one export format.")
+            elif question_quantity and question_quantity.strip().isdigit() and int(question_quantity) > 0:
                 st.write(f"Number of questions to generate: {question_quantity}")
-                pdf_text = read_pdf(uploaded_file)
-                generate_psct_test_questions(question_quantity, pdf_text, option)
+                pdf_text = read_upload(uploaded_file, on_read=record_document_version)
+                generate_psct_test_questions(question_quantity, pdf_text, option, document_key(uploaded_file),
+                                              int(variants), [f.lower() for f in formats])
 
 
             else:
                 st.write("Please enter a valid number.")
+
+        render_exam_job("PSCT")
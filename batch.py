@@ -0,0 +1,244 @@
+"""
+Prepares Test Mode exams for a whole folder of SOPs without the Streamlit UI.
+
+Every supported document (PDF, DOCX, PPTX) in the folder gets one exam per
+mode and difficulty, written to the output folder as
+<document>-<hash>/<mode>-<difficulty>/: questions.jsonl with the questions
+(the JSON question format), the exported exam, and done.json once the exam
+is complete. Extraction, generation, de-duplication and export are the
+same functions the app uses, and so are the extraction cache and the
+question bank: questions the bank already holds for a document are used
+before new ones are generated. An exam that comes up short is exported
+anyway and topped up on the next run.
+
+Documents are processed on a thread pool; every model call still goes
+through the process-wide rate-limit scheduler, so the pool size only decides
+how many documents share it at once. questions.jsonl is appended after every
+batch of --checkpoint-every questions, so an interrupted run (Ctrl-C, a
+crash, a reboot) picks up where it stopped when started again with the same
+arguments, and finished exams are skipped.
+
+Run from the repo root:
+    python batch.py sops/ exams/ --questions 100 --modes EMT --difficulties Easy,Moderate
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from exporter import FORMATS, MAX_VARIANTS, export_exam, pdf_available
+from extractors import EXTRACTORS, document_kind
+from llm_client import scheduler
+from pipeline import exam_questions, read_document, test_shard_response_fn
+from question_bank import document_hash
+from questions import QuestionJSON
+
+MODES = ("EMT", "PSCT")
+DIFFICULTIES = ("Easy", "Moderate", "Difficulty")
+
+# Held while questions.jsonl is appended, so a second Ctrl-C never quits in the middle of a write
+_checkpoint_lock = threading.Lock()
+
+
+def find_documents(folder, recursive=False):
+    """Paths of the supported documents in folder, sorted, skipping hidden files."""
+    found = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".")) if recursive else []
+        for name in files:
+            if not name.startswith(".") and os.path.splitext(name)[1].lower().lstrip(".") in EXTRACTORS:
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+
+def _write_atomic(path, data):
+    # A reader (or the next run) sees the old file or the new one, never half of one
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    """The questions saved so far; a line torn by an interruption is dropped and the file rewritten without it."""
+    if not os.path.exists(path):
+        return []
+    questions = []
+    torn = False
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                questions.append(QuestionJSON(**json.loads(line)).to_question())
+            except ValueError:
+                torn = True
+    if torn:
+        _write_atomic(path, "".join(_checkpoint_line(q) for q in questions).encode("utf-8"))
+    return questions
+
+
+def _checkpoint_line(question):
+    return QuestionJSON.from_question(question).model_dump_json() + "\n"
+
+
+def append_checkpoint(path, questions):
+    with _checkpoint_lock, open(path, "a", encoding="utf-8") as f:
+        f.write("".join(_checkpoint_line(q) for q in questions))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _quit_now(pool):
+    # Leaving the with block would wait for every running document, so the process ends here
+    pool.shutdown(wait=False, cancel_futures=True)
+    with _checkpoint_lock:
+        print("Quit; questions up to the last checkpoint are kept, run the same command again to resume")
+        sys.stdout.flush()
+        os._exit(130)
+
+
+def prepare_exam(name, doc_hash, text, out_dir, mode, difficulty, args, stop):
+    """Generates (or finishes) and exports one exam; returns (status, generated)."""
+    os.makedirs(out_dir, exist_ok=True)
+    settings = {"questions": args.questions, "variants": args.variants, "formats": args.formats}
+    done_path = os.path.join(out_dir, "done.json")
+    if os.path.exists(done_path):
+        with open(done_path, encoding="utf-8") as f:
+            done = json.load(f)
+        if done.get("settings") == settings:
+            return "done earlier", done["generated"]
+
+    checkpoint = os.path.join(out_dir, "questions.jsonl")
+    questions = load_checkpoint(checkpoint)
+    while len(questions) < args.questions and not stop.is_set():
+        wanted = min(args.checkpoint_every, args.questions - len(questions))
+        batch = exam_questions(wanted, text, difficulty, doc_hash, mode, test_shard_response_fn(mode),
+                               should_stop=stop.is_set)
+        if stop.is_set():
+            # exam_questions() left what this batch generated unserved in the bank, so the next run takes it from there
+            break
+        if not batch:
+            break
+        append_checkpoint(checkpoint, batch)
+        questions += batch
+        print(f"[{name}] {mode}/{difficulty}: {len(questions)} of {args.questions} questions")
+    if stop.is_set():
+        return "interrupted", len(questions)
+    if not questions:
+        return "no questions", 0
+
+    title = f"{os.path.splitext(name)[0]} - {mode} Exam ({difficulty})"
+    file_name, _, data = export_exam(questions, title, args.variants, args.formats, seed=doc_hash)
+    _write_atomic(os.path.join(out_dir, file_name), data)
+    if len(questions) < args.questions:
+        # Exported as it is, but not marked done: the next run tries to top it up
+        return "short, run again to top up", len(questions)
+    done = {"document": name, "doc_hash": doc_hash, "mode": mode, "difficulty": difficulty, "settings": settings,
+            "generated": len(questions), "file": file_name, "finished_at": time.time()}
+    _write_atomic(done_path, json.dumps(done, indent=2).encode("utf-8"))
+    return "done", len(questions)
+
+
+def process_document(path, args, stop):
+    """Every requested exam for one document; returns [(mode, difficulty, status, generated)]."""
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    doc_hash = document_hash(data)
+    text = read_document(data, document_kind(name, data))
+    doc_dir = os.path.join(args.output, f"{os.path.splitext(name)[0]}-{doc_hash[:8]}")
+    results = []
+    for mode in args.modes:
+        for difficulty in args.difficulties:
+            if stop.is_set():
+                results.append((mode, difficulty, "interrupted", 0))
+                continue
+            out_dir = os.path.join(doc_dir, f"{mode}-{difficulty}")
+            results.append((mode, difficulty, *prepare_exam(name, doc_hash, text, out_dir, mode, difficulty, args, stop)))
+    return results
+
+
+def limit_rate(rpm=None, tpm=None):
+    """Caps every model's requests and tokens per minute, e.g. to leave room for the app on the same API key."""
+    for model, (model_rpm, model_tpm) in list(scheduler.limits.items()):
+        scheduler.limits[model] = (min(model_rpm, rpm or model_rpm), min(model_tpm, tpm or model_tpm))
+
+
+def _choices(allowed):
+    def parse(value):
+        chosen = [v.strip() for v in value.split(",") if v.strip()]
+        unknown = [v for v in chosen if v not in allowed]
+        if unknown or not chosen:
+            raise argparse.ArgumentTypeError(f"choose from {', '.join(allowed)}")
+        return chosen
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="folder of SOP documents")
+    parser.add_argument("output", help="folder for the question sets and exams")
+    parser.add_argument("--questions", type=int, default=50, help="questions per exam")
+    parser.add_argument("--modes", type=_choices(MODES), default=["EMT"], help="comma-separated: EMT,PSCT")
+    parser.add_argument("--difficulties", type=_choices(DIFFICULTIES), default=["Easy"],
+                        help="comma-separated: Easy,Moderate,Difficulty")
+    parser.add_argument("--variants", type=int, default=1, help=f"candidate variants per exam (1-{MAX_VARIANTS})")
+    parser.add_argument("--formats", type=_choices(FORMATS), default=["docx"], help="comma-separated: docx,pdf")
+    parser.add_argument("--workers", type=int, default=2, help="documents processed at once")
+    parser.add_argument("--checkpoint-every", type=int, default=50, help="questions generated between checkpoints")
+    parser.add_argument("--rpm", type=int, help="requests per minute cap for every model")
+    parser.add_argument("--tpm", type=int, help="tokens per minute cap for every model")
+    parser.add_argument("--recursive", action="store_true", help="include subfolders")
+    args = parser.parse_args(argv)
+    if args.questions < 1 or args.checkpoint_every < 1 or args.workers < 1:
+        parser.error("--questions, --checkpoint-every and --workers must be positive")
+    if not 1 <= args.variants <= MAX_VARIANTS:
+        parser.error(f"--variants must be between 1 and {MAX_VARIANTS}")
+    if "pdf" in args.formats and not pdf_available():
+        parser.error("PDF export needs wkhtmltopdf installed")
+
+    documents = find_documents(args.input, args.recursive)
+    if not documents:
+        print(f"No PDF, DOCX or PPTX files in {args.input}")
+        return 1
+    limit_rate(args.rpm, args.tpm)
+    os.makedirs(args.output, exist_ok=True)
+    print(f"{len(documents)} documents, {len(args.modes) * len(args.difficulties)} exams each, "
+          f"{args.workers} at a time")
+
+    stop = threading.Event()
+    failed = False
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="sara-batch") as pool:
+        futures = {pool.submit(process_document, path, args, stop): path for path in documents}
+        pending = set(futures)
+        while pending:
+            try:
+                # Waits in short steps so Ctrl-C reaches the main thread
+                finished, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                if stop.is_set():
+                    _quit_now(pool)
+                print("Stopping: finishing the batches in flight, Ctrl-C again to quit now")
+                stop.set()
+                continue
+            for future in finished:
+                name = os.path.basename(futures[future])
+                try:
+                    for mode, difficulty, status, generated in future.result():
+                        print(f"[{name}] {mode}/{difficulty}: {status} ({generated} of {args.questions} questions)")
+                except Exception as e:
+                    # One unreadable document or failing exam doesn't stop the rest of the batch
+                    failed = True
+                    print(f"[{name}] failed: {e}")
+    if stop.is_set():
+        print("Interrupted; run the same command again to resume")
+        return 130
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
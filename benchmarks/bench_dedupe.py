@@ -0,0 +1,108 @@
+"""
+Near-duplicate index: lookup latency as it grows, and what it catches.
+
+Fills a DuplicateIndex with synthetic SOP-style questions (words drawn with
+a Zipf-like skew, so common words are shared the way they are in real
+questions) and times is_duplicate() lookups at each size. Recall is measured
+on reworded copies of indexed questions (a stem word replaced, one
+inserted, options shuffled, numbering added); false positives on new
+questions that were never indexed. Last, short questions that differ in
+one word and share an option set ("Which drug is given for asthma?" and
+"...for anaphylaxis?") are added to an empty index; all should be kept.
+
+Run from the repo root:
+    python -m benchmarks.bench_dedupe --sizes 1000,10000,50000
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf_extract import WORDS  # noqa: E402
+from dedupe import DUPLICATE_SIMILARITY, OPTION_SIMILARITY, DuplicateIndex  # noqa: E402
+from questions import Question  # noqa: E402
+
+SYLLABLES = "ka ri to mu se na lo vi de pa shu ge bo ti ran el"
+STEMS = ("What is the", "Which of the following", "When should the", "Why must the", "How does the")
+DRUGS = ["Adrenaline", "Aspirin", "Salbutamol", "GTN"]
+CONDITIONS = ("anaphylaxis", "asthma", "chest pain", "a heart attack", "an angina attack", "wheezing")
+
+
+def make_vocabulary(size, rng):
+    syllables = SYLLABLES.split()
+    words = set(WORDS)
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    # Cumulative, so random.choices() doesn't sum them up again on every call
+    return words, list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+
+def make_question(rng, vocabulary, weights):
+    words = rng.choices(vocabulary, cum_weights=weights, k=10)
+    options = [" ".join(rng.choices(vocabulary, cum_weights=weights, k=rng.randint(1, 4))) for _ in range(4)]
+    return Question(question=f"{rng.choice(STEMS)} {' '.join(words)}?", options=options, correct_index=0,
+                    reasons=["" for _ in options])
+
+
+def reword(question, rng, vocabulary, weights):
+    words = question.question.rstrip("?").split()
+    words[rng.randrange(3, len(words))] = rng.choices(vocabulary, cum_weights=weights)[0]
+    words.insert(rng.randrange(3, len(words)), rng.choices(vocabulary, cum_weights=weights)[0])
+    options = list(question.options)
+    rng.shuffle(options)
+    return Question(question=f"Question {rng.randint(1, 30)} - {' '.join(words)}?", options=options,
+                    correct_index=0, reasons=question.reasons)
+
+
+def percentile(values, share):
+    return sorted(values)[min(len(values) - 1, int(share * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000", help="comma-separated index sizes")
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocabulary, weights = make_vocabulary(args.vocabulary, rng)
+    index = DuplicateIndex()
+    indexed = []
+    print(f"similarity threshold {DUPLICATE_SIMILARITY} (options {OPTION_SIMILARITY})")
+    print(f"{'indexed':>8} {'add us':>7} {'p50 lookup us':>14} {'p99 lookup us':>14} {'recall':>7} {'false pos':>10}")
+    for size in sorted(int(n) for n in args.sizes.split(",")):
+        batch = [make_question(rng, vocabulary, weights) for _ in range(size - len(indexed))]
+        start = time.perf_counter()
+        index.extend(batch)
+        add_us = (time.perf_counter() - start) * 1e6 / max(1, len(batch))
+        indexed += batch
+
+        times = []
+        caught = 0
+        for _ in range(args.lookups):
+            copy = reword(rng.choice(indexed), rng, vocabulary, weights)
+            start = time.perf_counter()
+            caught += index.is_duplicate(copy)
+            times.append((time.perf_counter() - start) * 1e6)
+        false = sum(index.is_duplicate(make_question(rng, vocabulary, weights)) for _ in range(args.lookups))
+        print(f"{len(indexed):>8} {add_us:>7.0f} {percentile(times, 0.5):>14.0f} {percentile(times, 0.99):>14.0f} "
+              f"{caught / args.lookups:>7.1%} {false / args.lookups:>10.2%}")
+
+    shared_options = DuplicateIndex()
+    kept = shared_options.filter([
+        Question(question=f"Which drug is given for {condition}?", options=DRUGS, correct_index=0,
+                 reasons=["" for _ in DRUGS])
+        for condition in CONDITIONS
+    ])
+    print(f"\nshort questions over one option set: {len(kept)}/{len(CONDITIONS)} kept")
+
+
+if __name__ == "__main__":
+    main()
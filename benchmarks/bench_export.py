@@ -0,0 +1,57 @@
+"""
+Times the exam exporter as the number of questions and candidate variants grows.
+
+Each row is one export_exam() call over the recorded fixture questions,
+repeated to the requested size. Time per question should stay flat as the
+exam grows; PDF rows are skipped when wkhtmltopdf isn't installed.
+
+Run from the repo root:
+    python -m benchmarks.bench_export --questions 50,200,500 --variants 1,10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exporter import export_exam, pdf_available  # noqa: E402
+from questions import QuestionJSON  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "questions.jsonl")
+
+
+def load_questions(count):
+    with open(FIXTURE, encoding="utf-8") as f:
+        recorded = [QuestionJSON(**json.loads(line)).to_question() for line in f if line.strip()]
+    return [recorded[i % len(recorded)] for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default="50,200,500", help="comma-separated exam sizes")
+    parser.add_argument("--variants", default="1,10", help="comma-separated variant counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    formats = [("docx",)] + ([("pdf",), ("docx", "pdf")] if pdf_available() else [])
+    if not pdf_available():
+        print("wkhtmltopdf not found, timing .docx only")
+    print(f"{'questions':>9} {'variants':>8} {'formats':<9} {'seconds':>8} {'ms/question/variant':>20} {'KiB':>8}")
+    for count in [int(n) for n in args.questions.split(",")]:
+        questions = load_questions(count)
+        for variants in [int(n) for n in args.variants.split(",")]:
+            for fmt in formats:
+                times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    _, _, data = export_exam(questions, "Benchmark Exam", variants, fmt, seed=0)
+                    times.append(time.perf_counter() - start)
+                best = min(times)
+                print(f"{count:>9} {variants:>8} {'+'.join(fmt):<9} {best:>8.2f} "
+                      f"{best * 1000 / (count * variants):>20.2f} {len(data) / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
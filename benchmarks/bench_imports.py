@@ -0,0 +1,78 @@
+"""
+Measures what the app scripts pay for their imports.
+
+cold start: a fresh interpreter running only the script's top-level import
+statements, the way the first Streamlit session of a server starts.
+per rerun: the same statements executed again in a warm process, which is
+what every widget interaction costs. The libraries the extractors and the
+exporter now import on first use are timed on their own, cold, to show what
+a script that imported them eagerly would add.
+
+Run from the repo root:
+    python -m benchmarks.bench_imports --repeat 5
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ("app.py", "sara_int.py")
+DEFERRED = ("PyPDF2", "docx", "lxml.etree", "pdfkit", "markdown", "html2docx")
+
+_TIMER = "import time\n_start = time.perf_counter()\n{code}\nprint(time.perf_counter() - _start)\n"
+
+
+def script_imports(path):
+    """The script's module-level import statements as source."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def cold_seconds(code, repeat):
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", _TIMER.format(code=code)], cwd=ROOT,
+                                capture_output=True, text=True, check=True)
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def warm_seconds(code, rounds=200):
+    compiled = compile(code, "<imports>", "exec")
+    exec(compiled, {})
+    start = time.perf_counter()
+    for _ in range(rounds):
+        exec(compiled, {})
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="cold starts per measurement (best is reported)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    # The Streamlit component packages warn about the missing script context when imported outside `streamlit run`
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+    print(f"{'imports of':<22} {'cold start ms':>14} {'per rerun us':>13}")
+    for script in SCRIPTS:
+        code = script_imports(os.path.join(ROOT, script))
+        print(f"{script:<22} {cold_seconds(code, args.repeat) * 1000:>14.0f} {warm_seconds(code) * 1e6:>13.1f}")
+
+    print("\ndeferred to first use (cold, on top of a bare interpreter):")
+    for module in DEFERRED:
+        try:
+            seconds = cold_seconds(f"import {module}", args.repeat)
+        except subprocess.CalledProcessError:
+            print(f"  {module:<20} not installed")
+            continue
+        print(f"  {module:<20} {seconds * 1000:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
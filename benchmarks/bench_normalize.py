@@ -0,0 +1,90 @@
+"""
+What text normalization saves on an SOP-shaped PDF.
+
+Builds a manual with a table of contents, a running header and a
+classification line on every page, "Page N of M" footers and words
+hyphenated across line breaks, then compares the raw extracted text with
+the normalized text: size, estimated tokens, how many context budgets each
+model needs to see the whole document, and whether any body text was lost.
+
+Run from the repo root:
+    python -m benchmarks.bench_normalize --pages 300
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf_extract import WORDS, pdf_from_lines  # noqa: E402
+from normalize import normalize_pages  # noqa: E402
+from pdf_extract import iter_pages  # noqa: E402
+from retrieval import CONTEXT_TOKEN_BUDGETS, estimate_tokens  # noqa: E402
+
+HEADER = "SCDF Emergency Medical Services - Standard Operating Procedures EMS-04 Rev 3"
+CLASSIFICATION = "RESTRICTED"
+LONG_WORDS = ("resuscitation", "defibrillator", "decontamination", "immobilisation", "haemorrhage")
+
+
+def make_sop(pages, lines_per_page=40, seed=0):
+    """Returns (pdf bytes, body words in reading order)."""
+    rng = random.Random(seed)
+    body = []
+    page_lines = [["Table of Contents"]]
+    for chapter in range(1, 30):
+        page_lines[0].append(f"{chapter}. {rng.choice(WORDS).title()} {rng.choice(WORDS)} " + "." * 40 + f" {chapter * 3}")
+    for page_num in range(1, pages):
+        lines = [HEADER, CLASSIFICATION]
+        for _ in range(lines_per_page):
+            words = [rng.choice(WORDS) for _ in range(11)]
+            if rng.random() < 0.2:
+                # A long word broken over the line end, continued on the next line
+                word = rng.choice(LONG_WORDS)
+                cut = rng.randrange(3, len(word) - 3)
+                body.extend(words + [word])
+                lines.append(" ".join(words) + f" {word[:cut]}-")
+                words = [word[cut:]] + [rng.choice(WORDS) for _ in range(10)]
+                body.extend(words[1:])
+                lines.append("  ".join(words))
+                continue
+            body.extend(words)
+            lines.append(" ".join(words))
+        lines.append(f"Page {page_num + 1} of {pages}")
+        page_lines.append(lines)
+    return pdf_from_lines(page_lines), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    args = parser.parse_args()
+
+    data, body = make_sop(args.pages)
+    pieces = [text for _, text in iter_pages(data)]
+    raw = "".join(pieces)
+    start = time.perf_counter()
+    text, report = normalize_pages(pieces)
+    seconds = time.perf_counter() - start
+
+    print(f"{args.pages} pages, {len(data) / 1024:.0f} KiB PDF; normalized in {seconds * 1000:.0f} ms "
+          f"({seconds * 1e6 / args.pages:.0f} us/page)")
+    print(report)
+    print(f"{'':<14} {'bytes':>10} {'~tokens':>9}")
+    print(f"{'raw':<14} {len(raw.encode('utf-8')):>10} {estimate_tokens(raw):>9}")
+    print(f"{'normalized':<14} {len(text.encode('utf-8')):>10} {estimate_tokens(text):>9}")
+
+    print("\ncontext budgets needed to cover the whole document:")
+    for model, budget in CONTEXT_TOKEN_BUDGETS.items():
+        print(f"  {model:<12} {math.ceil(estimate_tokens(raw) / budget):>4} raw  "
+              f"{math.ceil(estimate_tokens(text) / budget):>4} normalized")
+
+    left = sum(text.count(s) for s in (HEADER, CLASSIFICATION, " of {}".format(args.pages), "....."))
+    kept = text.split() == body
+    print(f"\nboilerplate left: {left} lines; body text kept word for word: {'yes' if kept else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Compares the original serial read_pdf loop with the parallel pdf_extract engine.
+
+Run from the repo root:
+    python -m benchmarks.bench_pdf_extract --pages 500
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyPDF2 import PdfReader  # noqa: E402
+
+import pdf_extract  # noqa: E402
+
+WORDS = (
+    "casualty airway breathing circulation oxygen ambulance protocol assess scene safety "
+    "triage responder stretcher defibrillator pulse dispatch crew hazard incident command "
+    "evacuation casualty report procedure station appliance rescue equipment"
+).split()
+
+
+def make_pdf(pages, lines_per_page=45, seed=0, revised=()):
+    """
+    Builds a text-only PDF with the given number of pages, no third-party writer needed.
+
+    Pages whose (0-based) numbers are in revised get different text, every
+    other page is the same as with revised empty: a revision of the manual.
+    """
+    rng = random.Random(seed)
+    page_lines = []
+    for page_num in range(pages):
+        lines = [f"SOP Manual - Page {page_num + 1}"]
+        for _ in range(lines_per_page):
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(12)))
+        if page_num in revised:
+            page_rng = random.Random(f"{seed}-revised-{page_num}")
+            lines[1:] = [" ".join(page_rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        page_lines.append(lines)
+    return pdf_from_lines(page_lines)
+
+
+def pdf_from_lines(page_lines):
+    """A PDF with one page per list of lines (latin-1 text, no parentheses or backslashes)."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for lines in page_lines:
+        ops = ["BT", "/F1 10 Tf", "14 TL", "50 800 Td"]
+        for line in lines:
+            ops.append(f"({line}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (page_tree, font, content)
+        ))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % page_tree
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+    return out.getvalue()
+
+
+def legacy_read_pdf(data):
+    # The read_pdf body as it was before the engine: serial pages, repeated string concatenation
+    pdf_reader = PdfReader(io.BytesIO(data))
+    text = ""
+    for page_num in range(len(pdf_reader.pages)):
+        page = pdf_reader.pages[page_num]
+        text += page.extract_text()
+    return text
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=pdf_extract.EXTRACT_WORKERS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_pdf(args.pages)
+    print(f"Generated {args.pages}-page PDF ({len(data) / 1024:.0f} KiB), {args.workers} workers")
+
+    # Start the pool once so worker spawn time is reported separately from steady-state extraction
+    warmup, _ = timed(pdf_extract.extract_text, make_pdf(pdf_extract.PARALLEL_MIN_PAGES), args.workers)
+    print(f"Pool warm-up: {warmup:.2f}s")
+
+    legacy_times, engine_times = [], []
+    for _ in range(args.repeat):
+        t, legacy_text = timed(legacy_read_pdf, data)
+        legacy_times.append(t)
+        t, engine_text = timed(pdf_extract.extract_text, data, args.workers)
+        engine_times.append(t)
+        assert engine_text == legacy_text, "engine output differs from the original read_pdf"
+
+    # Time until the first page comes out of the streaming generator
+    start = time.perf_counter()
+    pages = pdf_extract.iter_pages(data, args.workers)
+    next(pages)
+    first_page = time.perf_counter() - start
+    pages.close()
+
+    legacy_best, engine_best = min(legacy_times), min(engine_times)
+    print(f"legacy read_pdf : {legacy_best:.2f}s (best of {args.repeat})")
+    print(f"pdf_extract     : {engine_best:.2f}s (best of {args.repeat}), speedup {legacy_best / engine_best:.1f}x")
+    print(f"first page out  : {first_page:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Cache hit rates and repeated work across app replicas, with and without the shared store.
+
+Starts --replicas processes, each standing in for one Streamlit replica,
+against the in-process mock endpoint. Every replica serves --visits Dojo
+visits to a few documents, picking hot documents more often, the way a
+load balancer spreads users: read the upload (extraction), build a prompt
+(one of --prompts per document), get the response and its explanations
+through the same cached() tiers app.py uses. This runs twice:
+
+  local   every replica has its own extraction cache directory, question
+          bank and in-memory caches, as separate containers do
+  shared  all replicas use one SARA_SHARED_STORE and one question bank
+
+and reports how many extractions and model requests were made in total and
+what share of each replica's memory misses the shared store answered
+(cross-replica hits, including waits for a value another replica was still
+computing). One replica also runs a Test Mode exam job; in the shared run
+another replica follows it through the store until its export is ready.
+
+Run from the repo root:
+    python -m benchmarks.bench_replicas --replicas 4 --visits 30
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf_extract import make_pdf  # noqa: E402
+from benchmarks.mock_openai import MockConfig, MockOpenAIServer  # noqa: E402
+
+JOB_POLL_SECONDS = 0.2
+
+
+def follow_job(job_queue, job_id, timeout=300):
+    """Polls a job run by another replica until it finishes; returns (progress values seen, the finished job)."""
+    seen = []
+    deadline = time.monotonic() + timeout
+    job = job_queue.get(job_id)
+    while job is not None and job.active and time.monotonic() < deadline:
+        if not seen or seen[-1] != job.progress:
+            seen.append(job.progress)
+        time.sleep(JOB_POLL_SECONDS)
+        job = job_queue.latest(job)
+    return seen, job
+
+
+def replica(index, args, env, documents, start, job_ids, results):
+    # Settings are read when the app's modules are imported, so the environment goes first
+    os.environ.update(env)
+    from exporter import export_exam
+    from extract_cache import extraction_cache
+    from jobs import job_queue
+    from memory_cache import cached, memory_cache
+    from pipeline import (
+        exam_questions, explained_questions, format_explanation, get_test_shard_response, read_document,
+        request_chat_response,
+    )
+    from question_bank import document_hash
+    from questions import parse_questions
+    from retrieval import build_context
+    from shared_store import shared_store
+
+    @cached("read_document", key=lambda doc_hash, data: doc_hash)
+    def read_text(doc_hash, data):
+        return read_document(data)
+
+    @cached("dojo_response", shared=True)
+    def get_chat_response(user_query):
+        return request_chat_response(user_query)
+
+    @cached("explanation", shared=True)
+    def explanation(input):
+        return format_explanation(input)
+
+    rng = random.Random(index)
+    hashes = [document_hash(data) for data in documents]
+    # Hot documents first: the k-th document is visited about 1/k as often as the first
+    weights = [1 / (k + 1) for k in range(len(documents))]
+    start.wait()
+    started = time.perf_counter()
+
+    job = None
+    if index == 0:
+        def run(job):
+            text = read_text(hashes[0], documents[0])
+            questions = exam_questions(args.exam_questions, text, "Easy", hashes[0], "EMT", get_test_shard_response,
+                                       on_progress=lambda done, total: job.set_progress(done / total))
+            return dict(zip(("file_name", "mime", "data"), export_exam(questions)), questions=len(questions))
+        job = job_queue.submit("bench", run, description="replica exam")
+        if shared_store is not None:
+            job_ids.put(job.id)
+
+    followed = {}
+    follower = None
+    if shared_store is not None and index == 1:
+        def follow():
+            seen, remote = follow_job(job_queue, job_ids.get(timeout=60))
+            followed.update(progress_seen=len(seen), state=remote.state if remote else None,
+                            remote=bool(remote and remote.remote),
+                            bytes=len(remote.result["data"]) if remote and remote.result else 0)
+        follower = threading.Thread(target=follow)
+        follower.start()
+
+    for _ in range(args.visits):
+        doc = rng.choices(range(len(documents)), weights)[0]
+        text = read_text(hashes[doc], documents[doc])
+        context = build_context(text, "o1-mini", seed=rng.randrange(args.prompts))
+        explained_questions(parse_questions(get_chat_response(context), " | "), format_fn=explanation)
+
+    if follower is not None:
+        follower.join()
+    while job is not None and job.active:
+        # The job runs on this replica's worker thread, so this process stays up until it is done
+        time.sleep(JOB_POLL_SECONDS)
+
+    caches = memory_cache.stats()["caches"]
+    results.put({
+        "index": index,
+        "seconds": time.perf_counter() - started,
+        "extractions": extraction_cache.stats()["misses"],
+        "memory": {name: caches.get(name, {}) for name in ("dojo_response", "explanation")},
+        "shared": shared_store.stats() if shared_store is not None else {},
+        "followed": followed,
+    })
+
+
+def run_replicas(args, shared, documents, mock_url):
+    state = tempfile.mkdtemp(prefix=f"sara-bench-replicas-{'shared' if shared else 'local'}-")
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Barrier(args.replicas + 1)
+    job_ids = ctx.Queue()
+    results = ctx.Queue()
+    processes = []
+    for i in range(args.replicas):
+        env = {"OPENAI_BASE_URL": mock_url, "OPENAI_API_KEY": "sk-mock", "SARA_METRICS_PORT": "0",
+               "SARA_HEDGE": "0"}
+        # Each replica's rate limiter only knows its own calls; lifted so the runs compare cache hits alone
+        for name in ("O1_MINI", "GPT4", "GPT4O_MINI"):
+            env.update({f"SARA_{name}_RPM": "1000000", f"SARA_{name}_TPM": "1000000000"})
+        if shared:
+            env.update(SARA_SHARED_STORE=os.path.join(state, "shared.sqlite3"),
+                       SARA_QUESTION_BANK=os.path.join(state, "bank.sqlite3"),
+                       SARA_EXTRACT_CACHE_DIR=os.path.join(state, "extract"))
+        else:
+            env.update(SARA_QUESTION_BANK=os.path.join(state, f"bank-{i}.sqlite3"),
+                       SARA_EXTRACT_CACHE_DIR=os.path.join(state, f"extract-{i}"))
+        process = ctx.Process(target=replica, args=(i, args, env, documents, start, job_ids, results))
+        process.start()
+        processes.append(process)
+    start.wait()
+    started = time.perf_counter()
+    rows = [results.get() for _ in processes]
+    wall = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    return wall, sorted(rows, key=lambda row: row["index"])
+
+
+def summarize(rows, name):
+    misses = sum(row["memory"].get(name, {}).get("misses", 0) for row in rows)
+    shared = [row["shared"].get(name, {}) for row in rows]
+    answered = sum(s.get("hits", 0) + s.get("waits", 0) for s in shared)
+    return misses, answered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--visits", type=int, default=30, help="Dojo visits served by each replica")
+    parser.add_argument("--documents", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=40, help="pages of each generated SOP document")
+    parser.add_argument("--prompts", type=int, default=3, help="distinct prompts per document")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per mock question response")
+    parser.add_argument("--exam-questions", type=int, default=20, help="questions in the followed exam job")
+    args = parser.parse_args()
+    if args.replicas < 2:
+        parser.error("--replicas must be at least 2")
+
+    documents = [make_pdf(args.pages, seed=i) for i in range(args.documents)]
+    print(f"{args.replicas} replicas x {args.visits} visits, {args.documents} documents of {args.pages} pages, "
+          f"{args.prompts} prompts each")
+    print(f"\n{'run':<7} {'wall s':>7} {'extractions':>11} {'requests':>8} {'responses':>16} {'explanations':>16}")
+    for shared in (False, True):
+        mock = MockOpenAIServer(MockConfig(latency=args.latency, jitter=0.1, explain_latency=0.05,
+                                           first_token=0.05, seed=1)).start()
+        wall, rows = run_replicas(args, shared, documents, mock.url)
+        requests = mock.stats["requests"]
+        mock.stop()
+        cells = []
+        for name in ("dojo_response", "explanation"):
+            misses, answered = summarize(rows, name)
+            # Memory misses the shared store answered: work another replica had already done
+            cells.append(f"{answered}/{misses} shared" if shared else f"{misses} computed")
+        print(f"{'shared' if shared else 'local':<7} {wall:>7.1f} {sum(r['extractions'] for r in rows):>11} "
+              f"{requests:>8} {cells[0]:>16} {cells[1]:>16}")
+        followed = next((row["followed"] for row in rows if row["followed"]), None)
+    if followed:
+        print(f"\nexam job run on replica 0, followed from replica 1: {followed['state']} "
+              f"({followed['progress_seen']} progress updates seen, {followed['bytes']} byte export)")
+
+
+if __name__ == "__main__":
+    main()
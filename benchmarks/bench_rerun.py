@@ -0,0 +1,126 @@
+"""
+Cost of one Dojo interaction ("Check answer") on a large document.
+
+Runs app.py headless with streamlit.testing's AppTest against the in-process
+mock endpoint, with a generated PDF as the upload. After the first run has
+generated the page, each "Check answer" click is timed three ways:
+
+  rebuilt   a full rerun that builds the page again from the caches (reading
+            the upload, building the prompt context, the response, parse and
+            ten explanation lookups) - how every click worked before the
+            quiz was kept in the session
+  compiled  a full rerun that draws the quiz kept in the session, e.g. after
+            switching tabs
+  fragment  the rerun a click causes now: only that question's fragment
+
+AppTest can't run a fragment on its own, so the fragment row is one
+question drawn through the same fragment as a script of its own. Every row
+includes AppTest's own cost of a script run, shown as "empty script".
+Streaming is turned off so the rebuilt page reads the cached response
+instead of starting a new stream.
+
+Run from the repo root:
+    python -m benchmarks.bench_rerun --pages 300 --clicks 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf_extract import make_pdf  # noqa: E402
+from benchmarks.load_test import percentile  # noqa: E402
+from benchmarks.mock_openai import MockConfig, MockOpenAIServer  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_with_upload(script, name, data):
+    # AppTest can't drive st.file_uploader, so the app gets the document as if it had been uploaded
+    import runpy
+
+    import streamlit as st
+    from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+    upload = UploadedFile(UploadedFileRec("bench-upload", name, "application/pdf", data), None)
+    st.file_uploader = lambda *args, **kwargs: upload
+    runpy.run_path(script, run_name="__main__")
+
+
+def draw_one_question(quiz):
+    import streamlit as st
+
+    from dojo import answer_check
+
+    with st.container():
+        answer_check(quiz, 0)
+
+
+def empty_script():
+    import streamlit as st
+
+    st.empty()
+
+
+def timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return (time.perf_counter() - start) * 1000
+
+
+def timed_clicks(at, clicks, before_click=None):
+    """Milliseconds per rerun after clicking each "Check answer" in turn."""
+    times = []
+    for i in range(clicks):
+        if before_click:
+            before_click(at)
+        at.button[i % len(at.button)].click()
+        times.append(timed_run(at))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--clicks", type=int, default=20)
+    args = parser.parse_args()
+
+    mock = MockOpenAIServer(MockConfig(latency=0, jitter=0, explain_latency=0, first_token=0)).start()
+    state = tempfile.mkdtemp(prefix="sara-bench-rerun-")
+    os.environ.update({
+        "OPENAI_BASE_URL": mock.url, "OPENAI_API_KEY": "sk-mock", "SARA_STREAM_DOJO": "0", "SARA_METRICS_PORT": "0",
+        "SARA_QUESTION_BANK": os.path.join(state, "bank.sqlite3"), "SARA_EXTRACT_CACHE_DIR": os.path.join(state, "extract"),
+    })
+    from streamlit.testing.v1 import AppTest
+
+    data = make_pdf(args.pages)
+    at = AppTest.from_function(run_with_upload, args=(os.path.join(ROOT, "app.py"), "sop.pdf", data), default_timeout=300)
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    if at.exception or not at.button:
+        raise RuntimeError(f"the first run drew no quiz: {[e.value for e in at.exception]}")
+    print(f"{args.pages}-page PDF ({len(data) / 1024 / 1024:.1f} MiB): first run {first:.1f} s, "
+          f"{len(at.radio)} questions")
+
+    rows = {"rebuilt": timed_clicks(at, args.clicks, lambda at: at.session_state["dojo_quizzes"].clear())}
+    rows["compiled"] = timed_clicks(at, args.clicks)
+    quiz = next(iter(at.session_state["dojo_quizzes"].values()))
+    fragment = AppTest.from_function(draw_one_question, args=(quiz,))
+    fragment.run()
+    rows["fragment"] = timed_clicks(fragment, args.clicks)
+    empty = AppTest.from_function(empty_script)
+    rows["empty script"] = [timed_run(empty) for _ in range(args.clicks)]
+
+    print(f"\n{'per click':<14} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, times in rows.items():
+        print(f"{name:<14} {percentile(times, 50):>8.1f} {percentile(times, 95):>8.1f}")
+    mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+What uploading a revised SOP costs compared to a brand new one.
+
+Builds a manual and a revision of it with a few pages rewritten, then
+measures the work done for the revision when the first version was seen
+before: pages extracted (against the page cache) and the share of the
+text that needs new questions (sections that changed), next to the cost
+of treating it as a new document. No model calls are made; generation
+cost is estimated from the prompt tokens of the text to cover.
+
+Run from the repo root:
+    python -m benchmarks.bench_revision --pages 400 --revised 8
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf_extract import make_pdf  # noqa: E402
+from extract_cache import ExtractionCache  # noqa: E402
+from extractors import extractor_for  # noqa: E402
+from pdf_extract import extract_text, iter_pages_incremental  # noqa: E402
+from retrieval import estimate_tokens  # noqa: E402
+from versioning import split_sections  # noqa: E402
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--revised", type=int, default=8, help="pages rewritten in the revision")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    revised = set(random.Random(args.seed).sample(range(args.pages), args.revised))
+    first = make_pdf(args.pages, seed=args.seed)
+    second = make_pdf(args.pages, seed=args.seed, revised=revised)
+    version = extractor_for("pdf").version
+    cache = ExtractionCache(tempfile.mkdtemp(prefix="sara-revision-"))
+
+    def incremental(data):
+        return "".join(text for _, text in iter_pages_incremental(data, cache, version))
+
+    full_seconds, full_text = timed(extract_text, second)
+    first_seconds, first_text = timed(incremental, first)
+    revision_seconds, revision_text = timed(incremental, second)
+    assert revision_text == full_text, "incremental extraction differs from a full one"
+
+    old_sections = {h for h, _ in split_sections(first_text)}
+    new_sections = split_sections(revision_text)
+    added = [text for h, text in new_sections if h not in old_sections]
+    removed = old_sections - {h for h, _ in new_sections}
+    added_tokens = estimate_tokens("\n".join(added))
+    total_tokens = estimate_tokens(revision_text)
+
+    print(f"{args.pages}-page manual, {args.revised} pages revised")
+    print(f"extraction   : new document {full_seconds:.2f}s, revision {revision_seconds:.2f}s "
+          f"({revision_seconds / full_seconds:.0%}); first version with page cache writes {first_seconds:.2f}s")
+    print(f"sections     : {len(new_sections)} in the revision, {len(added)} new, {len(removed)} removed, "
+          f"{len(new_sections) - len(added)} kept with their questions")
+    print(f"text to cover: {added_tokens} of {total_tokens} tokens ({added_tokens / total_tokens:.1%})")
+
+
+if __name__ == "__main__":
+    main()
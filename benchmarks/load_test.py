@@ -0,0 +1,253 @@
+"""
+Headless load test of the Dojo and Test Mode pipelines against the mock OpenAI endpoint.
+
+N simulated sessions run concurrently in this process, the way Streamlit
+runs sessions as threads. Each one loops over the scenarios: a Dojo page
+(extraction, prompt, model call, parse and explanations; streamed like
+the app unless --stream 0) or a Test Mode exam (sharded generation and
+the .docx export). The mock endpoint runs in a separate process so its
+CPU and memory aren't counted.
+
+Run from the repo root:
+    python -m benchmarks.load_test --sessions 20 --iterations 3 --latency 1
+    python -m benchmarks.load_test --sessions 50 --max-p95 30 --max-error-rate 0.01   # as a regression gate
+
+Streamlit's st.cache_resource is not involved, so every Dojo page is a
+cache miss: this measures the cost of fresh generation.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_pdf_extract import make_pdf  # noqa: E402
+from benchmarks.mock_openai import add_config_arguments  # noqa: E402
+
+SCENARIOS = ("emt-dojo", "psct-dojo", "emt-test", "psct-test")
+
+
+def percentile(values, pct):
+    """Linear interpolation between closest ranks, pct in 0-100."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def start_mock(args):
+    """Starts benchmarks.mock_openai in its own process and returns (process, base_url)."""
+    port = args.port
+    command = [sys.executable, "-m", "benchmarks.mock_openai", "--port", str(port),
+               "--latency", str(args.latency), "--jitter", str(args.jitter),
+               "--explain-latency", str(args.explain_latency), "--first-token", str(args.first_token),
+               "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+               "--malformed-rate", str(args.malformed_rate), "--slow-rate", str(args.slow_rate),
+               "--slow-latency", str(args.slow_latency)]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(command, cwd=root, stdout=subprocess.PIPE, text=True)
+    # The mock prints its URL once it is listening
+    line = process.stdout.readline().strip()
+    if not line:
+        process.kill()
+        raise RuntimeError("mock OpenAI server did not start")
+    return process, line.rsplit(" ", 1)[-1]
+
+
+def configure_environment(base_url, workdir, keep_rate_limits):
+    # Must happen before the pipeline modules are imported, they read their settings at import time
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ["SARA_QUESTION_BANK"] = os.path.join(workdir, "question_bank.sqlite3")
+    os.environ["SARA_EXTRACT_CACHE_DIR"] = os.path.join(workdir, "extract")
+    os.environ.setdefault("SARA_METRICS_PORT", "0")
+    if not keep_rate_limits:
+        for name in ("O1_MINI", "GPT4", "GPT4O_MINI"):
+            os.environ[f"SARA_{name}_RPM"] = "1000000"
+            os.environ[f"SARA_{name}_TPM"] = "1000000000"
+
+
+def stream_dojo_page(pipeline, text, mode, seed):
+    """A streamed Dojo page the way app.py draws it; returns (questions, seconds to the first question)."""
+    from retrieval import build_context
+    from streaming import StreamedQuiz
+
+    started = time.perf_counter()
+    context = build_context(text, pipeline.DOJO_MODELS[mode], seed=seed)
+    stream_fn = pipeline.stream_chat_response if mode == "EMT" else pipeline.stream_psct_chat_response
+    quiz = StreamedQuiz(lambda: stream_fn(context), " | ", pipeline.format_explanation, pipeline.explanation_input)
+    first_question = None
+    questions = 0
+    for _ in quiz:
+        if first_question is None:
+            first_question = time.perf_counter() - started
+        questions += 1
+    if quiz.error and not questions:
+        raise quiz.error
+    return questions, first_question
+
+
+def run_session(session_no, args, document, results, lock, pipeline, export_exam):
+    rng = random.Random(session_no if args.seed is None else args.seed * 1000 + session_no)
+    doc_hash = f"load-test-{session_no}"
+    for iteration in range(args.iterations):
+        scenario = args.scenarios[(session_no + iteration) % len(args.scenarios)]
+        mode = "EMT" if scenario.startswith("emt") else "PSCT"
+        started = time.perf_counter()
+        error = None
+        questions = 0
+        first_question = None
+        try:
+            text = pipeline.read_document(document)
+            if scenario.endswith("dojo") and args.stream:
+                questions, first_question = stream_dojo_page(pipeline, text, mode, rng.randrange(2**31))
+            elif scenario.endswith("dojo"):
+                page = pipeline.dojo_questions(text, mode, seed=rng.randrange(2**31))
+                questions = len(pipeline.explained_questions(page))
+            else:
+                shard_response = pipeline.get_test_shard_response if mode == "EMT" else pipeline.get_psct_test_shard_response
+                exam = pipeline.exam_questions(args.test_questions, text, "Moderate", doc_hash, mode, shard_response)
+                export_exam(exam)
+                questions = len(exam)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - started
+        with lock:
+            results.append({"session": session_no, "scenario": scenario, "seconds": seconds,
+                            "questions": questions, "first_question": first_question, "error": error})
+
+
+def summarize(results, wall_seconds):
+    rows = {}
+    for scenario in sorted({r["scenario"] for r in results}):
+        subset = [r for r in results if r["scenario"] == scenario]
+        ok = [r["seconds"] for r in subset if r["error"] is None]
+        first = [r["first_question"] for r in subset if r["first_question"] is not None]
+        rows[scenario] = {
+            "runs": len(subset),
+            "errors": len(subset) - len(ok),
+            "p50": percentile(ok, 50),
+            "p95": percentile(ok, 95),
+            "p99": percentile(ok, 99),
+            "questions": sum(r["questions"] for r in subset),
+            "first_question_p50": percentile(first, 50) if first else None,
+        }
+    ok_all = [r["seconds"] for r in results if r["error"] is None]
+    return {
+        "scenarios": rows,
+        "runs": len(results),
+        "errors": sum(1 for r in results if r["error"] is not None),
+        "p50": percentile(ok_all, 50),
+        "p95": percentile(ok_all, 95),
+        "p99": percentile(ok_all, 99),
+        "wall_seconds": wall_seconds,
+        "runs_per_second": len(ok_all) / wall_seconds if wall_seconds else 0.0,
+        "questions_per_second": sum(r["questions"] for r in results) / wall_seconds if wall_seconds else 0.0,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated sessions")
+    parser.add_argument("--iterations", type=int, default=2, help="scenarios run by each session")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--test-questions", type=int, default=20, help="questions per Test Mode exam")
+    parser.add_argument("--pages", type=int, default=40, help="pages of the generated SOP document")
+    parser.add_argument("--port", type=int, default=8799, help="port for the mock endpoint")
+    parser.add_argument("--mock-url", help="use an already running mock (or real) endpoint instead of starting one")
+    parser.add_argument("--stream", type=int, choices=(0, 1), default=int(os.environ.get("SARA_STREAM_DOJO", "1")),
+                        help="stream Dojo pages like the app does (default: SARA_STREAM_DOJO, else 1)")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="keep the scheduler's real RPM/TPM limits")
+    parser.add_argument("--json", help="also write the summary and every run to this file")
+    parser.add_argument("--max-p95", type=float, help="exit with status 1 if the overall p95 (seconds) is above this")
+    parser.add_argument("--max-error-rate", type=float, help="exit with status 1 if the share of failed runs is above this")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    mock = None
+    base_url = args.mock_url
+    if base_url is None:
+        mock, base_url = start_mock(args)
+    workdir = tempfile.mkdtemp(prefix="sara-load-")
+    configure_environment(base_url, workdir, args.keep_rate_limits)
+
+    import hedging  # noqa: E402
+    import pipeline  # noqa: E402
+    from exporter import export_exam  # noqa: E402
+
+    document = make_pdf(args.pages)
+    results = []
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_session, args=(i, args, document, results, lock, pipeline, export_exam), name=f"session-{i}")
+        for i in range(args.sessions)
+    ]
+    print(f"{args.sessions} sessions x {args.iterations} iterations against {base_url} ({', '.join(args.scenarios)})")
+    started = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        wall_seconds = time.perf_counter() - started
+        mock_stats = None
+        try:
+            with urllib.request.urlopen(base_url.rsplit("/v1", 1)[0] + "/stats", timeout=5) as response:
+                mock_stats = json.load(response)
+        except Exception:
+            pass
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+    summary = summarize(results, wall_seconds)
+    print(f"{'scenario':<10} {'runs':>5} {'errors':>6} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'questions':>9} {'first q p50':>11}")
+    for scenario, row in summary["scenarios"].items():
+        first = f"{row['first_question_p50']:.2f}" if row["first_question_p50"] is not None else "-"
+        print(f"{scenario:<10} {row['runs']:>5} {row['errors']:>6} {row['p50']:>8.2f} {row['p95']:>8.2f} {row['p99']:>8.2f} {row['questions']:>9} {first:>11}")
+    print(f"{'all':<10} {summary['runs']:>5} {summary['errors']:>6} {summary['p50']:>8.2f} {summary['p95']:>8.2f} {summary['p99']:>8.2f}")
+    print(f"throughput: {summary['runs_per_second']:.2f} runs/s, {summary['questions_per_second']:.1f} questions/s "
+          f"over {summary['wall_seconds']:.1f}s; peak RSS {summary['peak_rss_mib']:.0f} MiB")
+    print(f"hedging: {hedging.policy.stats()}")
+    if mock_stats:
+        print(f"mock endpoint: {mock_stats}")
+    for error in sorted({r["error"] for r in results if r["error"]})[:5]:
+        print(f"error: {error}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "mock": mock_stats, "runs": results, "args": vars(args)}, f, indent=2)
+
+    failed = False
+    if args.max_p95 is not None and not summary["p95"] <= args.max_p95:
+        print(f"FAIL: p95 {summary['p95']:.2f}s is above {args.max_p95}s")
+        failed = True
+    error_rate = summary["errors"] / summary["runs"] if summary["runs"] else 1.0
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        print(f"FAIL: error rate {error_rate:.1%} is above {args.max_error_rate:.1%}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
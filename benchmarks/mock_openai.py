@@ -0,0 +1,269 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, for benchmarks and load tests.
+
+Question prompts are answered from the recorded fixtures in
+benchmarks/fixtures: JSON lines when the prompt asks for JSON objects,
+"|||" lines for sara_int.py's template and " | " lines otherwise. Every
+response tags its questions with a request number so they don't
+deduplicate against each other. gpt-4o-mini (explanation formatting)
+gets a numbered list back. Latency, streaming speed, injected 500/429
+errors, malformed lines and occasional straggling responses are
+configurable.
+
+Run standalone and point the app at it:
+    python -m benchmarks.mock_openai --port 8765 --latency 2 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-mock streamlit run app.py
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURES = {"json": "questions.jsonl", "|||": "quiz_pipe.txt", " | ": "dojo_pipe.txt"}
+
+_COUNT_RES = [re.compile(r"exactly (\d+) JSON objects"), re.compile(r"generate for (?:me )?(\d+)")]
+
+
+def load_fixtures(directory=FIXTURE_DIR):
+    fixtures = {}
+    for fmt, name in FIXTURES.items():
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            fixtures[fmt] = [line.rstrip("\n") for line in f if line.strip()]
+    return fixtures
+
+
+class MockConfig:
+    def __init__(self, latency=1.0, jitter=0.25, explain_latency=0.3, first_token=0.3, chunk_chars=40,
+                 error_rate=0.0, rate_limit_rate=0.0, malformed_rate=0.0, slow_rate=0.0, slow_latency=30.0, seed=None):
+        self.latency = latency                  # seconds for a full question response
+        self.jitter = jitter                    # +- fraction applied to every latency
+        self.explain_latency = explain_latency  # seconds for a gpt-4o-mini formatting call
+        self.first_token = first_token          # seconds to the first streamed chunk
+        self.chunk_chars = chunk_chars          # characters per streamed chunk
+        self.error_rate = error_rate            # fraction of calls answered with a 500
+        self.rate_limit_rate = rate_limit_rate  # fraction of calls answered with a 429
+        self.malformed_rate = malformed_rate    # fraction of question lines that come back broken
+        self.slow_rate = slow_rate              # fraction of question responses that are stragglers
+        self.slow_latency = slow_latency        # seconds a straggler takes instead of latency
+        self.seed = seed
+
+
+class MockOpenAIServer:
+    """The mock endpoint on a background thread; url is the base URL to give the OpenAI client."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0, fixtures=None):
+        self.config = config or MockConfig()
+        self.fixtures = fixtures or load_fixtures()
+        self.rng = random.Random(self.config.seed)
+        self.stats = {"requests": 0, "streams": 0, "errors_500": 0, "errors_429": 0, "malformed_lines": 0,
+                      "slow_responses": 0, "streams_cut_off": 0}
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _chance(self, rate):
+        with self._lock:
+            return self.rng.random() < rate
+
+    def _latency(self, seconds):
+        with self._lock:
+            return max(0.0, seconds * (1 + self.rng.uniform(-self.config.jitter, self.config.jitter)))
+
+    @staticmethod
+    def is_explanation(body):
+        """A gpt-4o-mini formatting call, as opposed to a generation request (which always asks for a count)."""
+        prompt = "\n".join(m.get("content") or "" for m in body.get("messages", []))
+        return body.get("model") == "gpt-4o-mini" and not any(count_re.search(prompt) for count_re in _COUNT_RES)
+
+    def completion_text(self, body):
+        prompt = "\n".join(m.get("content") or "" for m in body.get("messages", []))
+        if self.is_explanation(body):
+            points = [p.strip() for p in re.split(r"\s*\|\s*|\n", prompt.splitlines()[-1]) if p.strip()]
+            return "\n".join(f"{i}. {point}" for i, point in enumerate(points, start=1))
+
+        fmt = "json" if "JSON objects" in prompt else "|||" if "|||" in prompt else " | "
+        count = 10
+        for count_re in _COUNT_RES:
+            match = count_re.search(prompt)
+            if match:
+                count = int(match.group(1))
+                break
+        request_id = next(self._request_ids)
+        lines = []
+        for i, line in zip(range(count), itertools.cycle(self.fixtures[fmt])):
+            tag = f" [r{request_id}q{i + 1}]"
+            if fmt == "json":
+                record = json.loads(line)
+                record["question"] += tag
+                line = json.dumps(record)
+            else:
+                head, sep, rest = line.partition(fmt)
+                line = head + tag + sep + rest
+            if self._chance(self.config.malformed_rate):
+                self._count("malformed_lines")
+                line = line[:len(line) // 2]
+            lines.append(line)
+        return "\n".join(lines) + "\n"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                # GET /stats reports what the mock has served and injected
+                with server._lock:
+                    self._send_json(200, dict(server.stats))
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                server._count("requests")
+                if server._chance(server.config.rate_limit_rate):
+                    server._count("errors_429")
+                    self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests"}},
+                                    {"retry-after": "0.2"})
+                    return
+                if server._chance(server.config.error_rate):
+                    server._count("errors_500")
+                    self._send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+                    return
+
+                text = server.completion_text(body)
+                explain = server.is_explanation(body)
+                total = server._latency(server.config.explain_latency if explain else server.config.latency)
+                if not explain and server._chance(server.config.slow_rate):
+                    server._count("slow_responses")
+                    total = server._latency(server.config.slow_latency)
+                if body.get("stream"):
+                    server._count("streams")
+                    self._stream(body, text, total)
+                else:
+                    time.sleep(total)
+                    tokens = (len(json.dumps(body.get("messages", []))) + 3) // 4
+                    self._send_json(200, {
+                        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": tokens, "completion_tokens": (len(text) + 3) // 4,
+                                  "total_tokens": tokens + (len(text) + 3) // 4},
+                    })
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, body, text, total):
+                model = body["model"]
+                size = max(1, server.config.chunk_chars)
+                chunks = [text[i:i + size] for i in range(0, len(text), size)]
+                first = min(server.config.first_token, total)
+                per_chunk = (total - first) / max(1, len(chunks))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(first)
+                try:
+                    for i, chunk in enumerate(chunks):
+                        if i:
+                            time.sleep(per_chunk)
+                        event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": model, "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}
+                        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        # As the API does: one last chunk with no choices and the usage of the whole call
+                        tokens = (len(json.dumps(body.get("messages", []))) + 3) // 4
+                        event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": model, "choices": [],
+                                 "usage": {"prompt_tokens": tokens, "completion_tokens": (len(text) + 3) // 4,
+                                           "total_tokens": tokens + (len(text) + 3) // 4}}
+                        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self._write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client hung up, e.g. a hedged request that lost
+                    server._count("streams_cut_off")
+                    self.close_connection = True
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per question response")
+    parser.add_argument("--jitter", type=float, default=0.25, help="+- fraction of random latency variation")
+    parser.add_argument("--explain-latency", type=float, default=0.3, help="seconds per gpt-4o-mini call")
+    parser.add_argument("--first-token", type=float, default=0.3, help="seconds to the first streamed chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls failing with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of question lines broken")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of question responses that straggle")
+    parser.add_argument("--slow-latency", type=float, default=30.0, help="seconds a straggling response takes")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args):
+    return MockConfig(latency=args.latency, jitter=args.jitter, explain_latency=args.explain_latency,
+                      first_token=args.first_token, error_rate=args.error_rate,
+                      rate_limit_rate=args.rate_limit_rate, malformed_rate=args.malformed_rate,
+                      slow_rate=args.slow_rate, slow_latency=args.slow_latency, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(config_from_args(args), args.host, args.port)
+    print(f"Mock OpenAI endpoint on {server.url}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
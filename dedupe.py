@@ -0,0 +1,181 @@
+"""
+Near-duplicate detection for generated questions.
+
+The prompts ask the model never to repeat itself, but reworded copies of
+the same question still come back, within one response, across exam shards
+and across visits. A question's text is reduced to shingles (see shingles()),
+and those to a MinHash signature; its options are compared separately. The signature is cut into bands for
+locality-sensitive hashing: only questions that share a whole band are
+compared, which keeps a lookup in the same sub-millisecond range with fifty
+thousand questions indexed as with fifty.
+"""
+import os
+import threading
+import zlib
+
+import numpy as np
+
+import metrics
+from questions import question_key, strip_numbering
+from retrieval import tokenize
+
+# Signatures are BANDS * ROWS values long; questions become candidates when all ROWS values of one band match
+BANDS = 20
+ROWS = 3
+# Overlap (Jaccard) of the question texts' shingles from which two questions count as the same
+DUPLICATE_SIMILARITY = float(os.environ.get("SARA_DUPLICATE_SIMILARITY", "0.5"))
+# ...provided their options overlap this much too; questions over the same options still need alike texts
+OPTION_SIMILARITY = float(os.environ.get("SARA_DUPLICATE_OPTION_SIMILARITY", "0.25"))
+# Candidates whose signatures estimate this much less than that are not compared exactly
+_ESTIMATE_SLACK = 0.25
+
+# Word pairs made only of these ("what is", "which of the following") are in every other question, so they're skipped
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does for following from how in is it of on or should the this to what when "
+    "which who why will with".split()
+)
+
+_PRIME = (1 << 31) - 1
+# Fixed seed: the same question gets the same signature in every process
+_rng = np.random.default_rng(0x5A4A)
+_A = _rng.integers(1, _PRIME, BANDS * ROWS, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, BANDS * ROWS, dtype=np.uint64)
+
+
+def shingles(question):
+    """
+    The content words of the question text and the pairs they form once stop words are dropped.
+
+    Options are left out (see option_shingles()): in a short question over a
+    common option set they would outweigh the one word that tells
+    "Which drug is given for asthma?" from "...for anaphylaxis?".
+    """
+    words = tokenize(strip_numbering(question.question))
+    content = [word for word in words if word not in STOP_WORDS]
+    if not content:
+        return set(words)
+    return set(content) | {f"{a} {b}" for a, b in zip(content, content[1:])}
+
+
+def option_shingles(question):
+    """Each option as a whole, so reordered options still match."""
+    return {" ".join(tokenize(option)) for option in question.options}
+
+
+def hash_shingles(strings):
+    """Shingles as sorted unique 31-bit hashes."""
+    return np.unique(np.fromiter((zlib.crc32(s.encode("utf-8")) & _PRIME for s in strings), dtype=np.uint64))
+
+
+def shingle_hashes(question):
+    """The question text's shingles as sorted unique 31-bit hashes."""
+    return hash_shingles(shingles(question))
+
+
+def signature(hashes):
+    """The MinHash signature of non-empty shingle hashes."""
+    # One universal hash per signature value; values stay below 2**62, so uint64 never overflows
+    return ((np.multiply.outer(hashes, _A) + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def jaccard(a, b):
+    if not len(a) and not len(b):
+        return 1.0
+    shared = len(np.intersect1d(a, b, assume_unique=True))
+    return shared / (len(a) + len(b) - shared)
+
+
+def _bands(sig):
+    return [sig[i * ROWS:(i + 1) * ROWS].tobytes() for i in range(BANDS)]
+
+
+class DuplicateIndex:
+    """
+    Questions seen so far, for near-duplicate lookups.
+
+    Band matches only nominate candidates; whether one is a duplicate is
+    decided on the exact overlap of the stored shingle hashes, since a
+    60-value signature alone is too coarse to tell 0.45 from 0.55. The texts
+    must overlap by threshold and the options by option_threshold. add() is an
+    atomic check-and-insert, so shards or threads filtering through the same
+    index never let two copies of a question both through. Exact repeats
+    (same question_key()) always count as duplicates.
+    """
+
+    def __init__(self, threshold=DUPLICATE_SIMILARITY, option_threshold=OPTION_SIMILARITY):
+        self.threshold = threshold
+        self.option_threshold = option_threshold
+        self._signatures = np.empty((64, BANDS * ROWS), dtype=np.uint32)
+        self._hashes = []
+        self._options = []
+        self._buckets = [{} for _ in range(BANDS)]
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _prepare(question):
+        hashes = shingle_hashes(question)
+        options = hash_shingles(option_shingles(question))
+        return question_key(question), hashes, options, signature(hashes) if len(hashes) else None
+
+    def _similar(self, hashes, options, sig):
+        candidates = set()
+        for band, bucket in zip(_bands(sig), self._buckets):
+            rows = bucket.get(band)
+            if rows:
+                candidates.update(rows)
+        if not candidates:
+            return False
+        rows = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+        estimates = (self._signatures[rows] == sig).mean(axis=1)
+        likely = rows[estimates >= self.threshold - _ESTIMATE_SLACK]
+        return any(jaccard(hashes, self._hashes[row]) >= self.threshold
+                   and jaccard(options, self._options[row]) >= self.option_threshold for row in likely)
+
+    def _is_duplicate(self, key, hashes, options, sig):
+        return key in self._keys or (sig is not None and self._similar(hashes, options, sig))
+
+    def _insert(self, key, hashes, options, sig):
+        self._keys.add(key)
+        if sig is None:
+            return
+        row = len(self._hashes)
+        if row == len(self._signatures):
+            grown = np.empty((2 * row, BANDS * ROWS), dtype=np.uint32)
+            grown[:row] = self._signatures
+            self._signatures = grown
+        self._signatures[row] = sig
+        self._hashes.append(hashes.astype(np.uint32))
+        self._options.append(options.astype(np.uint32))
+        for band, bucket in zip(_bands(sig), self._buckets):
+            bucket.setdefault(band, []).append(row)
+
+    def is_duplicate(self, question):
+        prepared = self._prepare(question)
+        with self._lock:
+            return self._is_duplicate(*prepared)
+
+    def add(self, question):
+        """Indexes question unless it is a near-duplicate of one already indexed; returns whether it was added."""
+        prepared = self._prepare(question)
+        with self._lock:
+            if self._is_duplicate(*prepared):
+                metrics.DUPLICATE_QUESTIONS.inc()
+                return False
+            self._insert(*prepared)
+            return True
+
+    def extend(self, questions):
+        """Indexes questions without checking them, e.g. ones already stored; exact repeats are skipped."""
+        prepared = [self._prepare(question) for question in questions]
+        with self._lock:
+            for item in prepared:
+                if item[0] not in self._keys:
+                    self._insert(*item)
+
+    def filter(self, questions):
+        """The questions that are new, in order; they are indexed, so a second call drops them."""
+        return [question for question in questions if self.add(question)]
@@ -0,0 +1,84 @@
+"""
+Dojo quizzes held in the session, drawn one fragment per question.
+
+A Dojo page is compiled once per tab and upload into a quiz object kept in
+st.session_state. A rerun draws that object as it is instead of reading the
+upload, building the prompt context and going through the response, parse
+and explanation caches again. Each question is drawn in its own fragment,
+so "Check answer" reruns that question's widget and nothing else.
+"""
+import streamlit as st
+import streamlit_book as stb
+
+from explanations import iter_explanations
+
+WRONG_ANSWER = '''Wrong Answer 😒 \n Please try again'''
+
+
+class CompiledQuiz:
+    """
+    A Dojo page whose questions are known up front (from the bank or a whole response).
+
+    The first pass over it formats the explanations concurrently and yields
+    each question as its explanation is ready; later passes yield the stored
+    ones. A pass cut short by a rerun is picked up where it stopped. Iterates
+    like StreamedQuiz, so both are drawn the same way.
+    """
+
+    error = None
+
+    def __init__(self, questions, format_fn, explanation_input):
+        self.questions = list(questions)
+        self.explanations = []
+        self._format_fn = format_fn
+        self._inputs = [explanation_input(question) for question in self.questions]
+
+    @property
+    def done(self):
+        return len(self.explanations) == len(self.questions)
+
+    def explanation(self, i):
+        return self.explanations[i]
+
+    def __iter__(self):
+        yield from zip(self.questions, self.explanations)
+        start = len(self.explanations)
+        for i, explanation in iter_explanations(self._format_fn, self._inputs[start:]):
+            self.explanations.append(explanation)
+            yield self.questions[start + i], explanation
+
+
+def session_quiz(key):
+    """The quiz compiled for key in this session, or None if there is none worth keeping."""
+    quiz = st.session_state.setdefault("dojo_quizzes", {}).get(key)
+    # A page that came out empty is built again on the next run rather than shown empty for the whole session
+    if quiz is not None and quiz.done and not quiz.questions:
+        return None
+    return quiz
+
+
+def keep_quiz(key, quiz):
+    st.session_state.setdefault("dojo_quizzes", {})[key] = quiz
+    return quiz
+
+
+@st.fragment
+def answer_check(quiz, i):
+    # The explanation is looked up when drawn: a streamed one may have been formatted since the page was drawn
+    question = quiz.questions[i]
+    stb.single_choice(
+        question.question,
+        question.options,
+        question.correct_index + 1,
+        success=quiz.explanation(i),
+        error=WRONG_ANSWER,
+        button="Check answer"
+    )
+
+
+def draw_quiz(quiz):
+    """Draws each question of quiz as soon as it is ready."""
+    for i, _ in enumerate(quiz):
+        # Fragments are told apart by their position on the page, so each question gets its own container
+        with st.container():
+            answer_check(quiz, i)
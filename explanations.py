@@ -0,0 +1,48 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# How many explanation formatting calls may be in flight at once per page
+EXPLANATION_CONCURRENCY = int(os.environ.get("SARA_EXPLANATION_CONCURRENCY", "4"))
+
+
+def explanation_task(format_fn):
+    """format_fn timed as the "explanation" stage, bound to the calling session for use on a pool thread."""
+    def run(text):
+        with metrics.stage("explanation"):
+            return format_fn(text)
+    return metrics.bind(run)
+
+
+def iter_explanations(format_fn, inputs, max_workers=None):
+    """
+    Formats every explanation input with format_fn on a bounded thread pool.
+
+    All inputs are submitted up front, at most max_workers (default
+    EXPLANATION_CONCURRENCY) run at the same time. Results are yielded as
+    (index, formatted_text) in the original question order, as soon as that
+    question and every question before it is ready, so the caller can render
+    question 1 while the later ones are still being formatted.
+
+    If formatting one input fails, the raw input is yielded for that question
+    instead of breaking the whole page.
+    """
+    inputs = list(inputs)
+    if not inputs:
+        return
+
+    workers = max(1, min(max_workers or EXPLANATION_CONCURRENCY, len(inputs)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sara-explain")
+    try:
+        task = explanation_task(format_fn)
+        futures = [pool.submit(task, text) for text in inputs]
+        for i, future in enumerate(futures):
+            try:
+                yield i, future.result()
+            except Exception as e:
+                print(f"Explanation formatting failed for question {i + 1}: {e}")
+                yield i, inputs[i]
+    finally:
+        # Don't leave queued calls running if the caller stopped early
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,242 @@
+import copy
+import functools
+import html
+import io
+import os
+import random
+import string
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from questions import Question, strip_numbering
+
+# wkhtmltopdf processes rendering PDFs at once, and the most variants one export may ask for
+PDF_RENDER_WORKERS = int(os.environ.get("SARA_PDF_RENDER_WORKERS", "4"))
+MAX_VARIANTS = int(os.environ.get("SARA_MAX_VARIANTS", "50"))
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PDF_MIME = "application/pdf"
+ZIP_MIME = "application/zip"
+FORMATS = ("docx", "pdf")
+OPTION_LETTERS = "ABCD"
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def variant_label(number):
+    """A, B, ..., Z, AA, AB, ... for variant 0, 1, ..."""
+    label = ""
+    number += 1
+    while number:
+        number, rest = divmod(number - 1, 26)
+        label = string.ascii_uppercase[rest] + label
+    return label
+
+
+def shuffle_options(question, rng):
+    order = list(range(len(question.options)))
+    rng.shuffle(order)
+    return Question(
+        question=question.question,
+        options=[question.options[i] for i in order],
+        correct_index=order.index(question.correct_index),
+        reasons=[question.reasons[i] for i in order],
+    )
+
+
+def exam_variants(questions, count, seed=None):
+    """
+    Yields (label, questions) for count candidate variants, one at a time.
+
+    Variant A keeps the generated order; every other variant shuffles the
+    questions and the options within each question, reproducibly for a seed.
+    """
+    for number in range(count):
+        if number == 0:
+            yield variant_label(0), list(questions)
+            continue
+        rng = random.Random(f"{seed}-{number}")
+        variant = [shuffle_options(question, rng) for question in questions]
+        rng.shuffle(variant)
+        yield variant_label(number), variant
+
+
+def _exam_styles(doc):
+    # Paragraph formatting lives in two styles, set up once, instead of on every paragraph
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.shared import Cm, Pt
+
+    styles = doc.styles
+    question_style = styles.add_style("Exam Question", WD_STYLE_TYPE.PARAGRAPH)
+    question_style.base_style = styles["Normal"]
+    question_style.font.bold = True
+    question_style.paragraph_format.space_before = Pt(10)
+    question_style.paragraph_format.space_after = Pt(2)
+    question_style.paragraph_format.keep_with_next = True
+    option_style = styles.add_style("Exam Option", WD_STYLE_TYPE.PARAGRAPH)
+    option_style.base_style = styles["Normal"]
+    option_style.paragraph_format.left_indent = Cm(0.75)
+    option_style.paragraph_format.space_after = Pt(0)
+    return question_style, option_style
+
+
+class _ParagraphWriter:
+    """
+    Appends paragraphs of one style to a document in constant time.
+
+    python-docx's add_paragraph() looks up the style among all of them and
+    scans the whole body for the section properties on every call, which
+    makes long exams quadratic. This clones a prototype paragraph instead.
+    """
+
+    def __init__(self, doc, style):
+        from docx.text.paragraph import Paragraph
+
+        self._paragraph = Paragraph
+        self._body = doc._body
+        self._sect_pr = doc.element.body.sectPr
+        self._prototype = doc.add_paragraph("", style)._p
+        self._prototype.getparent().remove(self._prototype)
+        self._prototype.add_r()
+
+    def add(self, text):
+        p = copy.deepcopy(self._prototype)
+        p.r_lst[0].text = text
+        self._sect_pr.addprevious(p)
+        return self._paragraph(p, self._body)
+
+
+def _add_questions(doc, questions, question_style, option_style):
+    add_question = _ParagraphWriter(doc, question_style).add
+    add_option = _ParagraphWriter(doc, option_style).add
+    for number, question in enumerate(questions, start=1):
+        add_question(f"{number}. {strip_numbering(question.question)}")
+        last = len(question.options) - 1
+        for i, (letter, option) in enumerate(zip(OPTION_LETTERS, question.options)):
+            paragraph = add_option(f"{letter}. {option}")
+            if i == last:
+                paragraph.paragraph_format.keep_with_next = False
+
+
+def _add_answer_key(doc, questions, title):
+    doc.add_heading(f"{title} - Answer key", level=1)
+    add_answer = _ParagraphWriter(doc, doc.styles["Normal"]).add
+    for number, question in enumerate(questions, start=1):
+        paragraph = add_answer("")
+        paragraph.add_run(f"{number}. {OPTION_LETTERS[question.correct_index]}").bold = True
+        paragraph.add_run(f"  {question.reasons[question.correct_index]}")
+
+
+def exam_docx(questions, title, paper=True, answer_key=True):
+    """The exam as .docx bytes: the question paper, its answer key (on a new page), or both."""
+    # python-docx is imported on the first export, not by every script run that imports this module
+    from docx import Document
+    from docx.enum.text import WD_BREAK
+
+    doc = Document()
+    question_style, option_style = _exam_styles(doc)
+    if paper:
+        doc.add_heading(title, level=0)
+        _add_questions(doc, questions, question_style, option_style)
+    if paper and answer_key:
+        doc.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+    if answer_key:
+        _add_answer_key(doc, questions, title)
+    file_stream = io.BytesIO()
+    doc.save(file_stream)
+    return file_stream.getvalue()
+
+
+def exam_html(questions, title, paper=True, answer_key=True):
+    """The same layout as exam_docx() as a standalone HTML page, for wkhtmltopdf."""
+    escape = html.escape
+    parts = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><style>"
+        "body{font-family:sans-serif;font-size:11pt} li.q{margin-top:10pt;font-weight:bold;page-break-inside:avoid}"
+        "ol.o{list-style-type:upper-alpha;font-weight:normal} .key{page-break-before:always}"
+        "</style></head><body>"
+    ]
+    if paper:
+        parts.append(f"<h1>{escape(title)}</h1><ol>")
+        for question in questions:
+            parts.append(f"<li class='q'>{escape(strip_numbering(question.question))}<ol class='o'>")
+            parts.extend(f"<li>{escape(option)}</li>" for option in question.options)
+            parts.append("</ol></li>")
+        parts.append("</ol>")
+    if answer_key:
+        parts.append(f"<div class='{'key' if paper else ''}'><h2>{escape(title)} - Answer key</h2><ol>")
+        for question in questions:
+            letter = OPTION_LETTERS[question.correct_index]
+            parts.append(f"<li><b>{letter}</b> {escape(question.reasons[question.correct_index])}</li>")
+        parts.append("</ol></div>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=1)
+def pdf_available():
+    """Whether the wkhtmltopdf binary pdfkit drives is installed."""
+    import pdfkit
+    try:
+        pdfkit.configuration()
+    except OSError:
+        return False
+    return True
+
+
+def _render_pdf(page):
+    import pdfkit
+    return pdfkit.from_string(page, False, options={"quiet": "", "encoding": "UTF-8"})
+
+
+def _submit_pdf(page):
+    # wkhtmltopdf runs as a subprocess, so a few threads render that many PDFs in parallel
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ThreadPoolExecutor(max_workers=PDF_RENDER_WORKERS, thread_name_prefix="sara-pdf")
+    return _pdf_pool.submit(metrics.bind(_render_pdf), page)
+
+
+def export_exam(questions, title="Exam", variants=1, formats=("docx",), seed=None):
+    """
+    Exports questions as structured exam documents; returns (file_name, mime, data).
+
+    One variant in one format is a single file with the answer key on its
+    last page. Otherwise the result is a .zip holding, for every variant, the
+    question paper and a separate answer key in each format. Variants are
+    built one at a time and written into the archive as they are done, while
+    their PDFs render concurrently on the PDF pool.
+    """
+    formats = [f for f in FORMATS if f in formats]
+    if not formats:
+        raise ValueError("choose at least one export format")
+    if not 1 <= variants <= MAX_VARIANTS:
+        raise ValueError(f"variants must be between 1 and {MAX_VARIANTS}")
+    if "pdf" in formats and not pdf_available():
+        raise RuntimeError("PDF export needs wkhtmltopdf installed on the server.")
+
+    with metrics.stage("export", questions=len(questions), variants=variants, formats=",".join(formats)):
+        if variants == 1 and len(formats) == 1:
+            if formats == ["docx"]:
+                return "exam.docx", DOCX_MIME, exam_docx(questions, title)
+            return "exam.pdf", PDF_MIME, _submit_pdf(exam_html(questions, title)).result()
+
+        buffer = io.BytesIO()
+        pdfs = []
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for label, variant in exam_variants(questions, variants, seed):
+                variant_title = f"{title} - Variant {label}"
+                for part, paper in (("", True), ("_answers", False)):
+                    name = f"variant_{label}{part}"
+                    if "pdf" in formats:
+                        pdfs.append((f"{name}.pdf", _submit_pdf(exam_html(variant, variant_title, paper, not paper))))
+                    if "docx" in formats:
+                        # .docx is already deflated, compressing it again only costs time
+                        archive.writestr(f"{name}.docx", exam_docx(variant, variant_title, paper, not paper), zipfile.ZIP_STORED)
+            for name, future in pdfs:
+                archive.writestr(name, future.result(), zipfile.ZIP_DEFLATED)
+        return "exam_variants.zip", ZIP_MIME, buffer.getvalue()
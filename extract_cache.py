@@ -0,0 +1,178 @@
+import hashlib
+import os
+import threading
+
+import metrics
+from shared_store import shared_store
+
+# Where extracted text is kept between restarts, and how much disk it may use
+CACHE_DIR = os.environ.get(
+    "SARA_EXTRACT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "sara", "extract"),
+)
+CACHE_MAX_BYTES = int(os.environ.get("SARA_EXTRACT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def content_key(data, version):
+    """Hash of the uploaded file bytes plus the extractor version that produced the text."""
+    digest = hashlib.sha256()
+    digest.update(version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of extracted document text on local disk.
+
+    Entries are plain UTF-8 files named after content_key(), so identical
+    uploads hit the cache from any session, process or restart. A hit bumps
+    the file's mtime; when the directory grows past max_bytes the least
+    recently used files are deleted first.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another process in between, the text is still good
+        return text
+
+    def _write(self, key, text):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        # Atomic, so concurrent readers never see a half written entry
+        os.replace(tmp_path, path)
+
+    def put(self, key, text):
+        self._write(key, text)
+        self._evict()
+
+    def put_many(self, items):
+        """Stores (key, text) pairs, scanning the directory for eviction once instead of after each."""
+        items = list(items)
+        for key, text in items:
+            self._write(key, text)
+        if items:
+            self._evict()
+
+    def get_or_extract(self, data, extract_fn, version):
+        """Returns the cached text for these bytes, running extract_fn(data) only on a miss."""
+        key = content_key(data, version)
+        text = self.get(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.cache_result("extract", hit=text is not None)
+        if text is None:
+            text = extract_fn(data)
+            self.put(key, text)
+        return text
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".txt"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        # Oldest first until we are back under budget
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SharedExtractionCache(ExtractionCache):
+    """
+    The same cache kept in the shared store, for replicas that should extract each upload once between them.
+
+    Eviction is the store's: extracted text shares its byte budget with the
+    other cached text, least recently used first.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def evictions(self):
+        # Counted by the store: extracted texts this process's writes pushed out of it
+        return self.store.stats().get("extract", {}).get("evictions", 0)
+
+    def get(self, key):
+        return self.store.get("extract", key, record=False)
+
+    def put(self, key, text):
+        self.store.put("extract", key, text)
+
+    def put_many(self, items):
+        self.store.put_many("extract", items)
+
+    def get_or_extract(self, data, extract_fn, version):
+        # Through the store's lease, so replicas given the same upload at once extract it once
+        extracted = []
+
+        def extract():
+            extracted.append(True)
+            return extract_fn(data)
+
+        text = self.store.get_or_compute("extract", content_key(data, version), extract)
+        with self._lock:
+            if extracted:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.cache_result("extract", hit=not extracted)
+        return text
+
+
+extraction_cache = SharedExtractionCache(shared_store) if shared_store is not None else ExtractionCache()
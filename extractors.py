@@ -0,0 +1,169 @@
+"""
+Text extractors for uploaded documents, keyed by file type.
+
+Each extractor yields the document's text piece by piece (PDF pages, DOCX
+paragraphs, PPTX slides) and imports its parsing library only when the
+first document of its type arrives, so a Streamlit script that imports
+this module pays nothing for formats nobody uploads.
+"""
+import importlib.metadata
+import io
+import os
+import posixpath
+import re
+import zipfile
+
+import metrics
+from normalize import NORMALIZE, NORMALIZER_VERSION, normalize_pages
+
+# Bump when an extractor's output changes, so stale cached text is not reused
+EXTRACTORS_VERSION = 1
+
+WORD_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+DRAWING_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+PRESENTATION_NS = "http://schemas.openxmlformats.org/presentationml/2006/main"
+RELATIONSHIPS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+
+class UnsupportedDocument(ValueError):
+    pass
+
+
+class Extractor:
+    def __init__(self, kind, iter_text, requires, paged):
+        self.kind = kind
+        self.iter_text = iter_text
+        self.requires = requires
+        self.paged = paged
+        self._version = None
+
+    @property
+    def version(self):
+        # From the installed package metadata, which doesn't import the library itself
+        if self._version is None:
+            library = importlib.metadata.version(self.requires)
+            self._version = f"{self.kind}-{self.requires}-{library}-{EXTRACTORS_VERSION}"
+        return self._version
+
+    @property
+    def text_version(self):
+        """Cache version of extract_text()'s output, which also depends on the normalizer."""
+        return f"{self.version}-norm{NORMALIZER_VERSION}" if NORMALIZE else self.version
+
+    def extract_text(self, data):
+        """Extracts the whole document, normalized for prompts unless SARA_NORMALIZE=0."""
+        if not NORMALIZE:
+            return "".join(self.iter_text(data))
+        text, report = normalize_pages(self.iter_text(data), paged=self.paged)
+        metrics.record_normalization(self.kind, report)
+        print(f"Normalized {self.kind} text: {report}")
+        return text
+
+
+EXTRACTORS = {}
+
+
+def register(kind, requires, paged=False):
+    """
+    Registers iter_text(data) as the extractor for kind; requires names the package it parses with.
+
+    paged extractors yield one page or slide per piece, which lets the
+    normalizer recognise running headers and footers.
+    """
+    def decorate(iter_text):
+        EXTRACTORS[kind] = Extractor(kind, iter_text, requires, paged)
+        return iter_text
+    return decorate
+
+
+def document_kind(file_name, data=b""):
+    """The registry key for an upload: its extension, or a sniff of its content when that is missing or unknown."""
+    kind = os.path.splitext(file_name or "")[1].lower().lstrip(".")
+    if kind in EXTRACTORS:
+        return kind
+    if data[:5] == b"%PDF-":
+        return "pdf"
+    if data[:4] == b"PK\x03\x04":
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            names = set(archive.namelist())
+        if "word/document.xml" in names:
+            return "docx"
+        if "ppt/presentation.xml" in names:
+            return "pptx"
+    raise UnsupportedDocument(f"unsupported document type: {file_name or 'unknown'}")
+
+
+def extractor_for(kind):
+    try:
+        return EXTRACTORS[kind]
+    except KeyError:
+        raise UnsupportedDocument(f"unsupported document type: {kind}") from None
+
+
+@register("pdf", requires="PyPDF2", paged=True)
+def iter_pdf_text(data):
+    # Pages unchanged since an earlier upload, e.g. the previous version of a revised SOP, aren't extracted again
+    from extract_cache import extraction_cache
+    from pdf_extract import iter_pages_incremental
+    for _, text in iter_pages_incremental(data, extraction_cache, EXTRACTORS["pdf"].version):
+        yield text
+
+
+def _iter_paragraphs(stream, paragraph_tag, text_tag, separators=None):
+    # Streams the part instead of building its whole tree, clearing every paragraph once it is read
+    from lxml import etree
+    separators = separators or {}
+    parts = []
+    for _, element in etree.iterparse(stream, events=("end",)):
+        if element.tag == text_tag:
+            parts.append(element.text or "")
+        elif element.tag in separators:
+            parts.append(separators[element.tag])
+        elif element.tag == paragraph_tag:
+            text = "".join(parts).strip()
+            parts = []
+            element.clear()
+            if text:
+                yield text
+
+
+@register("docx", requires="lxml")
+def iter_docx_text(data):
+    """Yields every non-empty paragraph of the body, tables included, in document order."""
+    w = f"{{{WORD_NS}}}"
+    with zipfile.ZipFile(io.BytesIO(data)) as archive, archive.open("word/document.xml") as stream:
+        for text in _iter_paragraphs(stream, f"{w}p", f"{w}t", {f"{w}tab": "\t", f"{w}br": "\n", f"{w}cr": "\n"}):
+            yield text + "\n"
+
+
+def _slide_parts(archive):
+    # Slide order is the order of sldIdLst in presentation.xml, resolved through its relationships
+    from lxml import etree
+    rels = etree.fromstring(archive.read("ppt/_rels/presentation.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{{{PACKAGE_RELS_NS}}}Relationship")}
+    presentation = etree.fromstring(archive.read("ppt/presentation.xml"))
+    parts = []
+    for slide_id in presentation.iter(f"{{{PRESENTATION_NS}}}sldId"):
+        target = targets.get(slide_id.get(f"{{{RELATIONSHIPS_NS}}}id"))
+        if target and target.startswith("/"):
+            parts.append(target[1:])
+        elif target:
+            parts.append(posixpath.normpath(posixpath.join("ppt", target)))
+    if not parts:
+        # No usable relationships: fall back to the slide file numbering
+        parts = sorted((n for n in archive.namelist() if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)),
+                       key=lambda n: int(re.search(r"\d+", n.rsplit("/", 1)[1]).group()))
+    return parts
+
+
+@register("pptx", requires="lxml", paged=True)
+def iter_pptx_text(data):
+    """Yields the text of every slide in presentation order, one paragraph per line."""
+    a = f"{{{DRAWING_NS}}}"
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for part in _slide_parts(archive):
+            with archive.open(part) as stream:
+                lines = list(_iter_paragraphs(stream, f"{a}p", f"{a}t", {f"{a}br": "\n"}))
+            if lines:
+                yield "\n".join(lines) + "\n\n"
@@ -0,0 +1,254 @@
+"""
+Hedged generation requests with a latency-aware model fallback ladder.
+
+A few o1-mini and gpt-4 completions take many times longer than the rest,
+and they set the tail latency of Dojo pages and exam shards. A call that
+has run past its model's hedge delay (the HEDGE_PERCENTILE of its recent
+latencies, capped at the configured delay) gets a second request, sent to
+whichever model on its ladder currently answers fastest. The first valid,
+parseable response wins and the other request is cut off. A primary that
+fails or returns nothing usable is hedged straight away.
+
+Hedges are paid from a budget that grows by MAX_HEDGE_RATE per call, so
+over time at most that share of calls costs a second request. Every call
+also has a deadline, after which it gives up with DeadlineExceeded.
+
+Requests go out streamed, so a loser can be stopped by closing its
+connection instead of running to the end.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import metrics
+from llm_client import PRIORITY_DOJO, PRIORITY_TEST, chat_completion
+
+# Hedge slow calls at all; deadlines apply either way
+HEDGE = os.environ.get("SARA_HEDGE", "1") != "0"
+
+# Models a slow call may be hedged to, the model itself included (a fresh request to the same model). Every rung must
+# accept the call's messages and parameters: o1-mini takes neither system messages nor a temperature.
+LADDERS = {
+    "o1-mini": os.environ.get("SARA_O1_MINI_LADDER", "o1-mini,gpt-4o-mini").split(","),
+    "gpt-4": os.environ.get("SARA_GPT4_LADDER", "gpt-4,gpt-4o-mini").split(","),
+}
+# Longest wait before hedging; used as it is until a model has LATENCY_SAMPLES_MIN recent latencies
+HEDGE_DELAY_SECONDS = {
+    "o1-mini": float(os.environ.get("SARA_O1_MINI_HEDGE_DELAY", "40")),
+    "gpt-4": float(os.environ.get("SARA_GPT4_HEDGE_DELAY", "30")),
+}
+DEFAULT_HEDGE_DELAY_SECONDS = 30.0
+MIN_HEDGE_DELAY_SECONDS = float(os.environ.get("SARA_MIN_HEDGE_DELAY", "2"))
+HEDGE_PERCENTILE = float(os.environ.get("SARA_HEDGE_PERCENTILE", "95"))
+# Long-run share of calls that may be hedged, and how many hedges may be spent in a burst
+MAX_HEDGE_RATE = float(os.environ.get("SARA_MAX_HEDGE_RATE", "0.1"))
+HEDGE_BURST = 2.0
+
+# Per-call deadlines by priority: an interactive page gives up sooner than an exam shard
+DEADLINE_SECONDS = {
+    PRIORITY_DOJO: float(os.environ.get("SARA_DOJO_DEADLINE", "120")),
+    PRIORITY_TEST: float(os.environ.get("SARA_TEST_DEADLINE", "300")),
+}
+
+LATENCY_WINDOW = 200
+LATENCY_SAMPLES_MIN = 20
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class LatencyTracker:
+    """Full-response latencies of the most recent generation calls, per model."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, seconds):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, model, pct):
+        """The pct-th percentile of model's recent latencies, or None with fewer than LATENCY_SAMPLES_MIN of them."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < LATENCY_SAMPLES_MIN:
+            return None
+        return samples[min(len(samples) - 1, int(pct / 100 * len(samples)))]
+
+
+class _Attempt:
+    def __init__(self, model, role):
+        self.model = model
+        self.role = role
+        self.started = time.monotonic()
+        self.cancelled = threading.Event()
+        self.stream = None
+
+    def cancel(self):
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception as e:
+                print(f"Closing a cancelled {self.model} request failed: {e}")
+
+
+class HedgePolicy:
+    """Decides when and where to hedge, and keeps the counts behind those decisions."""
+
+    def __init__(self):
+        self.latencies = LatencyTracker()
+        self._budget = HEDGE_BURST
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "hedged": 0, "fallbacks": 0, "hedge_wins": 0, "primary_wins": 0,
+                       "deadline_exceeded": 0}
+
+    def hedge_delay(self, model):
+        configured = HEDGE_DELAY_SECONDS.get(model, DEFAULT_HEDGE_DELAY_SECONDS)
+        recent = self.latencies.percentile(model, HEDGE_PERCENTILE)
+        return configured if recent is None else min(configured, max(MIN_HEDGE_DELAY_SECONDS, recent))
+
+    def hedge_target(self, model):
+        """The rung of model's ladder expected to answer fastest; a rung without enough samples yet goes first."""
+        ladder = LADDERS.get(model) or [model]
+        medians = {rung: self.latencies.percentile(rung, 50) for rung in ladder}
+        untried = [rung for rung in ladder if rung != model and medians[rung] is None]
+        if untried:
+            return untried[0]
+        return min(ladder, key=lambda rung: float("inf") if medians[rung] is None else medians[rung])
+
+    def start_call(self):
+        with self._lock:
+            self._stats["calls"] += 1
+            self._budget = min(HEDGE_BURST, self._budget + MAX_HEDGE_RATE)
+
+    def take_hedge(self):
+        """Spends one hedge from the budget; False when it is used up."""
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            self._stats["hedged"] += 1
+            return True
+
+    def count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+policy = HedgePolicy()
+
+
+def _run_attempt(attempt, build_request, priority, results):
+    try:
+        messages, kwargs = build_request(attempt.model)
+        if attempt.cancelled.is_set():
+            return
+        attempt.stream = chat_completion(attempt.model, messages, priority=priority, cancelled=attempt.cancelled,
+                                         stream=True, **kwargs)
+        # Closed while it was being opened: cancel() didn't see it yet
+        if attempt.cancelled.is_set():
+            attempt.stream.close()
+            return
+        parts = []
+        for chunk in attempt.stream:
+            if attempt.cancelled.is_set():
+                return
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+        policy.latencies.observe(attempt.model, time.monotonic() - attempt.started)
+        results.put((attempt, "".join(parts), None))
+    except Exception as e:
+        # A cancelled request fails as its connection is closed under it; that's not an error
+        if not attempt.cancelled.is_set():
+            results.put((attempt, None, e))
+
+
+def hedged_completion(model, build_request, validate, priority=PRIORITY_DOJO, deadline=None):
+    """
+    The text of the first valid response to a generation request for model.
+
+    build_request(rung) returns (messages, chat_completion() keyword
+    arguments) for the request to that model; validate(text) tells whether
+    a response is usable. When no response is valid, the text of one that
+    arrived is returned if there was one, otherwise the first error is
+    raised. deadline defaults to DEADLINE_SECONDS for the priority;
+    background calls have none and are made once, without a hedge.
+    """
+    deadline = deadline or DEADLINE_SECONDS.get(priority)
+    if deadline is None:
+        messages, kwargs = build_request(model)
+        completion = chat_completion(model, messages, priority=priority, **kwargs)
+        return completion.choices[0].message.content
+
+    policy.start_call()
+    results = queue.Queue()
+    started = time.monotonic()
+    attempts = []
+
+    def launch(rung, role):
+        attempt = _Attempt(rung, role)
+        attempts.append(attempt)
+        thread = threading.Thread(target=metrics.bind(_run_attempt), args=(attempt, build_request, priority, results),
+                                  name="sara-hedge", daemon=True)
+        thread.start()
+
+    def hedge(reason):
+        if reason != "slow":
+            policy.count("fallbacks")
+        target = policy.hedge_target(model)
+        metrics.record_hedge(model, target, reason)
+        launch(target, "hedge")
+
+    launch(model, "primary")
+    hedge_at = started + policy.hedge_delay(model) if HEDGE else float("inf")
+    unusable = []
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= started + deadline:
+                policy.count("deadline_exceeded")
+                metrics.record_deadline_exceeded(model, now - started)
+                raise DeadlineExceeded(f"no usable {model} response within {deadline:.0f}s")
+            try:
+                attempt, text, error = results.get(timeout=max(0.0, min(started + deadline, hedge_at) - now))
+            except queue.Empty:
+                if time.monotonic() >= hedge_at:
+                    hedge_at = float("inf")
+                    if policy.take_hedge():
+                        hedge("slow")
+                continue
+
+            if error is None and validate(text):
+                hedged = len(attempts) > 1
+                if hedged:
+                    policy.count(f"{attempt.role}_wins")
+                metrics.record_hedged_call(model, attempt.role, hedged, time.monotonic() - started)
+                return text
+
+            unusable.append((attempt, text, error))
+            if HEDGE and len(attempts) == 1:
+                # Failed or unparseable: no point waiting for the hedge delay. This replaces a call rather than
+                # doubling one, so it isn't charged to the hedge budget.
+                hedge_at = float("inf")
+                hedge("failed" if error else "invalid")
+            elif len(unusable) == len(attempts):
+                metrics.record_hedged_call(model, "none", len(attempts) > 1, time.monotonic() - started)
+                # What a single request would have given: a response to salvage what it can from, or the error
+                texts = [text for _, text, error in unusable if error is None]
+                if texts:
+                    return texts[0]
+                raise unusable[0][2]
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
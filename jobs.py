@@ -0,0 +1,287 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+import metrics
+from shared_store import REPLICA, shared_store
+
+# Worker threads shared by every session, and how many unfinished jobs one session may have
+JOB_WORKERS = int(os.environ.get("SARA_JOB_WORKERS", "2"))
+JOBS_PER_OWNER = int(os.environ.get("SARA_JOBS_PER_SESSION", "1"))
+MAX_QUEUED_JOBS = int(os.environ.get("SARA_MAX_QUEUED_JOBS", "50"))
+# Finished jobs stay retrievable by id for this long
+JOB_RETENTION_SECONDS = float(os.environ.get("SARA_JOB_RETENTION_SECONDS", "3600"))
+# With a shared store, how often a job's progress is written there and a cancel from another replica is looked for
+JOB_SYNC_SECONDS = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobLimitError(Exception):
+    """Raised by submit() when the owner or the whole queue already has too many jobs."""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """One unit of background work; fn(job) runs on a worker thread and its return value becomes result."""
+
+    # A job read back from the shared store, run by another replica
+    remote = False
+
+    def __init__(self, owner, fn, description="", store=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.fn = fn
+        self.description = description
+        self.state = QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for a free worker..."
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._store = store
+        self._synced = 0.0
+        self._cancel_checked = 0.0
+
+    @property
+    def active(self):
+        return self.state in (QUEUED, RUNNING)
+
+    def set_progress(self, fraction, message=None):
+        self.progress = min(1.0, max(0.0, fraction))
+        if message is not None:
+            self.message = message
+        if time.monotonic() - self._synced >= JOB_SYNC_SECONDS:
+            self.publish()
+
+    def cancel_requested(self):
+        # A cancel pressed on another replica only reaches this one through the store
+        if self._store is not None and not self._cancel.is_set() and not self.remote:
+            now = time.monotonic()
+            if now - self._cancel_checked >= JOB_SYNC_SECONDS:
+                self._cancel_checked = now
+                if self._store.job_cancel_requested(self.id):
+                    self._cancel.set()
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self.cancel_requested():
+            raise JobCancelled()
+
+    def publish(self):
+        """Writes the job's state to the shared store, if there is one, for the other replicas to read."""
+        if self._store is None or self.remote:
+            return
+        self._synced = time.monotonic()
+        result = dict(self.result) if isinstance(self.result, dict) else self.result
+        data = result.pop("data", None) if isinstance(result, dict) else None
+        try:
+            self._store.save_job({
+                "id": self.id, "owner": self.owner, "description": self.description, "state": self.state,
+                "progress": self.progress, "message": self.message,
+                "result": json.dumps(result) if result is not None else None, "data": data,
+                "created": self.created, "finished": self.finished, "replica": REPLICA,
+            })
+        except Exception as e:
+            # The job itself goes on; only other replicas miss this update
+            print(f"Publishing job {self.id[:8]} failed: {e}")
+
+    @classmethod
+    def from_record(cls, record, store):
+        """A read-only snapshot of a job another replica runs."""
+        job = cls(record["owner"], None, record["description"], store)
+        job.remote = True
+        job.id = record["id"]
+        job.state = record["state"]
+        job.progress = record["progress"]
+        job.message = record["message"]
+        job.created = record["created"]
+        job.finished = record["finished"]
+        if record["result"] is not None:
+            job.result = json.loads(record["result"])
+            if isinstance(job.result, dict) and record["data"] is not None:
+                job.result["data"] = record["data"]
+        if record["cancel_requested"]:
+            job._cancel.set()
+        if job.active and _replica_gone(record["replica"]):
+            job.state = FAILED
+            job.message = "The server running this job stopped, please generate the exam again."
+        return job
+
+
+def _replica_gone(replica):
+    # Replicas sharing a store run on one host (see shared_store.py), so a dead process means a dead job
+    host, _, pid = replica.rpartition(":")
+    if host != REPLICA.rpartition(":")[0]:
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        return False
+    return False
+
+
+class JobQueue:
+    """
+    Process-wide queue of background jobs, run by a fixed set of worker threads.
+
+    Owners (sessions) are served round-robin, so one owner's queued jobs
+    never hold back another owner's, and each owner may only have
+    JOBS_PER_OWNER unfinished jobs at a time. Cancelling a queued job drops
+    it; a running job stops at its next check_cancelled() / cancel_requested().
+    With a shared store, jobs are published there, so get() and cancel()
+    also work for the jobs of other replicas.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, per_owner=JOBS_PER_OWNER, max_queued=MAX_QUEUED_JOBS, store=shared_store):
+        self.workers = workers
+        self.per_owner = per_owner
+        self.max_queued = max_queued
+        self.store = store
+        self._jobs = OrderedDict()
+        self._queues = OrderedDict()  # owner -> deque of queued jobs, in round-robin order
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, owner, fn, description=""):
+        job = Job(owner, metrics.bind(fn), description, self.store)
+        with self._cond:
+            self._purge()
+            unfinished = sum(1 for j in self._jobs.values() if j.owner == owner and j.active)
+            if unfinished >= self.per_owner:
+                raise JobLimitError(f"Only {self.per_owner} job(s) per session can run at a time.")
+            if sum(len(q) for q in self._queues.values()) >= self.max_queued:
+                raise JobLimitError("Too many jobs are waiting, please try again in a moment.")
+            self._jobs[job.id] = job
+            self._queues.setdefault(owner, deque()).append(job)
+            self._start_workers()
+            self._cond.notify()
+        job.publish()
+        if self.store is not None:
+            self.store.purge_jobs(time.time() - JOB_RETENTION_SECONDS)
+        metrics.trace("job_submitted", job=job.id, description=description)
+        return job
+
+    def get(self, job_id):
+        """The job with this id, from this process or (as a snapshot) from another replica; None if unknown."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            record = self.store.load_job(job_id)
+            if record is not None:
+                job = Job.from_record(record, self.store)
+        return job
+
+    def latest(self, job):
+        """job as it is now: a snapshot of another replica's unfinished job is read again."""
+        if not job.remote or not job.active:
+            return job
+        return self.get(job.id) or job
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                if self.store is not None:
+                    # Another replica's job: it sees the request at its next cancel_requested()
+                    self.store.request_job_cancel(job_id)
+                return
+            if not job.active:
+                return
+            job._cancel.set()
+            if job.state == QUEUED:
+                queue = self._queues[job.owner]
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.owner]
+                self._finish(job, CANCELLED, "Cancelled.")
+        job.publish()
+
+    def queued_ahead(self, job):
+        """Rough number of jobs that will start before this one."""
+        with self._cond:
+            if job.state != QUEUED or job.remote:
+                return 0
+            position = self._queues[job.owner].index(job)
+            return sum(min(len(q), position + 1) for q in self._queues.values()) - 1
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"sara-job-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _next(self):
+        # Round-robin: take the first owner's next job, then move that owner to the back
+        while True:
+            while self._queues:
+                owner, queue = self._queues.popitem(last=False)
+                # An owner whose queued jobs were all cancelled may be left with an empty queue
+                if queue:
+                    job = queue.popleft()
+                    if queue:
+                        self._queues[owner] = queue
+                    return job
+            self._cond.wait()
+
+    def _work(self):
+        while True:
+            try:
+                self._run_next()
+            except Exception as e:
+                # Nothing replaces a worker that dies, so a bug here must not take it down
+                print(f"Job worker {threading.current_thread().name} hit an error: {e}")
+
+    def _run_next(self):
+        with self._cond:
+            job = self._next()
+            job.state = RUNNING
+            job.message = "Starting..."
+        job.publish()
+        started = time.perf_counter()
+        try:
+            result = job.fn(job)
+            job.check_cancelled()
+        except JobCancelled:
+            state, message = CANCELLED, "Cancelled."
+        except Exception as e:
+            print(f"Job {job.id[:8]} ({job.description}) failed: {e}")
+            job.error = e
+            state, message = FAILED, str(e)
+        else:
+            job.result = result
+            job.progress = 1.0
+            state, message = DONE, "Done."
+        with self._cond:
+            self._finish(job, state, message)
+        job.publish()
+        metrics.trace("job_finished", job=job.id, state=state, seconds=round(time.perf_counter() - started, 3))
+
+    def _finish(self, job, state, message):
+        job.state = state
+        job.message = message
+        job.finished = time.time()
+
+    def _purge(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [i for i, j in self._jobs.items() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+        for owner in [o for o, q in self._queues.items() if not q]:
+            del self._queues[owner]
+
+
+job_queue = JobQueue()
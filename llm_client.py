@@ -0,0 +1,332 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+from openai import OpenAI
+
+import metrics
+from retrieval import estimate_tokens
+
+# Lower runs first: interactive Dojo pages go ahead of Test Mode exams, which go ahead of pre-generation
+PRIORITY_DOJO = 0
+PRIORITY_TEST = 1
+PRIORITY_BACKGROUND = 2
+
+# Requests and tokens per minute we allow ourselves per model, shared by every session in the process
+MODEL_LIMITS = {
+    "o1-mini": (int(os.environ.get("SARA_O1_MINI_RPM", "400")), int(os.environ.get("SARA_O1_MINI_TPM", "150000"))),
+    "gpt-4": (int(os.environ.get("SARA_GPT4_RPM", "400")), int(os.environ.get("SARA_GPT4_TPM", "30000"))),
+    "gpt-4o-mini": (int(os.environ.get("SARA_GPT4O_MINI_RPM", "4000")), int(os.environ.get("SARA_GPT4O_MINI_TPM", "1000000"))),
+}
+DEFAULT_LIMITS = (500, 100000)
+
+# Largest prompt sent to each model in one request: its context window less room for the answer. Document
+# passages are fitted to retrieval.CONTEXT_TOKEN_BUDGETS well below this; it catches whatever else grows a prompt.
+MAX_PROMPT_TOKENS = {
+    "o1-mini": int(os.environ.get("SARA_O1_MINI_MAX_PROMPT_TOKENS", "100000")),
+    "gpt-4": int(os.environ.get("SARA_GPT4_MAX_PROMPT_TOKENS", "6000")),
+    "gpt-4o-mini": int(os.environ.get("SARA_GPT4O_MINI_MAX_PROMPT_TOKENS", "100000")),
+}
+DEFAULT_MAX_PROMPT_TOKENS = 6000
+
+# Completion tokens assumed before the real usage is known
+COMPLETION_TOKEN_ESTIMATE = int(os.environ.get("SARA_COMPLETION_TOKEN_ESTIMATE", "3000"))
+
+MAX_ATTEMPTS = int(os.environ.get("SARA_LLM_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = float(os.environ.get("SARA_LLM_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX_SECONDS = float(os.environ.get("SARA_LLM_BACKOFF_MAX", "30.0"))
+
+# Connection pool of the one HTTP client every call goes through
+MAX_CONNECTIONS = int(os.environ.get("SARA_LLM_MAX_CONNECTIONS", "64"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("SARA_LLM_MAX_KEEPALIVE", "32"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("SARA_LLM_KEEPALIVE_EXPIRY", "120"))
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get("SARA_LLM_TIMEOUT", "600"))
+
+
+class PromptTooLong(ValueError):
+    pass
+
+
+class CallCancelled(Exception):
+    """Raised by chat_completion() when its cancelled event was set before the request was sent."""
+
+
+class TokenBucket:
+    """Refills at rate_per_minute up to one minute's worth; the level may go negative when usage is settled late."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        # A single request bigger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class RateLimitScheduler:
+    """
+    Token-bucket admission control for LLM calls, per model.
+
+    acquire() blocks until the model has both a request (RPM) and enough
+    tokens (TPM) left. Waiters are served by priority, then arrival order, so
+    a queued Dojo call never waits behind Test Mode calls for the same model.
+    After a 429 the model is paused for everyone via penalize().
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(MODEL_LIMITS if limits is None else limits)
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._queues = {}
+        self._paused_until = {}
+        self._seq = itertools.count()
+
+    def _buckets_for(self, model):
+        if model not in self._buckets:
+            rpm, tpm = self.limits.get(model, DEFAULT_LIMITS)
+            self._buckets[model] = (TokenBucket(rpm), TokenBucket(tpm))
+        return self._buckets[model]
+
+    def acquire(self, model, tokens, priority=PRIORITY_DOJO):
+        entry = (priority, next(self._seq))
+        with self._cond:
+            queue = self._queues.setdefault(model, [])
+            heapq.heappush(queue, entry)
+            try:
+                while True:
+                    if queue[0] is entry:
+                        # Buckets first: one created after now was read would refill by a negative interval
+                        requests, token_bucket = self._buckets_for(model)
+                        now = time.monotonic()
+                        wait = max(
+                            self._paused_until.get(model, 0.0) - now,
+                            requests.wait_time(1, now),
+                            token_bucket.wait_time(tokens, now),
+                        )
+                        if wait <= 0:
+                            requests.take(1)
+                            token_bucket.take(tokens)
+                            return
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            finally:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+
+    def settle(self, model, token_delta):
+        """Corrects the token bucket once the real usage of a call is known."""
+        with self._cond:
+            self._buckets_for(model)[1].take(token_delta)
+            self._cond.notify_all()
+
+    def penalize(self, model, seconds):
+        with self._cond:
+            self._paused_until[model] = max(self._paused_until.get(model, 0.0), time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def queued(self, model):
+        with self._cond:
+            return len(self._queues.get(model, ()))
+
+
+scheduler = RateLimitScheduler()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _api_key():
+    key = os.environ.get("OPENAI_API_KEY")
+    if key:
+        return key
+    import streamlit as st
+    return st.secrets["OpenAI_Key"]
+
+
+def get_client():
+    """The process-wide OpenAI client, so keep-alive connections and TLS sessions are reused by every call."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+                ),
+                timeout=httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=10.0),
+            )
+            # base_url falls back to OPENAI_BASE_URL, which is how a local stub server is swapped in.
+            # Retries are ours (below), so they go through the scheduler too.
+            _client = OpenAI(api_key=_api_key(), http_client=http_client, max_retries=0)
+        return _client
+
+
+def backoff_delay(attempt, retry_after=None):
+    # Full jitter, so sessions that were throttled together don't come back together
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _retry_after(error):
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _stream_usage(chunk):
+    # Only the last chunk has usage, and this SDK version keeps it as a plain dict
+    usage = getattr(chunk, "usage", None)
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    if usage is not None:
+        return usage.prompt_tokens, usage.completion_tokens
+    return None
+
+
+class MeteredStream:
+    """
+    The chunks of a completion stream; tokens and latency are recorded, and the scheduler settled, when it ends.
+
+    The request asks for usage on its last chunk. A stream closed before
+    that (or an endpoint that doesn't send it) is settled with completion
+    tokens estimated from the text received.
+    """
+
+    def __init__(self, stream, model, started, prompt_tokens, estimated):
+        self._stream = stream
+        self.model = model
+        self.started = started
+        self.prompt_tokens = prompt_tokens
+        self.estimated = estimated
+        self._iterating = False
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        self._iterating = True
+        first_token = None
+        parts = []
+        usage = None
+        try:
+            for chunk in self._stream:
+                usage = _stream_usage(chunk) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        metrics.LLM_FIRST_TOKEN_SECONDS.labels(self.model).observe(first_token - self.started)
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk
+        finally:
+            self._finish(usage, "".join(parts))
+
+    def _finish(self, usage, text):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        prompt_tokens, completion_tokens = usage or (self.prompt_tokens, estimate_tokens(text))
+        scheduler.settle(self.model, prompt_tokens + completion_tokens - self.estimated)
+        metrics.record_llm_call(self.model, time.perf_counter() - self.started, prompt_tokens, completion_tokens,
+                                stream=True, estimated=usage is None)
+
+    def close(self):
+        # Drops the connection, which also stops the generation server-side; may be called from another thread
+        self._stream.close()
+        if not self._iterating:
+            # Never read, so nothing else settles it
+            self._finish(None, "")
+
+
+def chat_completion(model, messages, priority=PRIORITY_DOJO, cancelled=None, **kwargs):
+    """
+    client.chat.completions.create() through the shared client and the rate-limit scheduler.
+
+    Rate limits, timeouts, connection errors and 5xx responses are retried
+    with jittered exponential backoff, up to MAX_ATTEMPTS. With stream=True
+    a MeteredStream over the stream's chunks is returned. Latency, tokens,
+    retries and failures are recorded in metrics. A prompt over the model's
+    MAX_PROMPT_TOKENS raises PromptTooLong without being sent. If the
+    threading.Event cancelled is set by the time the scheduler admits the
+    call, CallCancelled is raised instead of sending it.
+    """
+    prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+    limit = MAX_PROMPT_TOKENS.get(model, DEFAULT_MAX_PROMPT_TOKENS)
+    if prompt_tokens > limit:
+        error = PromptTooLong(f"prompt of ~{prompt_tokens} tokens is over the {limit} token limit for {model}")
+        metrics.record_llm_failure(model, error)
+        raise error
+    estimated = prompt_tokens + COMPLETION_TOKEN_ESTIMATE
+    if kwargs.get("stream"):
+        # Usage on the last chunk, so the scheduler is settled with what the stream really used
+        extra_body = dict(kwargs.get("extra_body") or {}, stream_options={"include_usage": True})
+        kwargs = dict(kwargs, extra_body=extra_body)
+    last_error = None
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            metrics.record_llm_retry(model, _retry_reason(last_error))
+        scheduler.acquire(model, estimated, priority)
+        if cancelled is not None and cancelled.is_set():
+            # Cancelled while waiting for the scheduler: nothing is sent, so the tokens go back
+            scheduler.settle(model, -estimated)
+            raise CallCancelled(f"{model} call cancelled before it was sent")
+        started = time.perf_counter()
+        try:
+            completion = get_client().chat.completions.create(model=model, messages=messages, **kwargs)
+        except Exception as e:
+            # A failed attempt has no usage to settle, so its tokens go back before the next one takes more
+            scheduler.settle(model, -estimated)
+            if isinstance(e, openai.RateLimitError):
+                last_error = e
+                # Everyone calling this model backs off, not just this session
+                scheduler.penalize(model, backoff_delay(attempt, _retry_after(e)))
+                continue
+            if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+                last_error = e
+                time.sleep(backoff_delay(attempt))
+                continue
+            metrics.record_llm_failure(model, e)
+            raise
+
+        if kwargs.get("stream"):
+            return MeteredStream(completion, model, started, prompt_tokens, estimated)
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            scheduler.settle(model, usage.total_tokens - estimated)
+            metrics.record_llm_call(model, time.perf_counter() - started, usage.prompt_tokens, usage.completion_tokens)
+        else:
+            metrics.record_llm_call(model, time.perf_counter() - started, prompt_tokens, 0, estimated=True)
+        return completion
+    metrics.record_llm_failure(model, last_error)
+    raise last_error
+
+
+def _retry_reason(error):
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    return "server_error"
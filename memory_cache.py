@@ -0,0 +1,221 @@
+import functools
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from shared_store import shared_store
+
+# All in-process caches together may hold this much, least recently used entries go first
+CACHE_BUDGET_BYTES = int(float(os.environ.get("SARA_CACHE_BUDGET_MB", "256")) * 1024 * 1024)
+# Entries older than this are recomputed; 0 keeps them until they are evicted
+CACHE_TTL_SECONDS = float(os.environ.get("SARA_CACHE_TTL_SECONDS", str(6 * 3600)))
+# Strings longer than this are keyed by a digest instead of by themselves
+KEY_HASH_MIN_CHARS = 1024
+
+
+class HashedText(str):
+    """A str that carries a digest identifying its content, so cache keys for it cost nothing to compute."""
+
+    def __new__(cls, text, digest=None):
+        self = super().__new__(cls, text)
+        self.digest = digest or _digest(text)
+        return self
+
+
+def _digest(value):
+    data = value.encode("utf-8", "surrogatepass") if isinstance(value, str) else bytes(value)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _code_fingerprint(code):
+    # Bytecode and constants, recursing into nested functions (whose repr would include a memory address)
+    parts = [code.co_code]
+    for const in code.co_consts:
+        parts.append(_code_fingerprint(const) if hasattr(const, "co_code") else repr(const).encode("utf-8"))
+    return b"\0".join(parts)
+
+
+def key_part(value):
+    """A cheap, hashable stand-in for one argument."""
+    if isinstance(value, HashedText):
+        return ("h", value.digest)
+    if isinstance(value, (str, bytes)):
+        return value if len(value) < KEY_HASH_MIN_CHARS else ("d", _digest(value))
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (tuple, list)):
+        return tuple(key_part(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, key_part(v)) for k, v in value.items()))
+    raise TypeError(f"can't build a cache key from {type(value).__name__}; pass key=")
+
+
+def deep_sizeof(value):
+    """Approximate memory held by value and everything it references (shared objects counted once)."""
+    seen = set()
+    stack = [value]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+            if isinstance(obj, str) and hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+    return total
+
+
+class MemoryCache:
+    """
+    Byte-accounted in-process cache shared by every cached function.
+
+    Each entry's size is measured once on insert. When the total goes over
+    budget_bytes, the least recently used entries (of any function) are
+    evicted. Entries also expire after their ttl. Values bigger than the
+    whole budget are returned but not kept.
+    """
+
+    def __init__(self, budget_bytes=CACHE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # (name, key) -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._key_locks = {}
+
+    def _name_stats(self, name):
+        if name not in self._stats:
+            self._stats[name] = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "entries": 0, "bytes": 0}
+        return self._stats[name]
+
+    def get(self, name, key, record=True):
+        """Returns (True, value) on a hit, (False, None) otherwise."""
+        with self._lock:
+            stats = self._name_stats(name)
+            entry = self._entries.get((name, key))
+            if entry is not None and entry[2] and entry[2] < time.monotonic():
+                self._remove((name, key), "expirations")
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end((name, key))
+            if record:
+                stats["hits" if entry is not None else "misses"] += 1
+        if record:
+            metrics.cache_result(name, hit=entry is not None)
+        return (True, entry[0]) if entry is not None else (False, None)
+
+    def get_or_compute(self, name, key, compute, ttl=CACHE_TTL_SECONDS, max_entries=None):
+        """The cached value, or compute()'s result; concurrent misses on one key wait for a single compute()."""
+        found, value = self.get(name, key)
+        if found:
+            return value
+        with self._lock:
+            lock, waiters = self._key_locks.get((name, key), (threading.Lock(), 0))
+            self._key_locks[(name, key)] = (lock, waiters + 1)
+        try:
+            with lock:
+                # Another session may have computed it while we waited
+                found, value = self.get(name, key, record=False)
+                if not found:
+                    value = compute()
+                    self.put(name, key, value, ttl=ttl, max_entries=max_entries)
+                return value
+        finally:
+            with self._lock:
+                lock, waiters = self._key_locks[(name, key)]
+                if waiters == 1:
+                    del self._key_locks[(name, key)]
+                else:
+                    self._key_locks[(name, key)] = (lock, waiters - 1)
+
+    def put(self, name, key, value, ttl=CACHE_TTL_SECONDS, max_entries=None):
+        size = deep_sizeof(value)
+        with self._lock:
+            if (name, key) in self._entries:
+                self._remove((name, key))
+            if size > self.budget_bytes:
+                return
+            self._entries[(name, key)] = (value, size, time.monotonic() + ttl if ttl else 0.0)
+            stats = self._name_stats(name)
+            stats["entries"] += 1
+            stats["bytes"] += size
+            self.total_bytes += size
+            if max_entries is not None and stats["entries"] > max_entries:
+                oldest = next(k for k in self._entries if k[0] == name)
+                self._remove(oldest, "evictions")
+            while self.total_bytes > self.budget_bytes:
+                self._remove(next(iter(self._entries)), "evictions")
+        metrics.CACHE_BYTES.set(self.total_bytes)
+
+    def _remove(self, entry_key, reason=None):
+        _, size, _ = self._entries.pop(entry_key)
+        stats = self._name_stats(entry_key[0])
+        stats["entries"] -= 1
+        stats["bytes"] -= size
+        self.total_bytes -= size
+        if reason:
+            stats[reason] += 1
+            metrics.CACHE_EVICTIONS.labels(entry_key[0], reason).inc()
+
+    def clear(self, name=None):
+        with self._lock:
+            for entry_key in [k for k in self._entries if name is None or k[0] == name]:
+                self._remove(entry_key)
+        metrics.CACHE_BYTES.set(self.total_bytes)
+
+    def stats(self):
+        with self._lock:
+            per_name = {name: dict(stats) for name, stats in self._stats.items()}
+            total = self.total_bytes
+        for stats in per_name.values():
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return {"budget_bytes": self.budget_bytes, "total_bytes": total, "caches": per_name}
+
+
+memory_cache = MemoryCache()
+
+
+def cached(name, ttl=CACHE_TTL_SECONDS, max_entries=None, key=None, cache=None, shared=False):
+    """
+    Caches fn's results in memory_cache under name, in place of st.cache_resource.
+
+    Arguments are turned into a key with key_part() unless key(*args, **kwargs)
+    is given. Concurrent calls with the same key, from any session, wait for
+    one computation like st.cache_resource. Exceptions are not cached. The function's code is
+    part of the key, so an edited function (Streamlit reruns the script) never
+    gets results of its old version. With shared=True, for functions returning
+    str, a memory miss is looked up in the shared store (when one is
+    configured) before fn runs, so other replicas' results are reused.
+    """
+    def decorate(fn):
+        version = _digest(_code_fingerprint(fn.__code__))
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache_key = (version, key(*args, **kwargs) if key else (key_part(args), key_part(kwargs)))
+            compute = functools.partial(fn, *args, **kwargs)
+            if shared and shared_store is not None:
+                # Key parts are strings, numbers and digests, so their repr is the same in every replica
+                compute = functools.partial(shared_store.get_or_compute, name, _digest(repr(cache_key)),
+                                            compute, ttl=ttl)
+            return (cache or memory_cache).get_or_compute(
+                name, cache_key, compute, ttl=ttl, max_entries=max_entries)
+
+        wrapper.clear = lambda: (cache or memory_cache).clear(name)
+        return wrapper
+    return decorate
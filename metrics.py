@@ -0,0 +1,160 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Prometheus endpoint on localhost; 0 turns it off
+METRICS_PORT = int(os.environ.get("SARA_METRICS_PORT", "9464"))
+METRICS_ADDR = os.environ.get("SARA_METRICS_ADDR", "127.0.0.1")
+# When set, every session writes its events to <TRACE_DIR>/<session>.jsonl
+TRACE_DIR = os.environ.get("SARA_TRACE_DIR", "")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+
+STAGE_SECONDS = Histogram("sara_stage_seconds", "Time spent per pipeline stage", ["stage"], buckets=_LATENCY_BUCKETS)
+STAGE_FAILURES = Counter("sara_stage_failures_total", "Pipeline stages that raised", ["stage"])
+LLM_SECONDS = Histogram("sara_llm_request_seconds", "LLM call latency, to the full response or the end of the stream",
+                        ["model", "stream"], buckets=_LATENCY_BUCKETS)
+LLM_FIRST_TOKEN_SECONDS = Histogram("sara_llm_first_token_seconds", "Time to the first streamed token",
+                                    ["model"], buckets=_LATENCY_BUCKETS)
+LLM_TOKENS = Counter("sara_llm_tokens_total", "Prompt and completion tokens (estimated for streams)", ["model", "kind"])
+LLM_RETRIES = Counter("sara_llm_retries_total", "LLM calls retried", ["model", "reason"])
+LLM_FAILURES = Counter("sara_llm_failures_total", "LLM calls that failed after every retry", ["model", "error"])
+HEDGE_CALLS = Counter("sara_hedge_policy_calls_total", "Generation calls made under the hedging policy", ["model"])
+HEDGES = Counter("sara_hedges_total", "Second requests fired for a generation call", ["model", "target", "reason"])
+HEDGE_WINS = Counter("sara_hedge_wins_total", "Which request answered first in a hedged call", ["model", "winner"])
+DEADLINES_EXCEEDED = Counter("sara_deadline_exceeded_total", "Generation calls given up at their deadline", ["model"])
+PARSE_REJECTED = Counter("sara_parse_rejected_total", "Malformed questions dropped from model responses")
+DUPLICATE_QUESTIONS = Counter("sara_duplicate_questions_total", "Generated questions dropped as near-duplicates")
+CACHE_REQUESTS = Counter("sara_cache_requests_total", "Cache lookups", ["cache", "result"])
+CACHE_EVICTIONS = Counter("sara_memory_cache_evictions_total", "In-memory cache entries dropped", ["cache", "reason"])
+CACHE_BYTES = Gauge("sara_memory_cache_bytes", "Bytes held by the in-memory cache")
+NORMALIZE_SAVED = Counter("sara_normalize_saved_total", "Document text removed before prompting", ["kind", "unit"])
+NORMALIZE_DROPPED_LINES = Counter("sara_normalize_dropped_lines_total", "Lines dropped from document text", ["reason"])
+
+# The session whose work is running; propagated to worker threads by bind()
+_session = contextvars.ContextVar("sara_session", default=None)
+_server_lock = threading.Lock()
+_server_started = False
+_trace_lock = threading.Lock()
+
+
+def start_server():
+    """Starts the metrics endpoint once per process; safe to call on every Streamlit rerun."""
+    global _server_started
+    with _server_lock:
+        if _server_started or not METRICS_PORT:
+            return
+        _server_started = True
+        try:
+            start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+        except OSError as e:
+            # Another process (e.g. the other Streamlit app) already serves this port
+            print(f"Metrics endpoint not started on {METRICS_ADDR}:{METRICS_PORT}: {e}")
+
+
+def set_session(session_id):
+    _session.set(session_id)
+
+
+def bind(fn):
+    """Wraps fn so it runs under the calling thread's session, for work handed to a thread pool."""
+    session_id = _session.get()
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        token = _session.set(session_id)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _session.reset(token)
+    return bound
+
+
+def trace(event, **fields):
+    """Appends one event to the current session's JSON-lines trace, if tracing is on."""
+    session_id = _session.get()
+    if not TRACE_DIR or session_id is None:
+        return
+    record = {"ts": round(time.time(), 6), "session": session_id, "event": event, **fields}
+    line = json.dumps(record, default=str) + "\n"
+    path = os.path.join(TRACE_DIR, f"{session_id}.jsonl")
+    try:
+        with _trace_lock:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError as e:
+        print(f"Trace write failed: {e}")
+
+
+@contextmanager
+def stage(name, **fields):
+    """Times a block as pipeline stage name; failures are counted and re-raised."""
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(seconds)
+        if not ok:
+            STAGE_FAILURES.labels(name).inc()
+        trace("stage", stage=name, seconds=round(seconds, 6), ok=ok, **fields)
+
+
+def cache_result(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+    trace("cache", cache=cache, hit=hit)
+
+
+def record_normalization(kind, report):
+    NORMALIZE_SAVED.labels(kind, "bytes").inc(max(0, report.bytes_saved))
+    NORMALIZE_SAVED.labels(kind, "tokens").inc(max(0, report.tokens_saved))
+    for reason, count in report.dropped.items():
+        NORMALIZE_DROPPED_LINES.labels(reason).inc(count)
+    trace("normalize", kind=kind, bytes_in=report.bytes_in, bytes_out=report.bytes_out, tokens_in=report.tokens_in,
+          tokens_out=report.tokens_out, dropped=dict(report.dropped), hyphens_joined=report.hyphens_joined)
+
+
+def record_llm_call(model, seconds, prompt_tokens, completion_tokens, stream=False, estimated=False):
+    LLM_SECONDS.labels(model, str(stream).lower()).observe(seconds)
+    LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+    trace("llm", model=model, stream=stream, seconds=round(seconds, 6), prompt_tokens=prompt_tokens,
+          completion_tokens=completion_tokens, estimated=estimated)
+
+
+def record_llm_retry(model, reason):
+    LLM_RETRIES.labels(model, reason).inc()
+    trace("llm_retry", model=model, reason=reason)
+
+
+def record_llm_failure(model, error):
+    LLM_FAILURES.labels(model, type(error).__name__).inc()
+    trace("llm_failure", model=model, error=type(error).__name__, message=str(error))
+
+
+def record_hedge(model, target, reason):
+    HEDGES.labels(model, target, reason).inc()
+    trace("hedge", model=model, target=target, reason=reason)
+
+
+def record_hedged_call(model, winner, hedged, seconds):
+    """A generation call answered by winner ("primary" or "hedge"); wins are only counted for hedged calls."""
+    HEDGE_CALLS.labels(model).inc()
+    if hedged:
+        HEDGE_WINS.labels(model, winner).inc()
+    trace("hedged_call", model=model, winner=winner, hedged=hedged, seconds=round(seconds, 6))
+
+
+def record_deadline_exceeded(model, seconds):
+    HEDGE_CALLS.labels(model).inc()
+    DEADLINES_EXCEEDED.labels(model).inc()
+    trace("deadline_exceeded", model=model, seconds=round(seconds, 6))
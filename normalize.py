@@ -0,0 +1,147 @@
+"""
+Clean-up of extracted document text before it goes into prompts.
+
+PDF text comes out with every page's running header and footer, page
+numbers, table-of-contents lines and words hyphenated across line breaks.
+None of it helps the model, and all of it is paid for in tokens on every
+generation call and pushes real content out of the per-model context
+budget. normalize_pages() drops it page by page and reports what was saved.
+"""
+import os
+import re
+from collections import Counter
+
+from retrieval import estimate_tokens
+
+# Bump when the output changes, so text normalized by an older version is not reused from the cache
+NORMALIZER_VERSION = 1
+NORMALIZE = os.environ.get("SARA_NORMALIZE", "1") != "0"
+
+# Running headers and footers are looked for in this many lines at the top and bottom of each page
+EDGE_LINES = 3
+# ...and are lines found there on at least this share of the pages, and on at least BOILERPLATE_MIN_PAGES of them
+BOILERPLATE_MIN_SHARE = float(os.environ.get("SARA_BOILERPLATE_MIN_SHARE", "0.3"))
+BOILERPLATE_MIN_PAGES = 3
+
+# Soft hyphens, zero-width characters and NULs some PDF producers leave in the text
+_INVISIBLE = dict.fromkeys(map(ord, "\u00ad\u200b\u200c\u200d\u2060\ufeff\x00"))
+_DIGITS_RE = re.compile(r"\d+")
+_PAGE_NUMBER_RE = re.compile(r"^(?:page\s*)?[-\u2013(\[]?\s*(?:\d{1,4}|[ivxlc]{1,7})\s*[-\u2013)\]]?"
+                             r"(?:\s*(?:of|/)\s*\d{1,4})?$", re.IGNORECASE)
+_TOC_HEADING_RE = re.compile(r"^(?:table of )?contents$", re.IGNORECASE)
+# Dot leaders running up to a page number
+_TOC_LEADER_RE = re.compile(r"(?:[.\u2026\u00b7_]\s*){4,}\d{1,4}$")
+_TOC_ENTRY_RE = re.compile(r"\s\d{1,4}$")
+_HYPHENATED_RE = re.compile(r"[^\W\d_]-")
+_COMPOUND_RE = re.compile(r"\w+-\w+")
+_LAST_WORD_RE = re.compile(r"\w*$")
+_FIRST_WORD_RE = re.compile(r"\w*")
+
+
+class NormalizeReport:
+    """Size of a document's text before and after normalization, and the lines dropped by reason."""
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.dropped = Counter()
+        self.hyphens_joined = 0
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_in - self.bytes_out
+
+    @property
+    def tokens_saved(self):
+        return self.tokens_in - self.tokens_out
+
+    def __str__(self):
+        share = self.bytes_saved / self.bytes_in if self.bytes_in else 0.0
+        dropped = ", ".join(f"{count} {reason}" for reason, count in sorted(self.dropped.items())) or "none"
+        return (f"{self.bytes_saved} bytes ({share:.0%}) and ~{self.tokens_saved} tokens saved; "
+                f"lines dropped: {dropped}; {self.hyphens_joined} hyphenated words joined")
+
+
+def _clean_line(line):
+    # str.split() also breaks on non-breaking and other Unicode spaces
+    return " ".join(line.translate(_INVISIBLE).split())
+
+
+def _signature(line):
+    # "Page 3 of 40" and "Page 4 of 40" are the same footer
+    return _DIGITS_RE.sub("#", line.lower())
+
+
+def _boilerplate(pages):
+    """Signatures of the lines that recur at the top or bottom of enough pages to be running headers or footers."""
+    counts = Counter()
+    for lines in pages:
+        counts.update({_signature(line) for line in lines[:EDGE_LINES] + lines[-EDGE_LINES:]})
+    min_pages = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_SHARE * len(pages))
+    return {signature for signature, count in counts.items() if count >= min_pages}
+
+
+def _page_lines(lines, boilerplate, report):
+    """The page's lines without its header, footer, page number and table-of-contents entries."""
+    toc_page = any(_TOC_HEADING_RE.match(line) for line in lines[:EDGE_LINES])
+    kept = []
+    last = len(lines) - 1
+    for i, line in enumerate(lines):
+        edge = i < EDGE_LINES or i > last - EDGE_LINES
+        if edge and _signature(line) in boilerplate:
+            report.dropped["header/footer"] += 1
+        elif edge and _PAGE_NUMBER_RE.match(line):
+            report.dropped["page number"] += 1
+        elif line[-1].isdigit() and (_TOC_LEADER_RE.search(line) or (toc_page and _TOC_ENTRY_RE.search(line))):
+            report.dropped["contents"] += 1
+        elif toc_page and _TOC_HEADING_RE.match(line):
+            report.dropped["contents"] += 1
+        else:
+            kept.append(line)
+    return kept
+
+
+def _join_hyphenated(lines, report):
+    # "resusci-" / "tation of the patient" -> "resuscitation of the patient"; a capital after the break keeps the hyphen,
+    # and so does a compound the document also hyphenates mid-line, like "first-responder"
+    compounds = {word.lower() for line in lines if "-" in line for word in _COMPOUND_RE.findall(line)}
+    joined = []
+    for line in lines:
+        if joined and joined[-1][-1] == "-" and line[0].islower() and _HYPHENATED_RE.search(joined[-1][-2:]):
+            head = _LAST_WORD_RE.search(joined[-1][:-1]).group()
+            tail = _FIRST_WORD_RE.match(line).group()
+            hyphen = "-" if f"{head}-{tail}".lower() in compounds else ""
+            joined[-1] = joined[-1][:-1] + hyphen + line
+            report.hyphens_joined += 1
+        else:
+            joined.append(line)
+    return joined
+
+
+def normalize_pages(pages, paged=True):
+    """
+    Normalizes a document given as its extracted pieces; returns (text, NormalizeReport).
+
+    Whitespace is collapsed and words broken across lines are joined for
+    every document. Running headers and footers, page numbers and
+    table-of-contents pages are only recognised when paged is true, i.e. the
+    pieces are pages (PDF) or slides (PPTX) rather than paragraphs.
+    """
+    report = NormalizeReport()
+    pages = list(pages)
+    for page in pages:
+        report.bytes_in += len(page.encode("utf-8"))
+        report.tokens_in += estimate_tokens(page)
+
+    pages = [[line for line in map(_clean_line, page.splitlines()) if line] for page in pages]
+    if paged:
+        boilerplate = _boilerplate(pages) if len(pages) >= BOILERPLATE_MIN_PAGES else set()
+        pages = [_page_lines(lines, boilerplate, report) for lines in pages]
+    lines = _join_hyphenated([line for lines in pages for line in lines], report)
+
+    text = "\n".join(lines) + "\n" if lines else ""
+    report.bytes_out = len(text.encode("utf-8"))
+    report.tokens_out = estimate_tokens(text)
+    return text, report
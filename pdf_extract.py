@@ -0,0 +1,175 @@
+import atexit
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+import metrics
+
+# Worker processes used for page extraction, and how many pages each task covers
+EXTRACT_WORKERS = int(os.environ.get("SARA_PDF_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.environ.get("SARA_PDF_PAGES_PER_TASK", "16"))
+# Below this many pages handing work to the pool costs more than it saves
+PARALLEL_MIN_PAGES = int(os.environ.get("SARA_PDF_PARALLEL_MIN_PAGES", "48"))
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# Per worker process: the reader for the document it is currently working on
+_worker_reader = None
+_worker_reader_path = None
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers < workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn rather than fork: the Streamlit server is multi-threaded and forking it is unsafe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_range(path, start, stop):
+    global _worker_reader, _worker_reader_path
+    # Parse the xref once per document per worker, not once per task
+    if _worker_reader_path != path:
+        _worker_reader = PdfReader(path)
+        _worker_reader_path = path
+    return [_worker_reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def page_ranges(page_indexes, pages_per_task):
+    """Splits ascending page indexes into (start, stop) runs of consecutive pages, at most pages_per_task long."""
+    ranges = []
+    for index in page_indexes:
+        if ranges and ranges[-1][1] == index and index - ranges[-1][0] < pages_per_task:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+    return [tuple(r) for r in ranges]
+
+
+def _iter_selected(reader, data, page_indexes, workers, pages_per_task):
+    # Yields (index, text) for the given ascending page indexes, on the pool when there are enough of them
+    if len(page_indexes) < PARALLEL_MIN_PAGES or workers <= 1:
+        for index in page_indexes:
+            yield index, reader.pages[index].extract_text() or ""
+        return
+
+    # Workers read the document from a temp file instead of receiving the bytes with every task
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(data)
+        path = f.name
+
+    futures = []
+    try:
+        pool = _get_pool(workers)
+        ranges = page_ranges(page_indexes, pages_per_task or PAGES_PER_TASK)
+        futures = [pool.submit(_extract_range, path, start, stop) for start, stop in ranges]
+        for (start, _), future in zip(ranges, futures):
+            for offset, text in enumerate(future.result()):
+                yield start + offset, text
+    finally:
+        for future in futures:
+            future.cancel()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def iter_pages(data, max_workers=None, pages_per_task=None):
+    """
+    Yields (page_number, text) for every page of the PDF in data, in page order.
+
+    Large documents are split into page ranges that are extracted on a pool of
+    worker processes. Pages are yielded as soon as their range (and every range
+    before it) is finished, so callers can start working on the beginning of a
+    manual while the rest is still being parsed. Page numbers start at 1.
+    """
+    reader = PdfReader(io.BytesIO(data))
+    pages = range(len(reader.pages))
+    for index, text in _iter_selected(reader, data, pages, max_workers or EXTRACT_WORKERS, pages_per_task):
+        yield index + 1, text
+
+
+def page_fingerprint(page, font_digests=None):
+    """
+    Digest of what a page's extracted text depends on: its content stream and its fonts.
+
+    Identical pages of two versions of a document have the same fingerprint
+    even though the files (and their object numbers) differ. font_digests
+    caches the font part across the pages of one document.
+    """
+    font_digests = {} if font_digests is None else font_digests
+    digest = hashlib.blake2b(digest_size=16)
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    resources = page.get("/Resources")
+    fonts = resources.get_object().get("/Font") if resources is not None else None
+    for name, ref in sorted(fonts.get_object().items()) if fonts is not None else ():
+        key = (ref.idnum, ref.generation) if hasattr(ref, "idnum") else id(ref)
+        if key not in font_digests:
+            font = ref.get_object()
+            parts = [str(font.get(field)) for field in ("/BaseFont", "/Subtype")]
+            encoding = font.get("/Encoding")
+            parts.append(repr(encoding.get_object()) if encoding is not None else "")
+            to_unicode = font.get("/ToUnicode")
+            if to_unicode is not None:
+                parts.append(hashlib.blake2b(to_unicode.get_object().get_data(), digest_size=16).hexdigest())
+            font_digests[key] = "/".join(parts)
+        digest.update(f"\0{name}={font_digests[key]}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def iter_pages_incremental(data, page_cache, version, max_workers=None, pages_per_task=None):
+    """
+    iter_pages(), extracting only the pages page_cache doesn't already have.
+
+    Pages are looked up by page_fingerprint(), so a revised document only
+    pays for its changed pages; fingerprinting is far cheaper than
+    extraction. page_cache needs get(key) and put_many(items), like the
+    extraction cache. New page texts are stored once the caller is done.
+    """
+    reader = PdfReader(io.BytesIO(data))
+    font_digests = {}
+    keys = [f"page-{version}-{page_fingerprint(page, font_digests)}" for page in reader.pages]
+    texts = [page_cache.get(key) for key in keys]
+    missing = [index for index, text in enumerate(texts) if text is None]
+    metrics.CACHE_REQUESTS.labels("extract_page", "hit").inc(len(keys) - len(missing))
+    metrics.CACHE_REQUESTS.labels("extract_page", "miss").inc(len(missing))
+    metrics.trace("extract_pages", pages=len(keys), extracted=len(missing))
+
+    fresh = _iter_selected(reader, data, missing, max_workers or EXTRACT_WORKERS, pages_per_task)
+    new_pages = []
+    try:
+        for index, key in enumerate(keys):
+            text = texts[index]
+            if text is None:
+                _, text = next(fresh)
+                new_pages.append((key, text))
+            yield index + 1, text
+    finally:
+        fresh.close()
+        page_cache.put_many(new_pages)
+
+
+def extract_text(data, max_workers=None, pages_per_task=None):
+    """Extracts the whole document, joining the page texts once at the end."""
+    return "".join(text for _, text in iter_pages(data, max_workers, pages_per_task))
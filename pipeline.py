@@ -0,0 +1,251 @@
+"""
+The Dojo and Test Mode generation pipeline of app.py, without any Streamlit calls.
+
+app.py wraps these functions in its caches and widgets; benchmarks and
+headless tools call them directly.
+"""
+import random
+
+import metrics
+from explanations import iter_explanations
+from extract_cache import extraction_cache
+from extractors import extractor_for
+from hedging import hedged_completion
+from llm_client import PRIORITY_BACKGROUND, PRIORITY_DOJO, PRIORITY_TEST, chat_completion
+from question_bank import TARGET_STOCK, pregen_worker, question_bank
+from questions import OUTPUT_FORMAT, json_format_instructions, parse_questions, structured_output_kwargs
+from retrieval import CONTEXT_TOKEN_BUDGETS, build_context, index_for
+from sharding import SHARD_SIZE, generate_sharded
+from versioning import document_versions
+
+# Model behind each Dojo mode
+DOJO_MODELS = {"EMT": "o1-mini", "PSCT": "gpt-4"}
+
+
+def read_document(data, kind="pdf"):
+    # Identical uploads skip extraction in any session or process via the on-disk cache
+    extractor = extractor_for(kind)
+    with metrics.stage("read_document", kind=kind):
+        return extraction_cache.get_or_extract(data, extractor.extract_text, extractor.text_version)
+
+PIPE_TEMPLATE = "Question1 | Choice1 | Choice2 | Choice3 | Choice4 | (example: 2 #For Choice 2 | (reason for option A being correct/or wrong if not the right answer) | (reason for option B being correct/or wrong if not the right answer) | (reason for option C being correct/or wrong if not the right answer) | (reason for option D being correct/or wrong if not the right answer),   An Example if option D is the right answer: Question1 - What is the colour of healthy grass | Red | Yellow | Blue | Green | 4 | Healthy grass isn't Red colour | Grass is only yellow if its diseased | Its impossible for grass to be blue in colour | Yes! Grass is indeed Green in colour |. One question per line. Do not give me any other information other than this. STRICTLY follow this template I have specified. i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!"
+
+def format_instructions(count):
+    """Output format for the generation prompts: JSON objects in JSON mode, otherwise the pipe template."""
+    if OUTPUT_FORMAT == "json":
+        return json_format_instructions(count)
+    return PIPE_TEMPLATE
+
+def chat_messages(user_query):
+    message_text = [
+        #{"role": "system", "content": "You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this text and generate for 10 questions, 4 possible answers to each question, the correct answer's index( 0 to 3 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: Question1 | Choice1 | Choice2 | Choice3 | Choice4 | (example: 2 #For Choice 3 | (reason for option A being correct/or wrong if not the right answer) | (reason for option B being correct/or wrong if not the right answer) | (reason for option C being correct/or wrong if not the right answer) | (reason for option D being correct/or wrong if not the right answer),   An Example if option C is the right answer: Question1 - What is the colour of healthy grass | Red | Yellow | Blue | Green | 3 | Healthy grass isn't Red colour | Grass is only yellow if its diseased | Its impossible for grass to be blue in colour | Yes! Grass is indeed Green in colour |. Do not give me any other information other than this. STRICTLY follow this template I have specified. i dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!!"},
+        {"role": "user", "content": f"You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this text and generate for 10 questions, 4 possible answers to each question, the correct answer's index (1 to 4 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: {format_instructions(10)} Use full content of my SOP book: {user_query}" }
+    ]
+    return message_text
+
+def has_questions(text):
+    # A response is usable if at least one question parses out of it
+    return bool(parse_questions(text))
+
+def request_chat_response(user_query, priority=PRIORITY_DOJO):
+    # A slow or failed completion is hedged down the o1-mini ladder (see hedging.py)
+    return hedged_completion(
+        "o1-mini",
+        lambda model: (chat_messages(user_query), structured_output_kwargs(model)),
+        has_questions,
+        priority=priority,
+    )
+
+def stream_chat_response(user_query):
+    stream = chat_completion(
+        model="o1-mini",
+        messages=chat_messages(user_query),
+        stream=True,
+        **structured_output_kwargs("o1-mini"),
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def psct_chat_messages(user_query):
+    message_text = [
+        {"role": "system", "content": f"You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this question and answer and reasoning,  and generate for 10 PARAGRAPH LONG ELABORATE SCENARIO questions without ECG based on the similar questioning style as given information, 4 possible answers to each question, the correct answer's index (1 to 4 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: {format_instructions(10)}"},
+        {"role": "user", "content": "generate interesting questions using full content of my SOP book: " + user_query}
+    ]
+    return message_text
+
+def request_psct_chat_response(user_query, priority=PRIORITY_DOJO):
+    def build_request(model):
+        return psct_chat_messages(user_query), dict(
+            temperature=0.4,
+            top_p=0.5,
+            frequency_penalty=0,
+            presence_penalty=0,
+            **structured_output_kwargs(model),
+        )
+
+    return hedged_completion("gpt-4", build_request, has_questions, priority=priority)
+
+def stream_psct_chat_response(user_query):
+    stream = chat_completion(
+        model="gpt-4",
+        messages=psct_chat_messages(user_query),
+        temperature=0.4,
+        top_p=0.5,
+        frequency_penalty=0,
+        presence_penalty=0,
+        stream=True,
+        **structured_output_kwargs("gpt-4"),
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def format_explanation(input):
+    """Rewrites an explanation as unique numbered bullet points (the uncached OpenAI_Filtering_Check)."""
+    message_text = [
+        {"role": "system", "content": "Take this input and Return this in a numbered bulletised format seperated by the \n key in between bullet points. Make sure no points that are given are the same. all must be unique. Omit if needed."},
+        {"role": "user", "content": input}
+    ]
+
+    completion = chat_completion(
+        model="gpt-4o-mini",
+        messages=message_text,
+        temperature=0.2,
+        top_p=0.95,
+        frequency_penalty=0,
+        presence_penalty=0,
+        stop=None
+    )
+
+    filtered_message = completion.choices[0].message.content
+
+    return filtered_message
+
+def check_answer(reasons, correct_index, selected_option):
+    if selected_option == correct_index + 1:
+        return f"{reasons[correct_index]} | {reasons[0]} | {reasons[1]} | {reasons[2]} | {reasons[3]}"
+    else:
+        return f"Option {selected_option}: {reasons[selected_option - 1]}"
+
+def explanation_input(question):
+    return check_answer(question.reasons, question.correct_index, question.correct_index + 1)
+
+def dojo_response_fn(mode):
+    return request_chat_response if mode == "EMT" else request_psct_chat_response
+
+def dojo_questions(pdf_text, mode, seed=None, priority=PRIORITY_DOJO):
+    """One Dojo page for mode ("EMT" or "PSCT"): context, model call and parse, without any caching."""
+    with metrics.stage("prompt"):
+        context = build_context(pdf_text, DOJO_MODELS[mode], seed=seed)
+    with metrics.stage("dojo_generate", model=DOJO_MODELS[mode]):
+        response = dojo_response_fn(mode)(context, priority)
+    with metrics.stage("parse"):
+        return parse_questions(response, " | ")
+
+def explained_questions(questions, format_fn=format_explanation):
+    """The questions with their formatted explanations, as (question, explanation) pairs."""
+    inputs = [explanation_input(question) for question in questions]
+    return [(questions[i], explanation) for i, explanation in iter_explanations(format_fn, inputs)]
+
+def dojo_pregenerator(mode, pdf_text):
+    # Background top-up for the bank: a fresh sample of sections every round, lowest API priority
+    def generate(count):
+        context = build_context(pdf_text, DOJO_MODELS[mode], seed=random.randrange(2**31))
+        return parse_questions(dojo_response_fn(mode)(context, PRIORITY_BACKGROUND))
+    return generate
+
+def test_pregenerator(pdf_text, option, shard_response):
+    def generate(count):
+        context = build_context(pdf_text, "o1-mini", seed=random.randrange(2**31))
+        return parse_questions(shard_response(context, min(count, SHARD_SIZE), option, PRIORITY_BACKGROUND))
+    return generate
+
+def get_test_shard_response(context, count, option, priority=PRIORITY_TEST):
+    message_text = [
+        {"role": "user", "content": f"You are an expert Quiz Maker who makes thoughtful and fun quizzes. You never give the same type of questions twice. Understand this text and generate for me {count} {option} questions, 4 possible answers to each question, the correct answer's index (1 to 4 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: {format_instructions(count)} Use this part of my SOP book: {context}" },
+    ]
+
+    return hedged_completion(
+        "o1-mini",
+        lambda model: (message_text, structured_output_kwargs(model)),
+        has_questions,
+        priority=priority,
+    )
+
+def get_psct_test_shard_response(context, count, option, priority=PRIORITY_TEST):
+    message_text = [
+        {"role": "user", "content": f"You are an expert Quiz Maker who makes ELABORATE quizes. You never give the same type of questions twice. Understand this text(questions, the correct answer and their wrong answers) and generate for me {count} {option} PARAGRAPH LONG ELABORATE SCENARIO questions IN THE SAME WAY THE QUESTIONS WERE ASKED, 4 possible answers to each question, the correct answer's index (1 to 4 as there are 4 options), and its reason for being correct or wrong. Each reason for each of the choices, depending its correct or wrong. I want the Question, Choices, Correct Answer Index and Reasons to be in this format: {format_instructions(count)} Use this part of my SOP book: {context}" },
+    ]
+
+    return hedged_completion(
+        "o1-mini",
+        lambda model: (message_text, structured_output_kwargs(model)),
+        has_questions,
+        priority=priority,
+    )
+
+def exam_questions(quantity, pdf_text, option, doc_hash, mode, shard_response, on_progress=None, should_stop=None):
+    """
+    quantity Test Mode questions: unseen ones from the bank first, the rest generated as shards.
+
+    Generated questions go into the bank as served. on_progress(done, total)
+    is called after every finished shard, and should_stop() is passed on to
+    generate_sharded(). May return fewer than quantity.
+    """
+    bank_key = (doc_hash, mode, option)
+    questions = question_bank.take(*bank_key, quantity)
+    remaining = quantity - len(questions)
+    if remaining:
+        # Split the rest into shards over different parts of the book and run them concurrently
+        def generate_shard(context, count):
+            # Near-duplicates of questions already asked on this document are dropped, and the shortfall topped up
+            return question_bank.unique(*bank_key, parse_questions(shard_response(context, count, option)))
+
+        with metrics.stage("test_generate", mode=mode, questions=remaining):
+            generated = generate_sharded(generate_shard, index_for(pdf_text), remaining, CONTEXT_TOKEN_BUDGETS["o1-mini"],
+                                         on_progress=on_progress, should_stop=should_stop)
+        # A stopped exam is never delivered, so what it did generate stays unserved for the next one
+        question_bank.add(*bank_key, generated, served=not (should_stop and should_stop()))
+        questions += generated
+    return questions
+
+def test_shard_response_fn(mode):
+    return get_test_shard_response if mode == "EMT" else get_psct_test_shard_response
+
+def update_document_version(name, doc_hash, text):
+    """
+    Registers text as a version of the SOP uploaded as name (see versioning.py).
+
+    For a revision of a known document, the previous version's questions
+    about unchanged sections carry over and those about removed text are
+    retired. Replacements, about the new sections only, are generated in the
+    background for each mode and difficulty that had questions. Returns the
+    VersionUpdate, or None when there is no previous version.
+    """
+    with metrics.stage("version_diff"):
+        update = document_versions.register(name, doc_hash, text)
+        if update is None:
+            return None
+        carried, retired = document_versions.migrate_questions(update)
+
+    added_text = update.added_text
+    share = len(added_text.split()) / max(1, len(text.split()))
+    for mode, difficulty in set(carried) | set(retired):
+        lost = retired.get((mode, difficulty), 0)
+        # Replace what was retired, and cover new material in proportion to its share of the document
+        count = min(TARGET_STOCK, max(lost, round((carried.get((mode, difficulty), 0) + lost) * share)))
+        if not count or not added_text:
+            continue
+        if difficulty == "Dojo":
+            generate = dojo_pregenerator(mode, added_text)
+        else:
+            generate = test_pregenerator(added_text, difficulty, test_shard_response_fn(mode))
+        pregen_worker.enqueue(doc_hash, mode, difficulty, count, generate)
+
+    print(f"New version of {name} ({doc_hash[:12]}): {len(update.kept)} sections kept, {len(update.added)} new, "
+          f"{len(update.removed)} removed; {sum(carried.values())} questions carried over, {sum(retired.values())} retired")
+    metrics.trace("document_version", name=name, previous=update.previous_hash, kept=len(update.kept),
+                  added=len(update.added), removed=len(update.removed),
+                  carried=sum(carried.values()), retired=sum(retired.values()))
+    return update
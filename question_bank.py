@@ -0,0 +1,376 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from dedupe import DuplicateIndex
+from questions import Question, question_key
+
+BANK_PATH = os.environ.get(
+    "SARA_QUESTION_BANK",
+    os.path.join(os.path.expanduser("~"), ".cache", "sara", "question_bank.sqlite3"),
+)
+# Unseen questions the background worker keeps in stock per document, mode and difficulty
+TARGET_STOCK = int(os.environ.get("SARA_BANK_TARGET_STOCK", "30"))
+# Documents the worker keeps topping up, and for how long after their last use
+PREGEN_MAX_DOCUMENTS = int(os.environ.get("SARA_PREGEN_MAX_DOCUMENTS", "16"))
+PREGEN_IDLE_SECONDS = float(os.environ.get("SARA_PREGEN_IDLE_SECONDS", str(6 * 3600)))
+PREGEN_POLL_SECONDS = float(os.environ.get("SARA_PREGEN_POLL_SECONDS", "30"))
+# A key whose top-up adds nothing or fails waits twice as long each time, and is
+# dropped after this many such rounds in a row until the document is used again
+PREGEN_MAX_EMPTY_ROUNDS = int(os.environ.get("SARA_PREGEN_MAX_EMPTY_ROUNDS", "5"))
+# Near-duplicate indexes (one per document, mode and difficulty) kept in memory
+DEDUPE_INDEXES = int(os.environ.get("SARA_DEDUPE_INDEXES", "32"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    doc_hash TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    question_key TEXT NOT NULL,
+    question TEXT NOT NULL,
+    options TEXT NOT NULL,
+    correct_index INTEGER NOT NULL,
+    reasons TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    served_at REAL,
+    section_hash TEXT,
+    retired_at REAL,
+    UNIQUE (doc_hash, mode, difficulty, question_key)
+);
+CREATE INDEX IF NOT EXISTS questions_unseen ON questions (doc_hash, mode, difficulty, served_at, id);
+CREATE INDEX IF NOT EXISTS questions_added ON questions (doc_hash, mode, difficulty, id);
+"""
+
+# Columns added after the first release, for banks created before them
+MIGRATIONS = {
+    "section_hash": "ALTER TABLE questions ADD COLUMN section_hash TEXT",
+    "retired_at": "ALTER TABLE questions ADD COLUMN retired_at REAL",
+}
+
+
+def document_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class QuestionBank:
+    """
+    Parsed questions stored in SQLite, keyed by document hash, mode (EMT/PSCT) and difficulty.
+
+    Questions are "unseen" until take() hands them out. Exact repeats of a
+    question for the same document, mode and difficulty are ignored on insert;
+    unique() also filters out near-duplicates, before questions are shown.
+    Questions can be tagged with the document section they are about (see
+    versioning.py); retired ones, about text a newer version removed, are
+    never handed out again.
+    """
+
+    def __init__(self, path=BANK_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._indexes = OrderedDict()
+        self._indexes_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(questions)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in columns:
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError:
+                    pass  # another process added it first
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, so each thread gets its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, doc_hash, mode, difficulty, questions, served=False):
+        now = time.time()
+        rows = [
+            (doc_hash, mode, difficulty, question_key(q), q.question, json.dumps(q.options),
+             q.correct_index, json.dumps(q.reasons), now, now if served else None)
+            for q in questions
+        ]
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO questions (doc_hash, mode, difficulty, question_key, question, options,"
+                " correct_index, reasons, created_at, served_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            return conn.total_changes - before
+
+    def take(self, doc_hash, mode, difficulty, count):
+        """Hands out up to count unseen questions, oldest first, and marks them as served."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, question, options, correct_index, reasons FROM questions"
+                " WHERE doc_hash = ? AND mode = ? AND difficulty = ? AND served_at IS NULL AND retired_at IS NULL"
+                " ORDER BY id LIMIT ?",
+                (doc_hash, mode, difficulty, count),
+            ).fetchall()
+            conn.executemany("UPDATE questions SET served_at = ? WHERE id = ?", [(time.time(), row[0]) for row in rows])
+        # A hit only if the bank covered the whole request
+        metrics.cache_result("question_bank", hit=len(rows) == count)
+        return [Question(question=question, options=json.loads(options), correct_index=correct_index,
+                         reasons=json.loads(reasons))
+                for _, question, options, correct_index, reasons in rows]
+
+    def duplicate_index(self, doc_hash, mode, difficulty):
+        """
+        A DuplicateIndex of the key's live questions, served or not, loaded on first use.
+
+        Later calls add the rows inserted since, e.g. by another process
+        sharing the bank, so replicas don't serve each other's questions again.
+        """
+        key = (doc_hash, mode, difficulty)
+        with self._indexes_lock:
+            loaded = self._indexes.get(key)
+            if loaded is not None:
+                self._indexes.move_to_end(key)
+        index, last_id = loaded if loaded is not None else (DuplicateIndex(), 0)
+        rows = self._connect().execute(
+            "SELECT id, question, options, correct_index, reasons FROM questions"
+            " WHERE doc_hash = ? AND mode = ? AND difficulty = ? AND retired_at IS NULL AND id > ?",
+            (*key, last_id),
+        ).fetchall()
+        index.extend(Question(question=question, options=json.loads(options), correct_index=correct_index,
+                              reasons=json.loads(reasons))
+                     for _, question, options, correct_index, reasons in rows)
+        last_id = max([last_id] + [row[0] for row in rows])
+        with self._indexes_lock:
+            # Another thread may have loaded it meanwhile; keep the first, questions may have been added to it
+            current = self._indexes.setdefault(key, [index, last_id])
+            if current[0] is index:
+                current[1] = max(current[1], last_id)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > DEDUPE_INDEXES:
+                self._indexes.popitem(last=False)
+        return current[0]
+
+    def unique(self, doc_hash, mode, difficulty, questions):
+        """
+        The questions that are neither near-duplicates of the key's questions nor of each other.
+
+        They count as asked from then on, whether or not they are added to the bank.
+        """
+        return self.duplicate_index(doc_hash, mode, difficulty).filter(questions)
+
+    def _forget_indexes(self, doc_hash):
+        # Reloaded on next use, after the document's questions changed behind the indexes' back
+        with self._indexes_lock:
+            for key in [key for key in self._indexes if key[0] == doc_hash]:
+                del self._indexes[key]
+
+    def stock(self, doc_hash, mode, difficulty):
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM questions"
+            " WHERE doc_hash = ? AND mode = ? AND difficulty = ? AND served_at IS NULL AND retired_at IS NULL",
+            (doc_hash, mode, difficulty),
+        ).fetchone()
+        return row[0]
+
+    def untagged(self, doc_hash):
+        """(id, Question) for the document's live questions that have no section yet."""
+        rows = self._connect().execute(
+            "SELECT id, question, options, correct_index, reasons FROM questions"
+            " WHERE doc_hash = ? AND section_hash IS NULL AND retired_at IS NULL",
+            (doc_hash,),
+        ).fetchall()
+        return [(row_id, Question(question=question, options=json.loads(options), correct_index=correct_index,
+                                  reasons=json.loads(reasons)))
+                for row_id, question, options, correct_index, reasons in rows]
+
+    def tag_sections(self, tags):
+        """Sets the section of questions from (id, section_hash) pairs."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("UPDATE questions SET section_hash = ? WHERE id = ?", [(h, i) for i, h in tags])
+
+    def carry_over(self, from_doc, to_doc, section_hashes):
+        """
+        Copies from_doc's live questions about the given sections to to_doc, served or not as they were.
+
+        Returns how many were copied per (mode, difficulty).
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            counts = conn.execute(
+                "SELECT mode, difficulty, COUNT(*) FROM questions WHERE doc_hash = ? AND retired_at IS NULL"
+                " AND section_hash IN (SELECT value FROM json_each(?)) GROUP BY mode, difficulty",
+                (from_doc, json.dumps(sorted(section_hashes))),
+            ).fetchall()
+            conn.execute(
+                "INSERT OR IGNORE INTO questions (doc_hash, mode, difficulty, question_key, question, options,"
+                " correct_index, reasons, created_at, served_at, section_hash)"
+                " SELECT ?, mode, difficulty, question_key, question, options, correct_index, reasons, created_at,"
+                " served_at, section_hash FROM questions WHERE doc_hash = ? AND retired_at IS NULL"
+                " AND section_hash IN (SELECT value FROM json_each(?))",
+                (to_doc, from_doc, json.dumps(sorted(section_hashes))),
+            )
+        self._forget_indexes(to_doc)
+        return {(mode, difficulty): count for mode, difficulty, count in counts}
+
+    def retire(self, doc_hash, section_hashes):
+        """Retires the document's questions about the given sections; returns how many per (mode, difficulty)."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            counts = conn.execute(
+                "SELECT mode, difficulty, COUNT(*) FROM questions WHERE doc_hash = ? AND retired_at IS NULL"
+                " AND section_hash IN (SELECT value FROM json_each(?)) GROUP BY mode, difficulty",
+                (doc_hash, json.dumps(sorted(section_hashes))),
+            ).fetchall()
+            conn.execute(
+                "UPDATE questions SET retired_at = ? WHERE doc_hash = ? AND retired_at IS NULL"
+                " AND section_hash IN (SELECT value FROM json_each(?))",
+                (time.time(), doc_hash, json.dumps(sorted(section_hashes))),
+            )
+        self._forget_indexes(doc_hash)
+        return {(mode, difficulty): count for mode, difficulty, count in counts}
+
+
+class PregenWorker:
+    """
+    Background thread that keeps TARGET_STOCK unseen questions in the bank for recently used documents.
+
+    register() is called whenever a document is used; generate_fn(count) must
+    return a list of Question and may return fewer than asked. Near-duplicates
+    of questions the bank already has are dropped before they are stocked. Only the most
+    recent PREGEN_MAX_DOCUMENTS keys are kept, and keys not used for
+    PREGEN_IDLE_SECONDS are dropped, so the worker never holds on to old books.
+    A key whose top-ups keep adding nothing (or failing) backs off
+    exponentially and is dropped after PREGEN_MAX_EMPTY_ROUNDS, until the
+    next register() for it.
+    enqueue() adds one-off work, such as replacing the questions a revised
+    document retired, which runs before the next round of top-ups.
+    """
+
+    def __init__(self, bank, target=TARGET_STOCK):
+        self.bank = bank
+        self.target = target
+        self._wanted = OrderedDict()
+        self._tasks = deque()
+        # key -> (empty rounds in a row, monotonic time of the next try)
+        self._backoff = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def register(self, doc_hash, mode, difficulty, generate_fn):
+        key = (doc_hash, mode, difficulty)
+        with self._lock:
+            self._wanted[key] = (generate_fn, time.monotonic())
+            self._wanted.move_to_end(key)
+            self._backoff.pop(key, None)
+            while len(self._wanted) > PREGEN_MAX_DOCUMENTS:
+                self._backoff.pop(self._wanted.popitem(last=False)[0], None)
+            self._start()
+        self._wake.set()
+
+    def enqueue(self, doc_hash, mode, difficulty, count, generate_fn):
+        """Adds count questions from generate_fn to the bank once, in the background."""
+        with self._lock:
+            self._tasks.append(((doc_hash, mode, difficulty), count, generate_fn))
+            self._start()
+        self._wake.set()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sara-pregen", daemon=True)
+            self._thread.start()
+
+    def _run_tasks(self):
+        while True:
+            with self._lock:
+                if not self._tasks:
+                    return
+                key, count, generate_fn = self._tasks.popleft()
+            added = 0
+            try:
+                # Stop early if a round adds nothing, rather than asking forever
+                while added < count:
+                    new = self.bank.add(*key, self.bank.unique(*key, generate_fn(count - added)[:count - added]))
+                    if not new:
+                        break
+                    added += new
+                print(f"Generated {added} of {count} questions for {key[1]}/{key[2]} ({key[0][:12]})")
+            except Exception as e:
+                print(f"Generation failed for {key[1]}/{key[2]} ({key[0][:12]}): {e}")
+
+    def _due(self):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, (_, used) in self._wanted.items() if now - used > PREGEN_IDLE_SECONDS]:
+                del self._wanted[key]
+                self._backoff.pop(key, None)
+            return [(key, fn) for key, (fn, _) in reversed(self._wanted.items())
+                    if self._backoff.get(key, (0, 0))[1] <= now]
+
+    def _empty_round(self, key):
+        # Wait PREGEN_POLL_SECONDS, then twice that, and so on; give up on the key after too many
+        with self._lock:
+            rounds = self._backoff.get(key, (0, 0))[0] + 1
+            if rounds >= PREGEN_MAX_EMPTY_ROUNDS:
+                self._wanted.pop(key, None)
+                self._backoff.pop(key, None)
+                print(f"Stopped pre-generating for {key[1]}/{key[2]} ({key[0][:12]}) after {rounds} empty rounds")
+                return
+            self._backoff[key] = (rounds, time.monotonic() + PREGEN_POLL_SECONDS * 2 ** (rounds - 1))
+
+    def _next_wait(self, busy):
+        # No wait while a key is still filling up, otherwise until the first backed-off key is due
+        if busy:
+            return 0
+        with self._lock:
+            retries = [retry_at for key, (_, retry_at) in self._backoff.items() if key in self._wanted]
+        if not retries:
+            return PREGEN_POLL_SECONDS
+        return min(PREGEN_POLL_SECONDS, max(0.0, min(retries) - time.monotonic()))
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            self._run_tasks()
+            busy = False
+            for key, generate_fn in self._due():
+                deficit = self.target - self.bank.stock(*key)
+                if deficit <= 0:
+                    continue
+                try:
+                    added = self.bank.add(*key, self.bank.unique(*key, generate_fn(deficit)))
+                    print(f"Pre-generated {added} questions for {key[1]}/{key[2]} ({key[0][:12]})")
+                except Exception as e:
+                    print(f"Pre-generation failed for {key[1]}/{key[2]} ({key[0][:12]}): {e}")
+                    added = 0
+                if added > 0:
+                    with self._lock:
+                        self._backoff.pop(key, None)
+                    busy = busy or added < deficit
+                else:
+                    self._empty_round(key)
+            wait = self._next_wait(busy)
+            if wait > 0:
+                self._wake.wait(wait)
+
+
+question_bank = QuestionBank()
+pregen_worker = PregenWorker(question_bank)
@@ -0,0 +1,277 @@
+import json
+import os
+import re
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+import metrics
+
+# "json" asks the model for one JSON object per question; "pipe" keeps the old delimited lines.
+# Either way the parsers below accept both, so a model that ignores the format still gets parsed.
+OUTPUT_FORMAT = os.environ.get("SARA_OUTPUT_FORMAT", "json")
+# Models that accept response_format={"type": "json_schema"}; the others get the schema in the prompt only
+JSON_SCHEMA_MODELS = set(os.environ.get("SARA_JSON_SCHEMA_MODELS", "gpt-4o-mini,gpt-4o").split(","))
+
+
+class Question(BaseModel):
+    """One parsed multiple-choice question; correct_index is 0-based."""
+
+    model_config = ConfigDict(frozen=True)
+
+    question: str = Field(min_length=1)
+    options: list[str] = Field(min_length=4, max_length=4)
+    correct_index: int = Field(ge=0, le=3)
+    reasons: list[str] = Field(min_length=4, max_length=4)
+
+
+class QuestionJSON(BaseModel):
+    """One question as the model writes it in JSON mode; answer is 1-based like the pipe template."""
+
+    question: str = Field(min_length=1)
+    options: list[str] = Field(min_length=4, max_length=4)
+    answer: int = Field(ge=1, le=4)
+    reasons: list[str] = Field(min_length=4, max_length=4)
+
+    def to_question(self):
+        return Question(question=self.question.strip(), options=[o.strip() for o in self.options],
+                        correct_index=self.answer - 1, reasons=[r.strip() for r in self.reasons])
+
+    @classmethod
+    def from_question(cls, question):
+        return cls(question=question.question, options=question.options, answer=question.correct_index + 1,
+                   reasons=question.reasons)
+
+
+# Hand-written rather than QuestionJSON.model_json_schema(): strict structured outputs reject minItems/maxItems
+QUESTION_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}},
+        "answer": {"type": "integer"},
+        "reasons": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["question", "options", "answer", "reasons"],
+    "additionalProperties": False,
+}
+QUIZ_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {"questions": {"type": "array", "items": QUESTION_JSON_SCHEMA}},
+    "required": ["questions"],
+    "additionalProperties": False,
+}
+
+_LEADING_NUMBER_RE = re.compile(r"^\s*(\d+)")
+_NORMALIZE_RE = re.compile(r"[^a-z0-9]+")
+_NUMBERING_RE = re.compile(r"^\s*question\s*\d+\s*[:\-.)]?\s*", re.IGNORECASE)
+
+
+def parse_question_line(line, delimiter=" | "):
+    """
+    Parses one delimited question line into a Question, or returns None if the line is malformed.
+
+    Expected layout (delimiter " | " in app.py, "|||" in sara_int.py):
+      Question | Choice1 | Choice2 | Choice3 | Choice4 | <correct 1-4> | Reason1 | Reason2 | Reason3 | Reason4
+    A trailing delimiter and empty parts are ignored.
+    """
+    parts = [p.strip() for p in line.strip().rstrip("|").split(delimiter)]
+    parts = [p for p in parts if p]
+    if len(parts) != 10:
+        return None
+    match = _LEADING_NUMBER_RE.match(parts[5])
+    if not match or not 1 <= int(match.group(1)) <= 4:
+        return None
+    return Question(question=parts[0], options=parts[1:5], correct_index=int(match.group(1)) - 1, reasons=parts[6:10])
+
+
+def parse_question_lines(text, delimiter=" | "):
+    """Parses every well-formed line of text, skipping lines that don't match the template."""
+    questions = []
+    for line in text.splitlines():
+        if line.strip():
+            question = parse_question_line(line, delimiter)
+            if question is not None:
+                questions.append(question)
+    return questions
+
+
+def parse_json_question(text):
+    """Validates one JSON question object, or returns None if it is malformed or incomplete."""
+    try:
+        return QuestionJSON.model_validate_json(text).to_question()
+    except ValidationError:
+        return None
+
+
+class JsonQuestionParser:
+    """
+    Incremental parser for JSON-mode output.
+
+    feed() takes text deltas and returns every question object that closed in
+    them, so questions can be shown while the response is still streaming.
+    It only tracks braces and strings, which makes it indifferent to what
+    surrounds the objects: one object per line, a {"questions": [...]}
+    wrapper, or a markdown code fence all parse the same. Innermost objects
+    that close but don't validate are counted in rejected.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._starts = []
+        self._nested = []
+        self._in_string = False
+        self._escape = False
+        self.rejected = 0
+
+    @property
+    def in_object(self):
+        return bool(self._starts)
+
+    def feed(self, delta):
+        found = []
+        begin = len(self._pending)
+        self._pending += delta
+        for i in range(begin, len(self._pending)):
+            ch = self._pending[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = self.in_object
+            elif ch == "{":
+                if self._starts:
+                    self._nested[-1] = True
+                self._starts.append(i)
+                self._nested.append(False)
+            elif ch == "}" and self._starts:
+                start = self._starts.pop()
+                # Only innermost objects can be questions; wrappers around them are skipped
+                if self._nested.pop():
+                    continue
+                obj = self._pending[start:i + 1]
+                question = parse_json_question(obj)
+                if question is not None:
+                    found.append(question)
+                else:
+                    self.rejected += 1
+        # Only the text of still-open objects is needed for the next delta
+        if self._starts:
+            offset = self._starts[0]
+            self._pending = self._pending[offset:]
+            self._starts = [start - offset for start in self._starts]
+        else:
+            self._pending = ""
+        return found
+
+
+def json_format_instructions(count):
+    """The output format for JSON mode, to be put in the prompt in place of the pipe template."""
+    example = {
+        "question": "What is the colour of healthy grass?",
+        "options": ["Red", "Yellow", "Blue", "Green"],
+        "answer": 4,
+        "reasons": [
+            "Healthy grass isn't Red colour",
+            "Grass is only yellow if its diseased",
+            "Its impossible for grass to be blue in colour",
+            "Yes! Grass is indeed Green in colour",
+        ],
+    }
+    return (
+        f"Write exactly {count} JSON objects, one per line and nothing else, each matching this JSON schema: "
+        f"{json.dumps(QUESTION_JSON_SCHEMA)}. options holds exactly 4 choices, answer is the number (1 to 4) of "
+        f"the correct choice and reasons holds exactly 4 reasons, one per choice, saying why it is correct or "
+        f"wrong. Example line if option D is the right answer: {json.dumps(example)}"
+    )
+
+
+def structured_output_kwargs(model):
+    """Extra chat_completion() arguments that make the model itself enforce the schema, where it can."""
+    if OUTPUT_FORMAT != "json" or model not in JSON_SCHEMA_MODELS:
+        return {}
+    return {"response_format": {
+        "type": "json_schema",
+        "json_schema": {"name": "quiz", "strict": True, "schema": QUIZ_JSON_SCHEMA},
+    }}
+
+
+def strip_numbering(text):
+    """Removes a leading "Question3 -" / "Question 3:" label the model puts in front of the text."""
+    return _NUMBERING_RE.sub("", text)
+
+
+def question_key(question):
+    # Question text without numbering, case or punctuation, used to spot repeats
+    return _NORMALIZE_RE.sub(" ", strip_numbering(question.question).lower()).strip()
+
+
+def salvage_questions(text, delimiter=" | "):
+    """
+    Splits a response into the questions that parse and the parts that don't.
+
+    JSON question objects are tried first; if none of them is valid, the
+    response is parsed as delimited lines, and rejected holds the non-empty
+    lines that don't fit the template. A delimited response that merely has
+    {braces} in it is not taken for broken JSON.
+    """
+    parser = JsonQuestionParser()
+    valid = parser.feed(text)
+    if valid:
+        return valid, ["<invalid JSON question>"] * parser.rejected
+
+    rejected = []
+    for line in text.splitlines():
+        if line.strip():
+            question = parse_question_line(line, delimiter)
+            if question is None:
+                rejected.append(line)
+            else:
+                valid.append(question)
+    if not valid and parser.rejected:
+        # Nothing parses either way: report it as the JSON response it looks like
+        return valid, ["<invalid JSON question>"] * parser.rejected
+    return valid, rejected
+
+
+def parse_questions(text, delimiter=" | "):
+    """Every valid question in a response, JSON or delimited lines."""
+    return salvage_questions(text, delimiter)[0]
+
+
+def collect_questions(request_fn, count, delimiter=" | ", max_attempts=3):
+    """
+    Repair loop: asks request_fn(missing) for questions until count valid ones are collected.
+
+    Every attempt keeps the well-formed lines of the response and only asks
+    again for the number still missing, so a single malformed line costs a
+    small top-up request instead of a full regeneration. Near-duplicates of
+    an already collected question don't count. Stops after max_attempts
+    requests and returns what it has, which may be fewer than count.
+    """
+    # dedupe imports this module
+    from dedupe import DuplicateIndex
+
+    questions = []
+    seen = DuplicateIndex()
+    for attempt in range(1, max_attempts + 1):
+        missing = count - len(questions)
+        if missing <= 0:
+            break
+        try:
+            text = request_fn(missing)
+        except Exception as e:
+            print(f"Question request failed on attempt {attempt}: {e}")
+            continue
+        with metrics.stage("parse"):
+            valid, rejected = salvage_questions(text, delimiter)
+        if rejected:
+            metrics.PARSE_REJECTED.inc(len(rejected))
+            print(f"Dropped {len(rejected)} malformed line(s) on attempt {attempt}")
+        for question in valid:
+            if len(questions) < count and seen.add(question):
+                questions.append(question)
+    return questions
@@ -0,0 +1,175 @@
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import metrics
+
+# Rough size of one chunk, and how many of them are kept in memory as indexes
+CHUNK_WORDS = int(os.environ.get("SARA_CHUNK_WORDS", "220"))
+CHUNK_OVERLAP_WORDS = int(os.environ.get("SARA_CHUNK_OVERLAP_WORDS", "30"))
+INDEX_CACHE_SIZE = int(os.environ.get("SARA_INDEX_CACHE_SIZE", "8"))
+
+# Prompt budget (in tokens) for document passages per model, leaving room for instructions and output
+CONTEXT_TOKEN_BUDGETS = {
+    "o1-mini": int(os.environ.get("SARA_O1_MINI_CONTEXT_TOKENS", "24000")),
+    "gpt-4": int(os.environ.get("SARA_GPT4_CONTEXT_TOKENS", "4000")),
+    "gpt-4o-mini": int(os.environ.get("SARA_GPT4O_MINI_CONTEXT_TOKENS", "24000")),
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English prose, close enough for budgeting without a tokenizer
+    return (len(text) + 3) // 4
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def chunk_text(text, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS):
+    """Splits text into overlapping windows of roughly chunk_words words, in document order."""
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+class ChunkIndex:
+    """
+    BM25 index over the chunks of one document, built and queried locally.
+
+    select() picks passages for a generation prompt under a token budget:
+    with a query it returns the best BM25 matches, without one it samples a
+    spread of chunks from every part of the document so different runs cover
+    different sections. Selected chunks are always returned in document order.
+    """
+
+    def __init__(self, text, chunk_words=CHUNK_WORDS, overlap_words=CHUNK_OVERLAP_WORDS, k1=1.5, b=0.75, chunks=None):
+        # chunks, when given, are indexed as they are instead of splitting text
+        self.chunks = chunk_text(text, chunk_words, overlap_words) if chunks is None else list(chunks)
+        self.chunk_tokens = [estimate_tokens(chunk) for chunk in self.chunks]
+        self.k1 = k1
+        self.b = b
+
+        self.term_freqs = []
+        self.lengths = []
+        doc_freq = Counter()
+        for chunk in self.chunks:
+            terms = Counter(tokenize(chunk))
+            self.term_freqs.append(terms)
+            self.lengths.append(sum(terms.values()))
+            doc_freq.update(terms.keys())
+
+        n = len(self.chunks)
+        self.avg_length = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def total_tokens(self):
+        return sum(self.chunk_tokens)
+
+    def scores(self, query):
+        terms = [term for term in tokenize(query) if term in self.idf]
+        scores = [0.0] * len(self.chunks)
+        for i, freqs in enumerate(self.term_freqs):
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.avg_length or 1))
+            score = 0.0
+            for term in terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores[i] = score
+        return scores
+
+    def search(self, query, top_k=5):
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        return [i for i in ranked[:top_k] if scores[i] > 0]
+
+    def _fill(self, order, token_budget):
+        chosen, used = [], 0
+        for i in order:
+            if used + self.chunk_tokens[i] > token_budget:
+                continue
+            chosen.append(i)
+            used += self.chunk_tokens[i]
+        return sorted(chosen)
+
+    def select(self, token_budget, query=None, seed=None, chunk_ids=None):
+        """
+        Returns the ids of the chunks to put in a prompt, at most token_budget tokens in total.
+
+        chunk_ids restricts the choice to a subset of the document (e.g. one shard).
+        """
+        candidates = list(range(len(self.chunks))) if chunk_ids is None else list(chunk_ids)
+        if sum(self.chunk_tokens[i] for i in candidates) <= token_budget:
+            return sorted(candidates)
+
+        if query:
+            scores = self.scores(query)
+            order = sorted(candidates, key=lambda i: scores[i], reverse=True)
+            return self._fill(order, token_budget)
+
+        # Stratified sample: one random chunk per stretch of the document, then fill up the rest
+        rng = random.Random(seed)
+        avg_tokens = sum(self.chunk_tokens[i] for i in candidates) / len(candidates)
+        strata = max(1, min(len(candidates), int(token_budget // max(avg_tokens, 1))))
+        size = len(candidates) / strata
+        order = []
+        for s in range(strata):
+            lo, hi = int(s * size), max(int((s + 1) * size), int(s * size) + 1)
+            order.append(candidates[rng.randrange(lo, hi)])
+        sampled = set(order)
+        rest = [i for i in candidates if i not in sampled]
+        rng.shuffle(rest)
+        return self._fill(order + rest, token_budget)
+
+    def passages(self, chunk_ids):
+        return "\n\n".join(self.chunks[i] for i in chunk_ids)
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def index_for(text):
+    """Returns the ChunkIndex for text, reusing one built earlier for the same document."""
+    # HashedText already knows its digest; anything else is hashed here
+    key = getattr(text, "digest", None) or hashlib.sha1(text.encode("utf-8")).hexdigest()
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+    metrics.cache_result("chunk_index", hit=index is not None)
+    if index is not None:
+        return index
+    index = ChunkIndex(text)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def build_context(text, model, seed=None, query=None, token_budget=None):
+    """Selects the passages of text to send to model, keeping the prompt within its token budget."""
+    budget = token_budget or CONTEXT_TOKEN_BUDGETS.get(model, DEFAULT_CONTEXT_TOKEN_BUDGET)
+    if estimate_tokens(text) <= budget:
+        return text
+    index = index_for(text)
+    return index.passages(index.select(budget, query=query, seed=seed))
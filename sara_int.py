@@ -1,70 +1,121 @@
 import streamlit_shadcn_ui as ui
 import streamlit as st
-import streamlit_book as stb
-from openai import OpenAI
-from PyPDF2 import PdfReader
-import markdown
-from html2docx import html2docx
-from docx import Document
-import io
-import pdfkit
+import random
 import warnings
-import re  # for extra checking if needed
+import uuid
+import metrics
+from dojo import CompiledQuiz, draw_quiz, keep_quiz, session_quiz
+from hedging import hedged_completion
+from memory_cache import cached
+from llm_client import chat_completion
+from questions import OUTPUT_FORMAT, collect_questions, json_format_instructions, parse_questions, structured_output_kwargs
+from retrieval import build_context
+from streaming import STREAM_DOJO, StreamedQuiz
+from uploads import document_key, read_upload
 
 warnings.filterwarnings("ignore")
 
+# Questions per quiz, and how many requests may be spent getting them
+QUIZ_SIZE = 10
+MAX_ATTEMPTS = 3
 
-@st.cache_resource
-def read_pdf(file):
-    pdf_reader = PdfReader(file)
-    text = ""
-    for page_num in range(len(pdf_reader.pages)):
-        page = pdf_reader.pages[page_num]
-        text += page.extract_text()
-    return text
 
+def trace_session():
+    # Names this session's trace file and tags its metrics events
+    if "trace_session" not in st.session_state:
+        st.session_state.trace_session = uuid.uuid4().hex[:12]
+    return st.session_state.trace_session
 
-@st.cache_resource
-def get_chat_response(user_query):
-    OpenAI_Key = st.secrets["OpenAI_Key"]
-    client = OpenAI(api_key=OpenAI_Key)
 
+def context_seed():
+    # Same passages on every rerun of a session (so the response cache hits), different sections per session
+    if "context_seed" not in st.session_state:
+        st.session_state.context_seed = random.randrange(2**31)
+    return st.session_state.context_seed
+
+
+def output_template(count):
+    """JSON objects in JSON mode, otherwise the "|||" template."""
+    if OUTPUT_FORMAT == "json":
+        return json_format_instructions(count)
+    return (
+        "Question1: <question text> ||| Choice1 ||| Choice2 ||| Choice3 ||| Choice4 ||| <correct index> ||| "
+        "Reason for choice 1 ||| Reason for choice 2 ||| Reason for choice 3 ||| Reason for choice 4\n\n"
+        "An Example if option D is the right answer:\n"
+        "Question1: What is the colour of healthy grass ||| Red ||| Yellow ||| Blue ||| Green ||| 4 ||| "
+        "Healthy grass isn't Red colour ||| Grass is only yellow if it's diseased ||| Its impossible for grass "
+        "to be blue in colour ||| Yes! Grass is indeed Green in colour"
+    )
+
+
+def chat_messages(user_query, count=QUIZ_SIZE):
     message_text = [
         {
             "role": "user",
             "content": (
                 f"You are an expert Quiz Maker who makes thoughtful and fun quizzes. "
-                f"You never give the same type of questions twice. Understand this text and generate for 10 questions, "
-                f"4 possible answers to each question, the correct answer's index (0 to 3 as there are 4 options), "
+                f"You never give the same type of questions twice. Understand this text and generate for {count} questions, "
+                f"4 possible answers to each question, the correct answer's index (1 to 4 as there are 4 options), "
                 f"and its reason for being correct or wrong. Each reason for each of the choices, depending on its correctness, "
                 f"must be provided. I want the Question, Choices, Correct Answer Index and Reasons to be in this format:\n\n"
-                f"Question1: <question text> ||| Choice1 ||| Choice2 ||| Choice3 ||| Choice4 ||| <correct index> ||| "
-                f"Reason for choice 1 ||| Reason for choice 2 ||| Reason for choice 3 ||| Reason for choice 4\n\n"
-                f"An Example if option C is the right answer:\n"
-                f"Question1: What is the colour of healthy grass ||| Red ||| Yellow ||| Blue ||| Green ||| 3 ||| "
-                f"Healthy grass isn't Red colour ||| Grass is only yellow if it's diseased ||| Its impossible for grass "
-                f"to be blue in colour ||| Yes! Grass is indeed Green in colour\n\n"
+                f"{output_template(count)}\n\n"
                 f"Do not give me any other information other than this. STRICTLY follow this template I have specified. "
                 f"I dont want any filler words. DONT MESS THIS UP VERY IMPORTANT!! "
                 f"Use full content of my SOP book: {user_query} . Remember to use my template I have provided."
             )
         }
     ]
+    return message_text
 
-    completion = client.chat.completions.create(
-        model="o1-mini",
-        messages=message_text,
-    )
 
-    filtered_message = completion.choices[0].message.content
+def request_chat_response(user_query, count=QUIZ_SIZE):
+    # A slow or failed completion is hedged down the o1-mini ladder (see hedging.py)
+    filtered_message = hedged_completion(
+        "o1-mini",
+        lambda model: (chat_messages(user_query, count), structured_output_kwargs(model)),
+        lambda text: bool(parse_questions(text, "|||")),
+    )
+    metrics.trace("quiz_response", text=filtered_message)
     return filtered_message
 
 
-@st.cache_resource
-def OpenAI_Filtering_Check(input):
-    OpenAI_Key = st.secrets["OpenAI_Key"]
-    client = OpenAI(api_key=OpenAI_Key)
+@cached("quiz_questions")
+def get_quiz_questions(user_query):
+    """
+    Validated quiz questions for user_query.
+
+    Malformed lines are dropped and only the missing number of questions is
+    requested again, at most MAX_ATTEMPTS requests in total. Only this
+    validated result is cached, never a raw response, so a bad response can't
+    be served again on the next rerun. Raises ValueError when no valid
+    question came back at all, which leaves nothing in the cache.
+    """
+    questions = collect_questions(
+        lambda missing: request_chat_response(user_query, missing),
+        QUIZ_SIZE,
+        delimiter="|||",
+        max_attempts=MAX_ATTEMPTS,
+    )
+    if not questions:
+        raise ValueError(f"No valid questions after {MAX_ATTEMPTS} attempts")
+    return questions
 
+
+def stream_chat_response(user_query):
+    """Yields the text deltas of the quiz completion as they arrive."""
+    stream = chat_completion(
+        model="o1-mini",
+        messages=chat_messages(user_query),
+        stream=True,
+        **structured_output_kwargs("o1-mini"),
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+@cached("explanation", shared=True)
+def OpenAI_Filtering_Check(input):
     message_text = [
         {
             "role": "system",
@@ -76,7 +127,7 @@ def OpenAI_Filtering_Check(input):
         {"role": "user", "content": input}
     ]
 
-    completion = client.chat.completions.create(
+    completion = chat_completion(
         model="gpt-4o-mini",
         messages=message_text,
         temperature=0.2,
@@ -90,48 +141,32 @@ def OpenAI_Filtering_Check(input):
     return filtered_message
 
 
-def parse_questions_text(text):
-    """
-    Parses the API response text.
-
-    Expected format for each question (each on a separate line):
-      QuestionX: <question text> ||| Choice1 ||| Choice2 ||| Choice3 ||| Choice4 ||| <correct index> ||| 
-      Reason for choice 1 ||| Reason for choice 2 ||| Reason for choice 3 ||| Reason for choice 4
+def correct_reason(question):
+    return question.reasons[question.correct_index]
 
-    For each non-empty line:
-      - Splits the line on the delimiter "|||".
-      - Trims extra spaces.
-      - Verifies that exactly 10 parts exist.
-      - Verifies that the correct answer index is a valid number.
 
-    Returns:
-      questions, answer_options, correct_answer_index, reasons
-    """
-    questions = []
-    answer_options = []
-    correct_answer_index = []
-    reasons = []
-
-    for line in text.splitlines():
-        if line.strip():
-            # Split the line using the custom delimiter "|||"
-            parts = [p.strip() for p in line.split("|||") if p.strip()]
-            if len(parts) != 10:
-                raise ValueError(f"Line does not contain exactly 10 parts: {line}")
-            question = parts[0]
-            options = parts[1:5]
-            correct_part = parts[5]
-            if not correct_part.isdigit():
-                raise ValueError(f"Expected a number for the correct answer index but got: {correct_part}")
-            correct_idx = int(correct_part) - 1
-            reason = parts[6:10]
-
-            questions.append(question)
-            answer_options.append(options)
-            correct_answer_index.append(correct_idx)
-            reasons.append(reason)
-
-    return questions, answer_options, correct_answer_index, reasons
+def new_quiz(file):
+    """The quiz for an upload: streamed onto the page, or generated and validated in full when streaming is off."""
+    # Read text from the uploaded file
+    pdf_text = read_upload(file)
+    # Only a token-budgeted selection of SOP passages goes into the prompt
+    with metrics.stage("prompt"):
+        context = build_context(pdf_text, "o1-mini", seed=context_seed())
+
+    if STREAM_DOJO:
+        return StreamedQuiz(
+            lambda: stream_chat_response(context),
+            "|||",
+            OpenAI_Filtering_Check,
+            correct_reason,
+            expected=QUIZ_SIZE,
+            top_up=lambda missing: request_chat_response(context, missing),
+            max_top_ups=MAX_ATTEMPTS - 1,
+        )
+    with metrics.stage("quiz_generate", model="o1-mini"):
+        questions = get_quiz_questions(context)
+    # Explanations are formatted concurrently as the quiz is first drawn
+    return CompiledQuiz(questions, OpenAI_Filtering_Check, correct_reason)
 
 
 st.markdown(
@@ -155,47 +190,30 @@ ui.badges(
     key="badges1"
 )
 
+metrics.start_server()
+metrics.set_session(trace_session())
+
 uploaded_file = st.file_uploader("Upload PDF or DOCX", type=["pdf", "docx", "pptx"], label_visibility="collapsed")
 st.divider()
 
 if uploaded_file is not None:
-    # Read text from the uploaded file
-    pdf_text = read_pdf(uploaded_file)
-
-    # --- Retry loop: call the API and try parsing up to 3 times ---
-    max_attempts = 3
-    attempt = 0
-    parsed_successfully = False
-    response_message = ""
-
-    while attempt < max_attempts and not parsed_successfully:
-        response_message = get_chat_response(pdf_text)
-        print(response_message)  # For debugging: see the actual output
+    # Built on the first run for this upload; later reruns only draw it
+    quiz = session_quiz(document_key(uploaded_file))
+    if quiz is None:
         try:
-            questions, answer_options, correct_answer_index, reasons = parse_questions_text(response_message)
-            parsed_successfully = True  # Parsing succeeded
+            quiz = keep_quiz(document_key(uploaded_file), new_quiz(uploaded_file))
         except Exception as e:
-            attempt += 1
-            st.warning(f"Parsing failed on attempt {attempt}: {e}. Retrying...")
-
-    if not parsed_successfully:
-        st.error("Failed to generate valid questions after 3 attempts. Please try again later.")
-    else:
-        st.success("Questions generated and parsed successfully!")
-        # Display the questions using streamlit_book's single_choice widget
-        for i in range(len(questions)):
-            def check_answer(selected_option, idx=i):
-                # Convert from 1-indexed selected_option to 0-indexed for comparison
-                if selected_option == correct_answer_index[idx] + 1:
-                    return f"{reasons[idx][correct_answer_index[idx]]}"
-                else:
-                    return f"Option {selected_option}: {reasons[idx][selected_option - 1]}"
-
-            stb.single_choice(
-                questions[i],
-                answer_options[i],
-                correct_answer_index[i] + 1,
-                success=OpenAI_Filtering_Check(check_answer(correct_answer_index[i] + 1)),
-                error="Wrong Answer 😒 \n Please try again",
-                button="Check answer"
-            )
+            st.error(f"Failed to generate valid questions after {MAX_ATTEMPTS} attempts: {e}. Please try again later.")
+
+    if isinstance(quiz, CompiledQuiz):
+        if len(quiz.questions) < QUIZ_SIZE:
+            st.warning(f"Only {len(quiz.questions)} of {QUIZ_SIZE} questions could be generated.")
+        else:
+            st.success("Questions generated and parsed successfully!")
+
+    if quiz is not None:
+        # Each question is drawn as soon as it has streamed in (or its explanation is formatted), in its own fragment
+        draw_quiz(quiz)
+
+        if quiz.error and not quiz.questions:
+            st.error("Failed to generate valid questions. Please try again later.")
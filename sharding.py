@@ -0,0 +1,88 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from dedupe import DuplicateIndex
+
+# Questions requested per shard, and how many shards run against the API at once
+SHARD_SIZE = int(os.environ.get("SARA_SHARD_SIZE", "10"))
+SHARD_CONCURRENCY = int(os.environ.get("SARA_SHARD_CONCURRENCY", "4"))
+# Extra rounds for the questions lost to failed shards or duplicates
+SHARD_TOPUP_ROUNDS = int(os.environ.get("SARA_SHARD_TOPUP_ROUNDS", "1"))
+
+
+def plan_shards(quantity, shard_size=SHARD_SIZE):
+    """Splits quantity into per-shard question counts, e.g. 25 -> [9, 8, 8] for a shard size of 10."""
+    shards = max(1, -(-quantity // shard_size))
+    base, extra = divmod(quantity, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+def _shard_chunk_ids(chunk_count, shards):
+    if chunk_count <= shards:
+        # Small document: every shard sees all of it
+        return [range(chunk_count) for _ in range(shards)]
+    # Contiguous slices of the document, one per shard
+    bounds = [round(i * chunk_count / shards) for i in range(shards + 1)]
+    return [range(bounds[i], bounds[i + 1]) for i in range(shards)]
+
+
+def generate_sharded(generate_shard, index, quantity, token_budget, shard_size=SHARD_SIZE,
+                     max_workers=SHARD_CONCURRENCY, on_progress=None, seed=None, should_stop=None):
+    """
+    Generates quantity questions as concurrent shards and merges them into one exam.
+
+    generate_shard(context, count) must return a list of Question for count
+    questions about context. Each shard gets its own slice of the document
+    (index is a retrieval.ChunkIndex) and a slice of the quantity. Results are
+    merged in document order, near-duplicates are dropped (see dedupe.py),
+    and the shortfall from failed shards or duplicates is topped up by
+    further rounds. on_progress(done, total) is called from the calling
+    thread after every finished shard, so it may update Streamlit widgets. Once
+    should_stop() returns true, shards that haven't started are dropped and
+    no further rounds run.
+
+    Returns at most quantity questions, fewer only if every round came up short.
+    """
+    rng = random.Random(seed)
+    merged = []
+    seen = DuplicateIndex()
+    done = 0
+    total = 0
+
+    for round_number in range(1 + SHARD_TOPUP_ROUNDS):
+        missing = quantity - len(merged)
+        if missing <= 0 or (should_stop and should_stop()):
+            break
+
+        counts = plan_shards(missing, shard_size)
+        slices = _shard_chunk_ids(len(index), len(counts))
+        # Top-up rounds look at the slices in a different order so they don't repeat the first round
+        if round_number:
+            rng.shuffle(slices)
+        contexts = [index.passages(index.select(token_budget, seed=rng.random(), chunk_ids=ids)) for ids in slices]
+        total += len(counts)
+
+        results = [[] for _ in counts]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(counts))), thread_name_prefix="sara-shard") as pool:
+            task = metrics.bind(generate_shard)
+            futures = {pool.submit(task, context, count): i for i, (context, count) in enumerate(zip(contexts, counts))}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()[:counts[i]]
+                except Exception as e:
+                    print(f"Shard {i + 1}/{len(counts)} failed: {e}")
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+                if should_stop and should_stop():
+                    for pending in futures:
+                        pending.cancel()
+
+        for shard_questions in results:
+            merged.extend(seen.filter(shard_questions))
+
+    return merged[:quantity]
+
@@ -0,0 +1,239 @@
+"""
+State shared by several app replicas: cached text and Test Mode jobs.
+
+Each Streamlit replica behind a load balancer keeps its own in-memory
+caches and job queue, so a user routed to another replica pays for the
+same extraction and generation again and can't see their exam job. With
+SARA_SHARED_STORE pointing at a SQLite file every replica opens, cached
+text (extracted documents, model responses) and job records go there as
+well. Each replica still answers from its own memory first; the store is
+the tier behind it. A value one replica is computing is waited for by the
+others instead of being computed again (a lease per key).
+
+WAL mode needs every process on the same host (it uses shared memory);
+for a volume mounted by several hosts set SARA_SHARED_STORE_WAL=0, which
+falls back to SQLite's rollback journal and the volume's file locks.
+The question bank is shared the same way by pointing SARA_QUESTION_BANK
+at one path.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import metrics
+
+SHARED_STORE_PATH = os.environ.get("SARA_SHARED_STORE", "")
+SHARED_STORE_WAL = os.environ.get("SARA_SHARED_STORE_WAL", "1") != "0"
+# Cached text may use this much of the store, least recently used entries go first
+SHARED_STORE_MAX_BYTES = int(float(os.environ.get("SARA_SHARED_STORE_MAX_MB", "1024")) * 1024 * 1024)
+# How long another replica waits for a value being computed before computing it itself
+LEASE_SECONDS = float(os.environ.get("SARA_SHARED_LEASE_SECONDS", "150"))
+LEASE_POLL_SECONDS = 0.2
+# A hit refreshes an entry's last use at most this often, so hot keys don't write on every read
+TOUCH_SECONDS = 60
+
+# This process, as recorded on the jobs it runs
+REPLICA = f"{socket.gethostname()}:{os.getpid()}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used_at);
+CREATE TABLE IF NOT EXISTS leases (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    description TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress REAL NOT NULL,
+    message TEXT NOT NULL,
+    result TEXT,
+    data BLOB,
+    created REAL NOT NULL,
+    finished REAL,
+    replica TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+JOB_COLUMNS = ("id", "owner", "description", "state", "progress", "message", "result", "data", "created", "finished",
+               "replica", "cancel_requested")
+
+
+class SharedStore:
+    """
+    Text entries and job records in one SQLite file used by every replica.
+
+    Entries are (namespace, key) -> text, with an optional expiry; once the
+    entries pass max_bytes the least recently used are deleted. Hits and
+    misses are counted per namespace for this process.
+    """
+
+    def __init__(self, path, max_bytes=SHARED_STORE_MAX_BYTES, wal=SHARED_STORE_WAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.wal = wal
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, so each thread gets its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            if self.wal:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, namespace, key):
+        with self._lock:
+            stats = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "waits": 0, "puts": 0, "evictions": 0})
+            stats[key] += 1
+
+    def get(self, namespace, key, record=True):
+        """The text stored under key, or None."""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, used_at FROM entries WHERE namespace = ? AND key = ? AND (expires_at = 0 OR expires_at > ?)",
+            (namespace, key, now),
+        ).fetchone()
+        if row is not None and row[1] < now - TOUCH_SECONDS:
+            conn.execute("UPDATE entries SET used_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+        if record:
+            self._count(namespace, "hits" if row is not None else "misses")
+            metrics.cache_result(f"shared_{namespace}", hit=row is not None)
+        return row[0] if row is not None else None
+
+    def put(self, namespace, key, value, ttl=0):
+        self.put_many(namespace, [(key, value)], ttl)
+
+    def put_many(self, namespace, items, ttl=0):
+        """Stores (key, text) pairs in one transaction."""
+        now = time.time()
+        rows = [(namespace, key, value, len(value.encode("utf-8")), now, now + ttl if ttl else 0) for key, value in items]
+        if not rows:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, used_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+        for _ in rows:
+            self._count(namespace, "puts")
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Oldest first until we are back under budget; expired entries count as the oldest
+        doomed = []
+        for rowid, namespace, size in conn.execute(
+                "SELECT rowid, namespace, size FROM entries ORDER BY expires_at != 0 AND expires_at < ? DESC, used_at",
+                (time.time(),)):
+            if total <= self.max_bytes:
+                break
+            doomed.append((rowid,))
+            total -= size
+            self._count(namespace, "evictions")
+        conn.executemany("DELETE FROM entries WHERE rowid = ?", doomed)
+
+    def _claim(self, namespace, key):
+        # A lease tells the other replicas this one is computing the key; an expired one is taken over
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT expires_at FROM leases WHERE namespace = ? AND key = ?",
+                               (namespace, key)).fetchone()
+            if row is not None and row[0] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (namespace, key, owner, expires_at) VALUES (?, ?, ?, ?)",
+                         (namespace, key, REPLICA, now + LEASE_SECONDS))
+            return True
+
+    def _release(self, namespace, key):
+        self._connect().execute("DELETE FROM leases WHERE namespace = ? AND key = ? AND owner = ?",
+                                (namespace, key, REPLICA))
+
+    def get_or_compute(self, namespace, key, compute, ttl=0):
+        """
+        The stored text, or compute()'s result, which is stored.
+
+        While another replica computes the same key this one waits for its
+        result; if that replica fails or its lease runs out, this one
+        computes it instead. compute() must return a str.
+        """
+        value = self.get(namespace, key)
+        while value is None:
+            if self._claim(namespace, key):
+                try:
+                    value = compute()
+                    self.put(namespace, key, value, ttl)
+                finally:
+                    self._release(namespace, key)
+                break
+            time.sleep(LEASE_POLL_SECONDS)
+            value = self.get(namespace, key, record=False)
+            if value is not None:
+                self._count(namespace, "waits")
+        return value
+
+    def save_job(self, record):
+        """Inserts or updates a job record, a dict with JOB_COLUMNS; cancel_requested is kept as it is."""
+        columns = [c for c in JOB_COLUMNS if c != "cancel_requested"]
+        self._connect().execute(
+            f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+            f" ON CONFLICT (id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns[1:])}",
+            [record[c] for c in columns],
+        )
+
+    def load_job(self, job_id):
+        row = self._connect().execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row is not None else None
+
+    def request_job_cancel(self, job_id):
+        self._connect().execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+
+    def job_cancel_requested(self, job_id):
+        row = self._connect().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def purge_jobs(self, finished_before):
+        self._connect().execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (finished_before,))
+
+    def stats(self):
+        with self._lock:
+            per_namespace = {namespace: dict(stats) for namespace, stats in self._stats.items()}
+        for stats in per_namespace.values():
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return per_namespace
+
+
+# None unless SARA_SHARED_STORE is set: a single replica has nothing to share
+shared_store = SharedStore(SHARED_STORE_PATH) if SHARED_STORE_PATH else None
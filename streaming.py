@@ -0,0 +1,139 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from dedupe import DuplicateIndex
+from explanations import EXPLANATION_CONCURRENCY, explanation_task
+from questions import JsonQuestionParser, parse_question_line, salvage_questions
+
+# Stream Dojo questions onto the page as they are generated instead of waiting for the full response
+STREAM_DOJO = os.environ.get("SARA_STREAM_DOJO", "1") == "1"
+
+
+def iter_streamed_questions(deltas, delimiter=" | "):
+    """
+    Turns a stream of completion text deltas into parsed questions.
+
+    JSON question objects are yielded as soon as they close; delimited
+    questions as soon as their line is complete (the newline after it
+    arrives, or the stream ends). Malformed questions are skipped.
+    """
+    json_parser = JsonQuestionParser()
+    pending = ""
+    for delta in deltas:
+        if not delta:
+            continue
+        yield from json_parser.feed(delta)
+        pending += delta
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            question = _parse_pipe_line(line, delimiter)
+            if question is not None:
+                yield question
+    question = _parse_pipe_line(pending, delimiter)
+    if question is not None:
+        yield question
+
+
+def _parse_pipe_line(line, delimiter):
+    # Lines that are part of a JSON object belong to the JSON parser
+    if not line.strip() or "{" in line or "}" in line:
+        return None
+    return parse_question_line(line, delimiter)
+
+
+class StreamedQuiz:
+    """
+    A Dojo quiz being streamed from the model on a background thread.
+
+    start_stream() is called on the worker thread and must return an iterable
+    of text deltas. Every parsed question's explanation is handed to
+    format_fn straight away, so formatting overlaps with generation.
+    Near-duplicates of earlier questions in the quiz are skipped, and so are
+    questions accept(question) turns down, e.g. ones asked on an earlier
+    visit. If expected is set and malformed lines or duplicates left the quiz
+    short, top_up(missing) is asked for just the missing questions: response
+    text to parse (and check), or a list of questions to add as they are.
+
+    The object lives in st.session_state: a rerun in the middle of
+    generation keeps consuming the same stream instead of starting a new one.
+    """
+
+    def __init__(self, start_stream, delimiter, format_fn, explanation_input, expected=None, top_up=None, max_top_ups=2,
+                 accept=None):
+        self.delimiter = delimiter
+        self.format_fn = format_fn
+        self.explanation_input = explanation_input
+        self.expected = expected
+        self.top_up = top_up
+        self.max_top_ups = max_top_ups
+        self.accept = accept
+        self.questions = []
+        self._seen = DuplicateIndex()
+        self.error = None
+        self.done = False
+        self._explanations = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=metrics.bind(self._run), args=(start_stream,), name="sara-stream", daemon=True)
+        self._thread.start()
+
+    def _run(self, start_stream):
+        pool = ThreadPoolExecutor(max_workers=EXPLANATION_CONCURRENCY, thread_name_prefix="sara-explain")
+        self._format = explanation_task(self.format_fn)
+        try:
+            with metrics.stage("dojo_stream"):
+                for question in iter_streamed_questions(start_stream(), self.delimiter):
+                    self._add(question, pool)
+
+            # Make up for malformed lines and duplicates with small follow-ups instead of a new stream
+            if self.expected and self.top_up:
+                for _ in range(self.max_top_ups):
+                    missing = self.expected - len(self.questions)
+                    if missing <= 0:
+                        break
+                    supplied = self.top_up(missing)
+                    if isinstance(supplied, str):
+                        for question in salvage_questions(supplied, self.delimiter)[0][:missing]:
+                            self._add(question, pool)
+                    else:
+                        for question in supplied[:missing]:
+                            self._add(question, pool, check=False)
+        except Exception as e:
+            print(f"Question stream failed: {e}")
+            self.error = e
+        finally:
+            pool.shutdown(wait=False)
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def _add(self, question, pool, check=True):
+        new = self._seen.add(question)
+        if check and (not new or (self.accept and not self.accept(question))):
+            return
+        future = pool.submit(self._format, self.explanation_input(question))
+        with self._cond:
+            self.questions.append(question)
+            self._explanations.append(future)
+            self._cond.notify_all()
+
+    def explanation(self, i):
+        # The formatted explanation if it is ready, otherwise the raw reasons so the widget can draw now
+        future = self._explanations[i]
+        if future.done() and future.exception() is None:
+            return future.result()
+        return self.explanation_input(self.questions[i])
+
+    def __iter__(self):
+        """Yields (question, explanation) in order, blocking until the next question has streamed in."""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.questions) and not self.done:
+                    self._cond.wait()
+                if i >= len(self.questions):
+                    return
+                question = self.questions[i]
+            yield question, self.explanation(i)
+            i += 1
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedupe import DuplicateIndex  # noqa: E402
+from questions import Question  # noqa: E402
+
+DRUGS = ["Adrenaline", "Aspirin", "Salbutamol", "GTN"]
+
+
+def question(text, options=DRUGS):
+    return Question(question=text, options=list(options), correct_index=0, reasons=["" for _ in options])
+
+
+class DuplicateIndexTest(unittest.TestCase):
+    def test_reworded_question_with_shuffled_options_is_a_duplicate(self):
+        index = DuplicateIndex()
+        self.assertTrue(index.add(question("Which drug is given first for anaphylaxis in an adult casualty?")))
+
+        self.assertFalse(index.add(question("Question 3 - Which drug should be given first for anaphylaxis in an adult "
+                                            "casualty?", DRUGS[::-1])))
+
+    def test_near_duplicate_text_with_different_options_is_kept(self):
+        index = DuplicateIndex()
+        index.add(question("Which drug is given first for anaphylaxis in an adult casualty?"))
+
+        # Nearly the same stem, but a different set of choices asks something else
+        self.assertTrue(index.add(question("Which drug should be given first for anaphylaxis in an adult casualty?",
+                                           ["Oxygen", "Glucose gel", "Naloxone", "Entonox"])))
+
+    def test_short_questions_over_one_option_set_are_kept(self):
+        index = DuplicateIndex()
+        added = [index.add(question(f"Which drug is given for {condition}?"))
+                 for condition in ("anaphylaxis", "asthma", "chest pain")]
+
+        self.assertEqual(added, [True, True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import CANCELLED, DONE, JobQueue  # noqa: E402
+
+TIMEOUT = 10
+
+
+def wait_until_finished(job):
+    for _ in range(TIMEOUT * 100):
+        if not job.active:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"job still {job.state} after {TIMEOUT}s")
+
+
+class CancelQueuedJobTest(unittest.TestCase):
+    def test_worker_survives_a_cancelled_queued_job(self):
+        queue = JobQueue(workers=1, store=None)
+        release = threading.Event()
+        first = queue.submit("a", lambda job: release.wait(TIMEOUT))
+        waiting = queue.submit("b", lambda job: "never runs")
+
+        queue.cancel(waiting.id)
+        release.set()
+        wait_until_finished(first)
+        later = queue.submit("c", lambda job: "ran")
+        wait_until_finished(later)
+
+        self.assertEqual(waiting.state, CANCELLED)
+        self.assertEqual((later.state, later.result), (DONE, "ran"))
+
+    def test_owner_cancelling_its_only_queued_job_can_submit_again(self):
+        queue = JobQueue(workers=1, store=None)
+        started, release = threading.Event(), threading.Event()
+        first = queue.submit("a", lambda job: started.set() or release.wait(TIMEOUT))
+        started.wait(TIMEOUT)
+        waiting = queue.submit("b", lambda job: "never runs")
+
+        queue.cancel(waiting.id)
+        again = queue.submit("b", lambda job: "ran")
+        self.assertEqual(queue.queued_ahead(again), 0)
+        release.set()
+        wait_until_finished(first)
+        wait_until_finished(again)
+
+        self.assertEqual((again.state, again.result), (DONE, "ran"))
+
+
+if __name__ == "__main__":
+    unittest.main()
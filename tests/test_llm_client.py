@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_client  # noqa: E402
+
+TPM = 100000
+MESSAGES = [{"role": "user", "content": "make one question"}]
+
+
+def failing_client(error):
+    def create(**kwargs):
+        raise error
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+class TokenRefundTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = llm_client.RateLimitScheduler({"test-model": (1000, TPM)})
+        for target, value in (("scheduler", self.scheduler), ("backoff_delay", lambda *args: 0)):
+            patcher = mock.patch.object(llm_client, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tokens_left(self):
+        bucket = self.scheduler._buckets_for("test-model")[1]
+        bucket._refill(bucket.updated)
+        return bucket.level
+
+    def call(self, error):
+        with mock.patch.object(llm_client, "get_client", lambda: failing_client(error)):
+            with self.assertRaises(type(error)):
+                llm_client.chat_completion("test-model", MESSAGES)
+
+    def test_retried_failures_give_their_tokens_back(self):
+        self.call(openai.APIConnectionError(request=httpx.Request("POST", "http://mock/v1/chat/completions")))
+
+        # Without refunds MAX_ATTEMPTS estimates (over 3000 tokens each) would still be taken
+        self.assertEqual(self.tokens_left(), TPM)
+
+    def test_non_retryable_failure_gives_its_tokens_back(self):
+        self.call(ValueError("bad request"))
+
+        self.assertEqual(self.tokens_left(), TPM)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+import unittest
+from collections import Counter
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import question_bank  # noqa: E402
+from question_bank import PregenWorker  # noqa: E402
+
+TIMEOUT = 10
+TARGET = 5
+EMPTY = ("empty-doc", "EMT", "Dojo")
+FULL = ("full-doc", "EMT", "Dojo")
+
+
+class FakeBank:
+    """Counts stocked questions per key; every generated question is new."""
+
+    def __init__(self):
+        self.stocked = Counter()
+        self.lock = threading.Lock()
+
+    def stock(self, *key):
+        with self.lock:
+            return self.stocked[key]
+
+    def unique(self, *key_and_questions):
+        return key_and_questions[-1]
+
+    def add(self, *key_and_questions):
+        *key, questions = key_and_questions
+        with self.lock:
+            self.stocked[tuple(key)] += len(questions)
+        return len(questions)
+
+
+def wait_for(condition):
+    done = threading.Event()
+    for _ in range(TIMEOUT * 100):
+        if condition():
+            return
+        done.wait(0.01)
+    raise AssertionError("condition not met in time")
+
+
+class PregenBackoffTest(unittest.TestCase):
+    def setUp(self):
+        self.bank = FakeBank()
+        self.worker = PregenWorker(self.bank, target=TARGET)
+        self.calls = Counter()
+
+    def generate(self, key):
+        def generate_fn(wanted):
+            self.calls[key] += 1
+            # One question per call from FULL, so it takes several rounds to fill; nothing ever from EMPTY
+            return ["question"] if key == FULL else []
+        return generate_fn
+
+    def register(self, key):
+        self.worker.register(*key, self.generate(key))
+
+    def test_backed_off_key_does_not_hold_up_another(self):
+        with mock.patch.object(question_bank, "PREGEN_POLL_SECONDS", 5):
+            self.register(EMPTY)
+            self.register(FULL)
+            wait_for(lambda: self.bank.stock(*FULL) == TARGET)
+
+        # FULL was topped up round after round while EMPTY waited out its first backoff
+        self.assertEqual(self.calls[FULL], TARGET)
+        self.assertEqual(self.calls[EMPTY], 1)
+
+    def test_key_is_dropped_after_empty_rounds_until_registered_again(self):
+        with mock.patch.object(question_bank, "PREGEN_POLL_SECONDS", 0.01), \
+                mock.patch.object(question_bank, "PREGEN_MAX_EMPTY_ROUNDS", 3):
+            self.register(EMPTY)
+            wait_for(lambda: EMPTY not in self.worker._wanted)
+            self.assertEqual(self.calls[EMPTY], 3)
+
+            self.register(EMPTY)
+            wait_for(lambda: self.calls[EMPTY] > 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from questions import salvage_questions  # noqa: E402
+
+PIPE_LINE = "What is the colour of healthy grass | Red | Yellow | Blue | Green | 4 | No | No | No | Yes"
+
+
+class SalvageQuestionsTest(unittest.TestCase):
+    def test_pipe_response_with_braces_keeps_its_questions(self):
+        valid, rejected = salvage_questions(PIPE_LINE + "\nSee section {3.2} of the SOP {annex}")
+
+        self.assertEqual([q.question for q in valid], ["What is the colour of healthy grass"])
+        self.assertEqual(valid[0].correct_index, 3)
+        self.assertEqual(rejected, ["See section {3.2} of the SOP {annex}"])
+
+    def test_broken_json_response_is_reported_as_json(self):
+        valid, rejected = salvage_questions('{"question": "Only a stem"}')
+
+        self.assertEqual(valid, [])
+        self.assertEqual(rejected, ["<invalid JSON question>"])
+
+
+if __name__ == "__main__":
+    unittest.main()
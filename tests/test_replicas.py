@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TIMEOUT = 60
+DOCUMENT = b"Standard operating procedure for anaphylaxis: give adrenaline."
+
+
+def replica(role, env, start, job_ids, release, results):
+    try:
+        results.put((role, run_replica(role, env, start, job_ids, release)))
+    except Exception as e:
+        # Reported instead of leaving the test waiting for a result that never comes
+        release.set()
+        results.put((role, {"error": repr(e)}))
+
+
+def run_replica(role, env, start, job_ids, release):
+    # Settings are read when the app's modules are imported, so the environment goes first
+    os.environ.update(env)
+    from extract_cache import extraction_cache
+    from jobs import job_queue
+    from question_bank import question_bank
+    from questions import Question
+
+    extracted = []
+
+    def extract(data):
+        extracted.append(data)
+        time.sleep(0.5)  # long enough for the other replica to ask for the same upload meanwhile
+        return data.decode("utf-8")
+
+    start.wait(TIMEOUT)
+    text = extraction_cache.get_or_extract(DOCUMENT, extract, "test")
+    report = {"extracted": len(extracted), "text": text}
+
+    if role == "runner":
+        question_bank.add("doc", "EMT", "Easy", [
+            Question(question="Which drug is given for anaphylaxis?", options=["Adrenaline", "Aspirin", "GTN", "Salbutamol"],
+                     correct_index=0, reasons=["Yes", "No", "No", "No"]),
+        ])
+        job = job_queue.submit("session", lambda job: release.wait(TIMEOUT) and {"questions": 1, "data": b"exam"},
+                               description="exam")
+        job_ids.put(job.id)
+        while job.active:
+            time.sleep(0.05)
+        report["state"] = job.state
+    else:
+        job = job_queue.get(job_ids.get(timeout=TIMEOUT))
+        report.update(remote=job.remote, seen_active=job.active, stock=question_bank.stock("doc", "EMT", "Easy"))
+        release.set()
+        deadline = time.monotonic() + TIMEOUT
+        while job.active and time.monotonic() < deadline:
+            time.sleep(0.1)
+            job = job_queue.latest(job)
+        report.update(state=job.state, result=job.result)
+    return report
+
+
+class SharedStoreReplicasTest(unittest.TestCase):
+    def setUp(self):
+        self.state = tempfile.mkdtemp(prefix="sara-test-replicas-")
+        self.addCleanup(shutil.rmtree, self.state, ignore_errors=True)
+
+    def test_two_replicas_share_extractions_bank_and_jobs(self):
+        env = {
+            "SARA_SHARED_STORE": os.path.join(self.state, "shared.sqlite3"),
+            "SARA_QUESTION_BANK": os.path.join(self.state, "bank.sqlite3"),
+            "SARA_EXTRACT_CACHE_DIR": os.path.join(self.state, "extract"),
+            "SARA_METRICS_PORT": "0",
+        }
+        ctx = multiprocessing.get_context("spawn")
+        start, release = ctx.Barrier(2), ctx.Event()
+        job_ids, results = ctx.Queue(), ctx.Queue()
+        processes = [ctx.Process(target=replica, args=(role, env, start, job_ids, release, results))
+                     for role in ("runner", "follower")]
+        for process in processes:
+            process.start()
+        try:
+            reports = dict(results.get(timeout=TIMEOUT) for _ in processes)
+        finally:
+            for process in processes:
+                process.join(TIMEOUT)
+
+        runner, follower = reports["runner"], reports["follower"]
+        self.assertNotIn("error", runner)
+        self.assertNotIn("error", follower)
+        # The upload was extracted once between the two replicas
+        self.assertEqual(runner["extracted"] + follower["extracted"], 1)
+        self.assertEqual(runner["text"], follower["text"])
+        self.assertEqual(follower["stock"], 1)
+        # The follower found the runner's job through the store while it ran, and saw it finish
+        self.assertTrue(follower["remote"])
+        self.assertTrue(follower["seen_active"])
+        self.assertEqual((runner["state"], follower["state"]), ("done", "done"))
+        self.assertEqual(follower["result"], {"questions": 1, "data": b"exam"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+"""
+Uploaded documents in a Streamlit session, shared by app.py and sara_int.py.
+
+An upload is hashed once per session, and its text is read once per
+content hash through the memory cache and the extraction cache behind it.
+"""
+import streamlit as st
+
+from extractors import document_kind
+from memory_cache import HashedText, cached
+from pipeline import read_document
+from question_bank import document_hash
+
+
+def document_key(file):
+    # Hash each upload once per session instead of on every rerun
+    hashes = st.session_state.setdefault("document_hashes", {})
+    if file.file_id not in hashes:
+        hashes[file.file_id] = document_hash(file.getvalue())
+    return hashes[file.file_id]
+
+
+@cached("read_document", key=lambda doc_hash, file, on_read=None: doc_hash)
+def read_document_text(doc_hash, file, on_read=None):
+    data = file.getvalue()
+    text = read_document(data, document_kind(file.name, data))
+    if on_read is not None:
+        on_read(file, doc_hash, text)
+    # Carries its digest along, so caches and indexes keyed on the text don't rehash megabytes of it
+    return HashedText(text, doc_hash)
+
+
+def read_upload(file, on_read=None):
+    """The upload's text; on_read(file, doc_hash, text) runs only when it is read, not on reruns that hit the cache."""
+    return read_document_text(document_key(file), file, on_read=on_read)
@@ -0,0 +1,180 @@
+"""
+Versions of an uploaded SOP, and which of its sections changed between them.
+
+A document's text is split into content-defined sections (see
+split_sections()) whose hashes are stored next to the question bank. When
+an upload has the same file name as an earlier one and shares enough of
+its sections, it is recorded as that document's next version: questions
+about sections that are still there carry over to the new version, those
+about removed or rewritten sections are retired, and only the new
+sections need fresh questions.
+"""
+import hashlib
+import os
+import time
+
+from question_bank import question_bank
+from retrieval import ChunkIndex
+
+# Average words per section; sections are between a quarter and four times this long
+SECTION_WORDS = int(os.environ.get("SARA_SECTION_WORDS", "300"))
+# An upload only counts as a revision of the previous one with its name if it keeps this share of its sections
+MIN_SHARED_SECTIONS = float(os.environ.get("SARA_VERSION_MIN_SHARED", "0.3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS document_versions (
+    doc_hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    previous_hash TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS document_versions_name ON document_versions (name, created_at);
+CREATE TABLE IF NOT EXISTS document_sections (
+    doc_hash TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    section_hash TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (doc_hash, position)
+);
+"""
+
+
+def _line_hash(line):
+    return int.from_bytes(hashlib.blake2b(line.encode("utf-8"), digest_size=8).digest(), "big") / 2**64
+
+
+def split_sections(text, target_words=SECTION_WORDS):
+    """
+    Splits text into (section_hash, section_text) pairs at content-defined boundaries.
+
+    Whether a line ends a section depends on the line's own text (and a
+    minimum section length), not on its position, so an edit only moves the
+    boundaries next to it: the sections before and after keep their hashes
+    even when the edit shifts everything after it to other pages.
+    """
+    min_words = max(1, target_words // 4)
+    max_words = target_words * 4
+    sections = []
+    lines = []
+    words = 0
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        lines.append(line)
+        line_words = len(line.split())
+        words += line_words
+        # Each line ends a section with a chance proportional to its length, so sections average target_words
+        if words >= max_words or (words >= min_words and _line_hash(line) < line_words / (target_words - min_words)):
+            sections.append(_section(lines))
+            lines = []
+            words = 0
+    if lines:
+        sections.append(_section(lines))
+    return sections
+
+
+def _section(lines):
+    text = "\n".join(lines)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest(), text
+
+
+class VersionUpdate:
+    """What changed from previous_hash to doc_hash: section hashes kept and removed, and the new sections' text."""
+
+    def __init__(self, name, previous_hash, doc_hash, kept, removed, added):
+        self.name = name
+        self.previous_hash = previous_hash
+        self.doc_hash = doc_hash
+        self.kept = kept
+        self.removed = removed
+        self.added = added
+
+    @property
+    def added_text(self):
+        return "\n".join(self.added)
+
+
+class DocumentVersions:
+    """Document versions and their sections, in the question bank's database."""
+
+    def __init__(self, bank=question_bank):
+        self.bank = bank
+        self.bank._connect().executescript(SCHEMA)
+
+    def sections(self, doc_hash):
+        rows = self.bank._connect().execute(
+            "SELECT section_hash, text FROM document_sections WHERE doc_hash = ? ORDER BY position", (doc_hash,)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def register(self, name, doc_hash, text):
+        """
+        Records text as a version of the document called name.
+
+        Returns a VersionUpdate against the previous version with that name,
+        or None for an already known version or an unrelated document.
+        """
+        conn = self.bank._connect()
+        if conn.execute("SELECT 1 FROM document_versions WHERE doc_hash = ?", (doc_hash,)).fetchone():
+            return None
+        sections = split_sections(text)
+        new_hashes = {section_hash for section_hash, _ in sections}
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Checked again under the write lock, another session or process may have registered it meanwhile
+            if conn.execute("SELECT 1 FROM document_versions WHERE doc_hash = ?", (doc_hash,)).fetchone():
+                return None
+            row = conn.execute(
+                "SELECT doc_hash FROM document_versions WHERE name = ? ORDER BY created_at DESC LIMIT 1", (name,)
+            ).fetchone()
+            previous_hash = row[0] if row else None
+            old_hashes = {h for (h,) in conn.execute(
+                "SELECT section_hash FROM document_sections WHERE doc_hash = ?", (previous_hash,))}
+            kept = old_hashes & new_hashes
+            if previous_hash and len(kept) < MIN_SHARED_SECTIONS * len(old_hashes):
+                # Same file name, different document
+                previous_hash = None
+            conn.execute("INSERT INTO document_versions (doc_hash, name, previous_hash, created_at) VALUES (?, ?, ?, ?)",
+                         (doc_hash, name, previous_hash, time.time()))
+            conn.executemany("INSERT INTO document_sections (doc_hash, position, section_hash, text) VALUES (?, ?, ?, ?)",
+                             [(doc_hash, i, h, section_text) for i, (h, section_text) in enumerate(sections)])
+
+        if previous_hash is None:
+            return None
+        added = [section_text for h, section_text in sections if h not in old_hashes]
+        return VersionUpdate(name, previous_hash, doc_hash, kept, old_hashes - new_hashes, added)
+
+    def tag_questions(self, doc_hash):
+        """Tags the document's untagged bank questions with the section that best matches them."""
+        untagged = self.bank.untagged(doc_hash)
+        sections = self.sections(doc_hash)
+        if not untagged or not sections:
+            return 0
+        index = ChunkIndex("", chunks=[section_text for _, section_text in sections])
+        tags = []
+        for row_id, question in untagged:
+            query = " ".join([question.question, question.options[question.correct_index],
+                              question.reasons[question.correct_index]])
+            best = index.search(query, top_k=1)
+            if best:
+                tags.append((row_id, sections[best[0]][0]))
+        self.bank.tag_sections(tags)
+        return len(tags)
+
+    def migrate_questions(self, update):
+        """
+        Carries the previous version's questions about kept sections over to the new version.
+
+        Questions about removed sections are retired. Returns (carried,
+        retired), each a count per (mode, difficulty).
+        """
+        # Questions are tagged lazily, only for documents that actually get a new version
+        self.tag_questions(update.previous_hash)
+        carried = self.bank.carry_over(update.previous_hash, update.doc_hash, update.kept)
+        retired = self.bank.retire(update.previous_hash, update.removed)
+        return carried, retired
+
+
+document_versions = DocumentVersions()